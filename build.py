@@ -8,9 +8,12 @@ import signal
 from rich.console import Console
 from rich.panel import Panel
 from rich.markdown import Markdown
+from rich.text import Text
 from echr.utils.build import prepare_build, remove_lock, append_history, add_build_info
+from echr.utils.cache import StepCache, is_cacheable
 from echr.utils.cli import strfdelta, TAB
 from echr.utils.logger import getlogger, serialize_console_logs
+from echr.utils.scheduler import run_workflow, run_step_in_process
 
 OSF_DST = 'test'
 BUILD_PATH = './build'
@@ -53,23 +56,79 @@ def main(args):
             step_delta = step_stop_time - step_start_time
             print('\n[blue]🕑 Step executed in {}'.format(strfdelta(step_delta, "{hours}h {minutes}min {seconds}s")))
 
-    start_time = datetime.now()
-    for i, step_info in enumerate(workflow_steps):
+    def get_step_args(step_info):
         step_args = step_info.get('args', {})
         if step_info.get('updatable', False) and update:
             step_args['update'] = True
         if force:
             step_args['force'] = True
+        return step_args
+
+    cache = None if force or args.no_cache else StepCache(args.build)
+    cache_keys = {}
+
+    def is_up_to_date(i):
+        step_info = workflow_steps[i]
+        if cache is None or not is_cacheable(step_info):
+            return False
+        cache_keys[i] = cache.step_key(step_info, doc_ids)
+        return cache.is_up_to_date(step_info, cache_keys[i])
+
+    def store_in_cache(i):
+        if i in cache_keys:
+            cache.store(workflow_steps[i], cache_keys[i])
+
+    def print_skipped_step(i):
+        title = workflow_steps[i].get('title', 'Untitled')
+        print(Panel('[bold yellow] {}'.format(title.upper()), title='STEP {}.'.format(i)))
+        print(TAB + '> Inputs, arguments and outputs unchanged since the last execution. [green]Skip the step.')
+
+    def step_task(i):
+        step_info = workflow_steps[i]
+        if is_up_to_date(i):
+            return None
+        return run_step_in_process, (step_info.get('run'), args.build, step_info.get('title', 'Untitled'), doc_ids,
+                                     get_step_args(step_info), console.width)
+
+    def step_started(i):
+        print(TAB + '> Start step {}. {}'.format(i, workflow_steps[i].get('title', 'Untitled')))
+
+    def step_done(i, result):
+        if result.get('skipped'):
+            print_skipped_step(i)
+            return
+        title = workflow_steps[i].get('title', 'Untitled')
+        print(Panel('[bold yellow] {}'.format(title.upper()), title='STEP {}.'.format(i)))
+        print(Text.from_ansi(result['output']))
+        if result['delta'] is not None:
+            print('\n[blue]🕑 Step executed in {}'.format(strfdelta(result['delta'], "{hours}h {minutes}min {seconds}s")))
+        if result['rc']:
+            print('[bold red]:double_exclamation_mark: Step {}. {} failed (code {})'.format(i, title, result['rc']))
+        else:
+            store_in_cache(i)
 
-        step_executor = importlib.import_module(step_info.get('run'))
-        execute_step(
-            step=step_executor,
-            build=args.build,
-            doc_ids=doc_ids,
-            args=step_args,
-            title=step_info.get('title', 'Untitled'),
-            index=i
-        )
+    start_time = datetime.now()
+    if args.jobs > 1:
+        print(Markdown("- **Execute workflow with {} parallel jobs**".format(args.jobs)))
+        failed = run_workflow(workflow_steps, args.jobs, step_task, on_start=step_started, on_done=step_done)
+        if failed:
+            print('[bold red]:double_exclamation_mark: The build failed. Remaining steps have been cancelled.')
+            exit(1)
+    else:
+        for i, step_info in enumerate(workflow_steps):
+            if is_up_to_date(i):
+                print_skipped_step(i)
+                continue
+            step_executor = importlib.import_module(step_info.get('run'))
+            execute_step(
+                step=step_executor,
+                build=args.build,
+                doc_ids=doc_ids,
+                args=get_step_args(step_info),
+                title=step_info.get('title', 'Untitled'),
+                index=i
+            )
+            store_in_cache(i)
     stop_time = datetime.now()
     step_delta = stop_time - start_time
     print(
@@ -114,6 +173,15 @@ if __name__ == "__main__":
     parser.add_argument('--max_documents', type=int, help='Maximum number of documents to retrieve')
     parser.add_argument('--params', type=str, help='Additional parameters to override workflow parameters')
     parser.add_argument('-w', '--workflow', type=str, default='local', help='Workflow to execute')
+    parser.add_argument('--no-cache', action='store_true', help='Execute all the steps even if their inputs, '
+                                                               'arguments and outputs did not change')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Maximum number of independent steps '
+                                                                  'executed at the same time')
+    parser.add_argument('--workers', type=int, help='Number of processes used by the steps processing the documents')
+    parser.add_argument('--docx_backend', type=str, choices=['python-docx', 'lxml'],
+                        help='Library used to read the judgments (python-docx or lxml)')
+    parser.add_argument('--vocabulary', type=str, choices=['exact', 'approximate', 'hashing'],
+                        help='How the Bag-of-Words features are selected (exact, approximate or hashing)')
 
     args = parse_args(parser)
     try:
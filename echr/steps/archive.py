@@ -0,0 +1,57 @@
+import argparse
+import os
+import shutil
+from zipfile import ZipFile
+
+from echr.utils.cli import TAB
+from rich.markdown import Markdown
+from rich.console import Console
+
+
+def run(console, build, title, doc_ids=None, force=False):
+    __console = console
+    global print
+    print = __console.print
+
+    print(Markdown("- **Create archives**"))
+    # Raw
+    shutil.make_archive(os.path.join(build, 'raw', 'judgments'), 'zip',
+                        os.path.join(build, 'raw', 'judgments'))
+    print(TAB + '> Archive raw judgments [green][DONE]')
+
+    # All
+    with ZipFile(os.path.join(build, 'all.zip'), 'w') as zipObj:
+        # Iterate over all the files in directory
+        folders = ['unstructured', 'raw', 'structured']
+        for f in folders:
+            for folderName, _, filenames in os.walk(os.path.join(build, f)):
+                for filename in filenames:
+                    if not filename.endswith('.zip'):
+                        filePath = os.path.join(folderName, filename)
+                        zipObj.write(filePath)
+    print(TAB + '> Archive build [green][DONE]')
+
+
+def main(args):
+    console = Console(record=True)
+    run(console,
+        build=args.build,
+        title=args.title,
+        doc_ids=args.doc_ids,
+        force=args.f)
+
+
+def parse_args(parser):
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Archive the build folders')
+    parser.add_argument('--build', type=str, default="./build/echr_database/")
+    parser.add_argument('--title', type=str)
+    parser.add_argument('--doc_ids', type=str, default=None, nargs='+')
+    parser.add_argument('-f', action='store_true')
+    args = parse_args(parser)
+
+    main(args)
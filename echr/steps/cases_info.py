@@ -1,8 +1,9 @@
 #!/usr/bin/python3
 import argparse
+import hashlib
 import requests
-import json
 import os
+import shutil
 import time
 import urllib3
 from concurrent.futures import ThreadPoolExecutor
@@ -10,7 +11,9 @@ import datetime
 
 from echr.utils.logger import getlogger
 from echr.utils.cli import TAB
+from echr.utils import serializer
 from echr.utils.folders import make_build_folder
+from echr.utils.http import get_client
 from rich.markdown import Markdown
 from rich.console import Console
 from rich.progress import (
@@ -65,55 +68,387 @@ fields = [
 
 BASE_URL = 'https://hudoc.echr.coe.int/app/query/results?query=contentsitename:ECHR' \
      ' AND (NOT (doctype=PR OR doctype=HFCOMOLD OR doctype=HECOMOLD)) AND ((languageisocode="ENG"))' \
-     ' AND (kpdate>="YEAR-01-01T00:00:00.0Z" AND kpdate<="YEAR_1-01-01T00:00:00.0Z")' \
-     ' AND ((organisations:"ECHR"))&select={}&sort=&start=0&length=10000&rankingModelId=11111111-0000-0000-0000-000000000000'.format(','.join(fields))
-LENGTH = 10_000  # maximum number of items per request
+     ' AND (kpdate>="START_DATE" AND kpdate<="END_DATE")' \
+     ' AND ((organisations:"ECHR"))&select={}&sort=itemid Ascending&start=OFFSET&length=LENGTH' \
+     '&rankingModelId=11111111-0000-0000-0000-000000000000'.format(','.join(fields))
+# Pages are requested by offset: the items must be sorted in a stable order for the pages to be disjoint
+LENGTH = 10_000  # maximum number of items per window, larger windows are split
+PAGE_SIZE = 500  # number of items per request
+TIMEOUT = 60
+PARTS_FOLDER = '.parts'
 YEARS = range(1959, datetime.date.today().year+1)
+SYNC_STATE = '.sync_state'
+SYNC_MARGIN = datetime.timedelta(days=31)  # Re-query documents published shortly before the last synchronization
+KPDATE_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y']
 
 
-def get_case_info(console, base_url, max_documents, path):
+def get_url(base_url, start, end, offset=0, length=PAGE_SIZE):
+    """
+        Get the query URL for a page of the documents published between two dates (included)
+
+        :param base_url: base url to query for documents
+        :type base_url: str
+        :param start: first day of the window
+        :type start: datetime.date
+        :param end: last day of the window
+        :type end: datetime.date
+        :param offset: index of the first item
+        :type offset: int
+        :param length: number of items
+        :type length: int
+        :return: query URL
+        :rtype: str
+    """
+    return base_url.replace('START_DATE', '{}T00:00:00.0Z'.format(start.isoformat())) \
+        .replace('END_DATE', '{}T23:59:59.9Z'.format(end.isoformat())) \
+        .replace('OFFSET', str(offset)).replace('LENGTH', str(length))
+
+
+def parse_kpdate(kpdate):
+    """
+        Parse a HUDOC kpdate
+
+        :param kpdate: kpdate as returned by HUDOC
+        :type kpdate: str
+        :return: date or None if the date cannot be parsed
+        :rtype: datetime.date
+    """
+    for fmt in KPDATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(kpdate.split('.')[0], fmt).date()
+        except (ValueError, AttributeError):
+            continue
+    return None
+
+
+def file_checksum(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def conditional_headers(entry, url):
+    """
+        Get the validators to send with a count request
+
+        The validators recorded during the last synchronization are only valid for the exact query they were
+        returned for: they are not sent if the window of the year changed since then.
+
+        :param entry: synchronization state of the year
+        :type entry: dict
+        :param url: count request
+        :type url: str
+        :return: If-None-Match and If-Modified-Since headers
+        :rtype: dict
+    """
+    headers = {}
+    if entry.get('count_url') != url:
+        return headers
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def load_sync_state(path):
+    try:
+        return serializer.load(os.path.join(path, SYNC_STATE))
+    except (OSError, ValueError):
+        return {'last_kpdate': None, 'years': {}}
+
+
+def save_sync_state(path, state):
+    serializer.dump(state, os.path.join(path, SYNC_STATE), sort_keys=True)
+
+
+def plan_sync(state, path, years, incremental=True):
+    """
+        Determine the date windows to query
+
+        In incremental mode, a year is fully downloaded only if its file is missing or does not match the
+        checksum recorded during the last synchronization. The years that may contain new documents
+        are queried from the last known kpdate (minus a safety margin) and merged into the existing files.
+
+        :param state: synchronization state of the last run
+        :type state: dict
+        :param path: folder containing the case information
+        :type path: str
+        :param years: years to synchronize
+        :type years: [int]
+        :param incremental: only query what could have changed since the last run
+        :type incremental: bool
+        :return: list of windows (year, first day, last day, merge)
+        :rtype: [(int, datetime.date, datetime.date, bool)]
+    """
+    last_kpdate = parse_kpdate(state.get('last_kpdate')) if incremental else None
+    since = last_kpdate - SYNC_MARGIN if last_kpdate else None
+    windows = []
+    for year in years:
+        start, end = datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+        entry = state.get('years', {}).get(str(year))
+        file_path = os.path.join(path, '{}.json'.format(year))
+        if since is None or entry is None or not os.path.isfile(file_path) \
+                or file_checksum(file_path) != entry.get('sha256'):
+            windows.append((year, start, end, False))
+        elif since.year <= year:
+            windows.append((year, max(start, since), end, True))
+    return windows
+
+
+def split_window(start, end, count, max_results=LENGTH, n=None):
+    """
+        Split a date window in half until each sub-window contains at most max_results items
+
+        :param start: first day of the window
+        :type start: datetime.date
+        :param end: last day of the window
+        :type end: datetime.date
+        :param count: function returning the number of items in a window
+        :type count: callable
+        :param max_results: maximal number of items in a window
+        :type max_results: int
+        :param n: number of items in the window if already known
+        :type n: int
+        :return: list of sub-windows with their number of items
+        :rtype: [(datetime.date, datetime.date, int)]
+    """
+    n = count(start, end) if n is None else n
+    if n <= max_results or start >= end:
+        if n > max_results:
+            log.warning('More than {} items published on {}. Some items might be missing.'.format(max_results, start))
+        return [(start, end, n)]
+    middle = start + (end - start) // 2
+    return split_window(start, middle, count, max_results) + \
+        split_window(middle + datetime.timedelta(days=1), end, count, max_results)
+
+
+def get_pages(windows, page_size=PAGE_SIZE):
+    """
+        List the pages to request to retrieve all the items of a list of windows
+
+        :param windows: windows with their number of items
+        :type windows: [(datetime.date, datetime.date, int)]
+        :param page_size: number of items per page
+        :type page_size: int
+        :return: list of pages (first day, last day, offset, length)
+        :rtype: [(datetime.date, datetime.date, int, int)]
+    """
+    return [(start, end, offset, min(page_size, n - offset))
+            for start, end, n in windows for offset in range(0, n, page_size)]
+
+
+def get_with_retry(url, headers=None, stream=False):
+    """
+        Send a GET request through the shared HTTP client, retrying on failure
+
+        :return: response or None if all the attempts failed
+        :rtype: requests.Response
+    """
+    client = get_client()
+    for i in range(MAX_RETRY):
+        try:
+            r = client.get(url, stream=stream, timeout=TIMEOUT, headers=headers or {})
+            if r.ok or r.status_code == 304:
+                return r
+            log.error('({}/{}) Request failed with status {}: {}'.format(i + 1, MAX_RETRY, r.status_code, url))
+        except requests.RequestException as e:
+            log.error('({}/{}) Request failed ({}): {}'.format(i + 1, MAX_RETRY, e.__class__.__name__, url))
+        time.sleep(0.001)
+    return None
+
+
+def stitch_pages(part_files, output_file):
+    """
+        Concatenate the pages of a query into a single file, one page at a time
+
+        The pages are requested in itemid order, so they are disjoint unless the results changed while they were
+        retrieved. Duplicated items are dropped, such that the number of items written can be checked against
+        the number of items of the query.
+
+        :param part_files: page files in order
+        :type part_files: [str]
+        :param output_file: path to the output file
+        :type output_file: str
+        :return: number of items written
+        :rtype: int
+    """
+    seen = set()
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'wb') as out:
+        out.write(b'{"results": [')
+        for part in part_files:
+            results = serializer.load(part).get('results', [])
+            for r in results:
+                itemid = r['columns'].get('itemid')
+                if itemid in seen:
+                    continue
+                seen.add(itemid)
+                if len(seen) > 1:
+                    out.write(b', ')
+                out.write(serializer.dumps(r, pretty=False))
+        out.write('], "resultcount": {}}}'.format(len(seen)).encode('utf-8'))
+    os.replace(tmp_file, output_file)
+    return len(seen)
+
+
+def merge_cases_info(existing, new):
+    """
+        Merge the results of a query into the content of an existing file
+
+        :param existing: content of the existing file
+        :type existing: dict
+        :param new: query result
+        :type new: dict
+        :return: merged content
+        :rtype: dict
+    """
+    results = existing.get('results', [])
+    index = {r['columns']['itemid']: i for i, r in enumerate(results)}
+    for r in new.get('results', []):
+        itemid = r['columns']['itemid']
+        if itemid in index:
+            results[index[itemid]] = r
+        else:
+            index[itemid] = len(results)
+            results.append(r)
+    existing['results'] = results
+    existing['resultcount'] = len(results)
+    return existing
+
+
+def assemble_year(part_files, file_path, expected, merge=False):
+    """
+        Stitch the pages of a year and save them, or merge them into the existing file of the year
+
+        The file of the year is left untouched if the number of items retrieved is not the number of items
+        counted for the windows of the year, e.g. because the results changed while the pages were retrieved.
+
+        :param part_files: page files in order
+        :type part_files: [str]
+        :param file_path: file of the year
+        :type file_path: str
+        :param expected: number of items counted for the windows of the year
+        :type expected: int
+        :param merge: merge the items into the existing file instead of replacing it
+        :type merge: bool
+        :return: number of items retrieved
+        :rtype: int
+    """
+    output_file = file_path + '.new'
+    n = stitch_pages(part_files, output_file)
+    if n != expected:
+        os.remove(output_file)
+        raise ValueError('{} items retrieved instead of {} for {}'.format(n, expected, file_path))
+    if merge:
+        new = serializer.load(output_file)
+        os.remove(output_file)
+        content = merge_cases_info(serializer.load(file_path), new)
+        serializer.dump(content, file_path, pretty=False)
+    else:
+        os.replace(output_file, file_path)
+    return n
+
+
+def get_last_kpdate(file_path):
+    content = serializer.load(file_path)
+    dates = [parse_kpdate(r['columns'].get('kpdate')) for r in content.get('results', [])]
+    dates = [d for d in dates if d is not None]
+    return max(dates).isoformat() if dates else None
+
+
+def get_case_info(console, base_url, max_documents, path, incremental=False):
     """
         Get case information from HUDOC
 
+        Each year is split into windows of at most LENGTH items, and each window is retrieved page by page.
+        Pages are stored in a temporary folder as they arrive and concatenated once all the pages of a year
+        have been retrieved.
+
         :param base_url: base url to query for documents
         :type base_url: string
         :param: max_documents: maximal number of documents to retrieve
         :type: int
         :param: path: path to store the information
         :type: str
+        :param: incremental: only query the documents that could have changed since the last run
+        :type: bool
     """
-    def get_cases_info_step(year, progress, task):
-        error = ""
-        file_path = os.path.join(path, "{}.json".format(year))
-        failed_to_get_some_cases = False
-        with open(file_path, 'wb') as f:
-            url = base_url.replace('YEAR_1', str(year+1)).replace('YEAR', str(year))
-            for i in range(MAX_RETRY):
-                error = ""
-                try:
-                    r = requests.get(url, stream=True, timeout=10)
-                    if not r.ok:
-                        raise Exception()
-                    for block in r.iter_content(1024):
-                        f.write(block)
-                    break
-                except:
-                    try:  # Delete the incorrect file if it exists
-                        os.remove(file_path)
-                    except OSError:
-                        pass
-                    __console.print_exception()
-                    log.error('({}/{}) Failed to fetch information for year {}'.format(
-                        i + 1, MAX_RETRY, year))
-                    error = '\n| ({}/{}) Failed to fetch information for year {}'.format(
-                        i + 1, MAX_RETRY, year)
-                    time.sleep(0.001)
-                if error:
-                    progress.update(task, advance=0, error=error)
-            else:
-                failed_to_get_some_cases = True
-        progress.update(task, advance=1, to_be_completed=len(YEARS), year=year)
-        return failed_to_get_some_cases
+    state = load_sync_state(path)
+    windows = plan_sync(state, path, YEARS, incremental)
+    parts_folder = os.path.join(path, PARTS_FOLDER)
+    os.makedirs(parts_folder, exist_ok=True)
+    failed = set()
+    headers = {}
+    expected = {}
+
+    def count(start, end, request_headers=None):
+        r = get_with_retry(get_url(base_url, start, end, 0, 1), headers=request_headers)
+        if r is None:
+            raise ConnectionError('Could not count the items between {} and {}'.format(start, end))
+        if r.status_code == 304:
+            return None, r
+        return r.json()['resultcount'], r
+
+    def plan_year_step(window, progress, task):
+        year, start, end, merge = window
+        entry = state['years'].get(str(year), {})
+        pages = []
+        try:
+            count_url = get_url(base_url, start, end, 0, 1)
+            n, r = count(start, end, conditional_headers(entry, count_url) if merge else None)
+            if n is not None:
+                headers[year] = (count_url, r.headers)
+                sub_windows = split_window(start, end, lambda s, e: count(s, e)[0], n=n)
+                expected[year] = sum(k for _, _, k in sub_windows)
+                pages = [(year,) + p for p in get_pages(sub_windows)]
+        except Exception:
+            __console.print_exception()
+            log.error('Failed to count the cases information for year {}'.format(year))
+            progress.update(task, error='\n| Failed to count the cases information for year {}'.format(year))
+            failed.add(year)
+        progress.update(task, advance=1, year=year)
+        return pages
+
+    def get_page_step(page, progress, task):
+        year, start, end, offset, length = page
+        if year in failed:
+            return
+        part_file = os.path.join(parts_folder, '{}_{}_{}_{}.json'.format(year, start.isoformat(), end.isoformat(),
+                                                                         offset))
+        r = get_with_retry(get_url(base_url, start, end, offset, length), stream=True)
+        try:
+            if r is None:
+                raise ConnectionError()
+            with open(part_file, 'wb') as f:
+                for block in r.iter_content(1 << 16):
+                    f.write(block)
+        except Exception:
+            log.error('Failed to fetch information for year {} (offset {})'.format(year, offset))
+            progress.update(task, error='\n| Failed to fetch information for year {}'.format(year))
+            failed.add(year)
+        progress.update(task, advance=1, year=year)
+        return part_file
+
+    print(TAB + '> Windows to query: {} ({} skipped)'.format(len(windows), len(YEARS) - len(windows)))
+    with Progress(
+            TAB + "> Counting... [IN PROGRESS]\n",
+            BarColumn(30),
+            TimeRemainingColumn(),
+            "| ({task.completed}/{task.total}) Counting cases for year {task.fields[year]}"
+            "{task.fields[error]}",
+            transient=True,
+            console=console
+    ) as progress:
+        task = progress.add_task("Counting...", total=len(windows),
+                                 year=windows[0][0] if windows else YEARS[0], error="")
+        with ThreadPoolExecutor(get_client().pool_size) as executor:
+            pages = [p for year_pages in executor.map(lambda x: plan_year_step(x, progress, task), windows)
+                     for p in year_pages]
+    print(TAB + '> Counting... [green][DONE]')
+    print(TAB + '> Pages to download: {}'.format(len(pages)))
 
     with Progress(
             TAB + "> Downloading... [IN PROGRESS]\n",
@@ -124,23 +459,54 @@ def get_case_info(console, base_url, max_documents, path):
             transient=True,
             console=console
     ) as progress:
-        task = progress.add_task("Downloading...", total=len(YEARS), to_be_completed=len(YEARS), year=YEARS[0], error="")
-        f = lambda x: get_cases_info_step(x, progress, task)
-        with ThreadPoolExecutor(16) as executor:
-            results = list(executor.map(f, YEARS))
-    failed_to_get_some_cases = all(results)
-    if failed_to_get_some_cases:
+        task = progress.add_task("Downloading...", total=len(pages),
+                                 year=pages[0][0] if pages else YEARS[0], error="")
+        with ThreadPoolExecutor(get_client().pool_size) as executor:
+            part_files = list(executor.map(lambda x: get_page_step(x, progress, task), pages))
+
+    parts_per_year = {}
+    for page, part_file in zip(pages, part_files):
+        parts_per_year.setdefault(page[0], []).append(part_file)
+    for year, start, end, merge in windows:
+        if year in failed:
+            state['years'].pop(str(year), None)
+            continue
+        if year not in headers:  # Not modified since the last synchronization
+            continue
+        file_path = os.path.join(path, '{}.json'.format(year))
+        count_url, year_headers = headers[year]
+        try:
+            assemble_year(parts_per_year.get(year, []), file_path, expected[year], merge)
+            state['years'][str(year)] = {
+                'sha256': file_checksum(file_path),
+                'count_url': count_url,
+                'etag': year_headers.get('ETag'),
+                'last_modified': year_headers.get('Last-Modified'),
+                'last_kpdate': get_last_kpdate(file_path)
+            }
+        except Exception:
+            __console.print_exception()
+            log.error('Failed to assemble information for year {}'.format(year))
+            failed.add(year)
+            state['years'].pop(str(year), None)
+    shutil.rmtree(parts_folder, ignore_errors=True)
+
+    last_kpdates = [e['last_kpdate'] for e in state['years'].values() if e.get('last_kpdate')]
+    state['last_kpdate'] = max(last_kpdates) if last_kpdates else None
+    save_sync_state(path, state)
+    if failed:
         print(TAB + '> Downloading... [yellow][WARNING]')
-        print(TAB + "[bold yellow]:warning: Some information could not be downloaded")
+        print(TAB + "[bold yellow]:warning: Some information could not be downloaded for years {}".format(
+            ', '.join(str(y) for y in sorted(failed))))
         print(TAB + "  [bold yellow]THE FINAL DATABASE WILL BE INCOMPLETE!")
         print(TAB + "  [bold yellow]Use --strict flag to exit on single failure")
-        return failed_to_get_some_cases
+        return True
     else:
         print(TAB + '> Downloading... [green][DONE]')
         return 0
 
 
-def run(console, build, title, doc_ids=None, max_documents=-1, force=False):
+def run(console, build, title, doc_ids=None, max_documents=-1, force=False, update=False):
     """
         Get case information from HUDOC
 
@@ -150,6 +516,8 @@ def run(console, build, title, doc_ids=None, max_documents=-1, force=False):
         :type: int
         :param: force: delete and recreate the folder
         :type: bool
+        :param: update: only query the documents that could have changed since the last run
+        :type: bool
     """
     __console = console
     global print
@@ -164,12 +532,12 @@ def run(console, build, title, doc_ids=None, max_documents=-1, force=False):
     if doc_ids:
         print(TAB + "> Doc ids given")
     print(Markdown("- **Get case information from HUDOC**"))
-    get_case_info(console, BASE_URL, max_documents, output_folder)
+    get_case_info(console, BASE_URL, max_documents, output_folder, incremental=update)
 
 
 def main(args):
     console = Console(record=True)
-    run(console, args.build, args.title, args.doc_ids, args.max_documents, args.f)
+    run(console, args.build, args.title, args.doc_ids, args.max_documents, args.f, args.u)
 
 
 def parse_args(parser):
@@ -183,5 +551,6 @@ if __name__ == "__main__":
     parser.add_argument('--doc_ids', type=str, default=None, nargs='+')
     parser.add_argument('--max_documents', type=int, default=-1)
     parser.add_argument('-f', action='store_true')
+    parser.add_argument('-u', action='store_true')
     args = parse_args(parser)
     main(args)
@@ -1,12 +1,14 @@
 #!/usr/bin/python
 import argparse
-from collections import Counter
-import json
 import os
 from os import listdir, path
 import copy
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import re
 
+from echr.utils import serializer
+from echr.utils.case_store import write_cases
 from echr.utils.folders import make_build_folder
 from echr.utils.logger import getlogger
 from echr.utils.cli import TAB
@@ -21,6 +23,10 @@ from rich.progress import (
 
 log = getlogger()
 
+NON_WORD_PREFIX = re.compile(r'^\W')
+ARTICLE_WORD = re.compile(r'(?<!\S)(art\S*)(?:\s+(\S+))?')
+CONCLUSION_CACHE_SIZE = 16384
+
 
 def format_parties(parties):
     """
@@ -51,7 +57,7 @@ def split_and_format_article(article):
     """
 
     def remove_incorrect_prefixes(art):
-        if re.match(re.compile("^\W"), art):
+        if NON_WORD_PREFIX.match(art):
             return art[1:]
         return art
 
@@ -142,23 +148,16 @@ def format_conclusion_elements(i, e, final_ccl):
             if p[0] in l:
                 l = l.replace(p[0], p[1])
 
-        b = l.split()
-        for j, a in enumerate(b):
-            if a.startswith('art'):
-                if a.lower().startswith('art.') and not a.lower().startswith('art. ') and len(a) > 4:
-                    art = a.lower()[4:]
-                else:
-                    art = b[j + 1]
-                break
+        # First word starting with 'art': either 'art.<article>' or followed by the article
+        match = ARTICLE_WORD.search(l)
+        if match is not None:
+            word, art = match.group(1), match.group(2)
+            if word.startswith('art.') and len(word) > 4:
+                art = word[4:]
+            elif art is None:
+                raise IndexError('No article after {} in {}'.format(word, e['element']))
         if art is not None:
             articles = split_and_format_article(art)
-            art = art.split('+')
-            if '+' in art[0]:
-                sart = art[0].split('+')
-                t = [sart[-1]]
-                for k, e in enumerate(sart[:-1]):
-                    if not sart[k + 1].startswith(e):
-                        t.append(e)
 
     base_articles = find_base_articles(articles)
     for k, art in enumerate(articles):
@@ -169,7 +168,39 @@ def format_conclusion_elements(i, e, final_ccl):
     return to_append
 
 
+def copy_conclusion(elements):
+    return [{k: list(v) if isinstance(v, list) else v for k, v in e.items()} for e in elements]
+
+
+@lru_cache(maxsize=CONCLUSION_CACHE_SIZE)
+def parse_conclusion(ccl):
+    """
+        Parse a conclusion string, memoized on the string
+
+        Many cases share the same conclusion. The returned elements are shared between the calls and must not be
+        modified: use format_conclusion to get a copy.
+
+        :param ccl: conclusion string
+        :type ccl: str
+        :return: formatted conclusion elements
+        :rtype: [dict]
+    """
+    return _format_conclusion(ccl)
+
+
 def format_conclusion(ccl):
+    """
+        Format a conclusion string into a list of elements
+
+        :param ccl: conclusion string
+        :type ccl: str
+        :return: list of formatted conclusion element, which can be modified
+        :rtype: [dict]
+    """
+    return copy_conclusion(parse_conclusion(ccl))
+
+
+def _format_conclusion(ccl):
     """
         Format a conclusion string into a list of elements:
 
@@ -274,28 +305,100 @@ def format_subarticle(article):
     return res
 
 
-def format_cases(console, cases):
+COUNTRIES = None
+ORIGINATING_BODY = None
+FORMAT_CHUNK_SIZE = 1000
+
+
+def load_reference_data():
+    """
+        Load the countries and originating bodies, once per process
+
+        :return: countries per ISO 3166-1 alpha-3 code and originating bodies per identifier
+        :rtype: (dict, dict)
+    """
+    global COUNTRIES, ORIGINATING_BODY
+    if COUNTRIES is None:
+        data = serializer.load(os.path.join('data', 'countries.json'))
+        COUNTRIES = {c['alpha-3']: {'alpha2': c['alpha-2'].lower(), 'name': c['name']} for c in data}
+    if ORIGINATING_BODY is None:
+        ORIGINATING_BODY = serializer.load(os.path.join('data', 'originatingbody.json'))
+    return COUNTRIES, ORIGINATING_BODY
+
+
+def split_field(value):
+    return [e.strip() for e in value.split(';')] if len(value) > 0 else []
+
+
+def format_case(case, countries, originating_body):
+    """
+        Format a case from its raw information
+
+        :param case: case raw information, updated in place
+        :type case: dict
+        :param countries: countries per ISO 3166-1 alpha-3 code
+        :type countries: dict
+        :param originating_body: originating bodies per identifier
+        :type originating_body: dict
+        :return: formatted case
+        :rtype: dict
+    """
+    case['parties'] = format_parties(case['docname'])
+    case['__conclusion'] = case['conclusion']
+    case['conclusion'] = format_conclusion(case['__conclusion'])
+    case['__articles'] = case['article']
+    case['article'] = format_article(case['__articles'])
+    case['paragraphs'] = format_subarticle(case['__articles'])
+    for k in ['externalsources', 'documentcollectionid', 'issue', 'representedby']:
+        case[k] = split_field(case[k])
+    case['extractedappno'] = [e.strip() for e in case['extractedappno'].split(';')]
+
+    case['country'] = countries[case['respondent'].split(';')[0]]
+    body = originating_body[case['originatingbody']]
+    case['originatingbody_type'] = body['type']
+    case['originatingbody_name'] = body['name']
+
+    for k in ['isplaceholder', 'documentcollectionid2', 'doctype', 'meetingnumber']:
+        del case[k]
+    case['kpthesaurus'] = case['kpthesaurus'].split(';')
+    case['scl'] = case['scl'].split(';') if case['scl'].strip() else []
+    return case
+
+
+def format_chunk(cases):
+    """
+        Format a chunk of cases and accumulate their statistics
+
+        :param cases: cases raw information
+        :type cases: [dict]
+        :return: formatted cases and their statistics
+        :rtype: ([dict], StatisticsAccumulator)
+    """
+    countries, originating_body = load_reference_data()
+    statistics = StatisticsAccumulator()
+    for c in cases:
+        statistics.add(format_case(c, countries, originating_body))
+    return cases, statistics
+
+
+def format_cases(console, cases, workers=1, statistics=None):
     """
         Format the cases from raw information
 
+        The cases are formatted by chunks, in parallel if several workers are used. The statistics about the
+        cases are accumulated at the same time.
+
         :param cases: list of cases raw information
         :type cases: [dict]
+        :param workers: number of processes
+        :type workers: int
+        :param statistics: if provided, updated with the formatted cases
+        :type statistics: StatisticsAccumulator
         :return: list of formatted cases
         :rtype: [dict]
     """
-    COUNTRIES = {}
-    with open(os.path.join('data', 'countries.json')) as f:
-        data = json.load(f)
-        for c in data:
-            COUNTRIES[c['alpha-3']] = {
-                'alpha2': c['alpha-2'].lower(),
-                'name': c['name']
-            }
-
-    ORIGINATING_BODY = {}
-    with open(os.path.join('data', 'originatingbody.json')) as f:
-        ORIGINATING_BODY = json.load(f)
-
+    chunks = [cases[i:i + FORMAT_CHUNK_SIZE] for i in range(0, len(cases), FORMAT_CHUNK_SIZE)]
+    formatted = []
     with Progress(
             TAB + "> Format cases [IN PROGRESS]",
             "| Cases ({task.completed} / {task.total})",
@@ -305,46 +408,23 @@ def format_cases(console, cases):
             console=console
     ) as progress:
         task = progress.add_task("Format", total=len(cases))
-        for i, c in enumerate(cases):
-            progress.update(task, advance=1)
-            cases[i]['parties'] = format_parties(cases[i]['docname'])
-            cases[i]['__conclusion'] = cases[i]['conclusion']
-            cases[i]['conclusion'] = format_conclusion(c['__conclusion'])
-            cases[i]['__articles'] = cases[i]['article']
-            cases[i]['article'] = format_article(cases[i]['__articles'])
-            cases[i]['paragraphs'] = format_subarticle(cases[i]['__articles'])
-            cases[i]['externalsources'] = cases[i]["externalsources"].split(';') if len(
-                cases[i]['externalsources']) > 0 else []
-            cases[i]["documentcollectionid"] = cases[i]["documentcollectionid"].split(';') if len(
-                cases[i]['documentcollectionid']) > 0 else []
-            cases[i]["issue"] = cases[i]["issue"].split(';') if len(cases[i]['issue']) > 0 else []
-            cases[i]["representedby"] = cases[i]["representedby"].split(';') if len(
-                cases[i]['representedby']) > 0 else []
-            cases[i]["extractedappno"] = cases[i]["extractedappno"].split(';')
-
-            cases[i]['externalsources'] = [e.strip() for e in cases[i]['externalsources']]
-            cases[i]['documentcollectionid'] = [e.strip() for e in cases[i]['documentcollectionid']]
-            cases[i]['issue'] = [e.strip() for e in cases[i]['issue']]
-            cases[i]['representedby'] = [e.strip() for e in cases[i]['representedby']]
-            cases[i]['extractedappno'] = [e.strip() for e in cases[i]['extractedappno']]
-
-            cases[i]['country'] = COUNTRIES[cases[i]['respondent'].split(';')[0]]
-            cases[i]['originatingbody_type'] = ORIGINATING_BODY[cases[i]['originatingbody']]['type']
-            cases[i]['originatingbody_name'] = ORIGINATING_BODY[cases[i]['originatingbody']]['name']
-
-            #cases[i]["rank"] = cases[i]['Rank']
-            #del cases[i]["Rank"]
-
-            del cases[i]["isplaceholder"]
-            #cases[i]["kpdate"] = cases[i]['kpdateAsText']
-            #del cases[i]['kpdateAsText']
-            del cases[i]["documentcollectionid2"]
-            cases[i]["kpthesaurus"] = cases[i]["kpthesaurus"].split(';')
-            cases[i]["scl"] = cases[i]["scl"].split(';') if cases[i]["scl"].strip() else []
-            del cases[i]["doctype"]
-            del cases[i]["meetingnumber"]
+        if workers > 1 and len(chunks) > 1:
+            executor = ProcessPoolExecutor(workers)
+            results = executor.map(format_chunk, chunks)
+        else:
+            executor = None
+            results = map(format_chunk, chunks)
+        try:
+            for chunk, chunk_statistics in results:
+                formatted.extend(chunk)
+                if statistics is not None:
+                    statistics.update(chunk_statistics)
+                progress.update(task, advance=len(chunk))
+        finally:
+            if executor is not None:
+                executor.shutdown()
     print(TAB + "> Format case [green][DONE]")
-    return cases
+    return formatted
 
 
 def filter_cases(cases):
@@ -383,52 +463,94 @@ def filter_cases(cases):
     return cases
 
 
-def generate_statistics(cases):
+class StatisticsAccumulator:
     """
-        Generate statistics about the cases
+        Accumulate the distinct values of each attribute of the cases
 
-        :param cases: list of cases
-        :type cases: [dict]
-        :return: statistics about the cases
-        :rtype: dict
+        The attributes are the keys of the first case. For the conclusion, only the elements are counted.
+        Accumulators computed on different chunks of cases can be merged.
     """
 
-    def generate_count(k, cases):
-        s = []
-        for c in cases:
+    def __init__(self):
+        self.keys = None
+        self.values = {}
+        self.count = 0
+
+    def add(self, case):
+        if self.keys is None:
+            self.keys = list(case.keys())
+            self.values = {k: set() for k in self.keys}
+        self.count += 1
+        for k in self.keys:
+            v = case[k]
             if k == 'conclusion':
                 # We do not take into account mention and details
-                s.extend([a['element'] for a in c[k]])
-            else:
-                if isinstance(c[k], list):
-                    if len(c[k]):
-                        s.extend(c[k])
-                elif isinstance(c[k], str):  # string
-                    if len(c[k].strip()):
-                        s.append(c[k])
-        return s
+                self.values[k].update(a['element'] for a in v)
+            elif isinstance(v, list):
+                self.values[k].update(v)
+            elif isinstance(v, str) and len(v.strip()):
+                self.values[k].add(v)
+
+    def update(self, other):
+        """
+            Merge the statistics of another set of cases
+
+            :param other: statistics to merge
+            :type other: StatisticsAccumulator
+        """
+        if other.keys is None:
+            return
+        if self.keys is None:
+            self.keys = list(other.keys)
+            self.values = {k: set() for k in self.keys}
+        for k in self.keys:
+            self.values[k].update(other.values.get(k, ()))
+        self.count += other.count
+
+    def statistics(self):
+        """
+            Get the statistics about the cases
+
+            :return: cardinal and density of each attribute
+            :rtype: dict
+        """
+        stats = {'attributes': {}}
+        for k in self.keys or []:
+            stats['attributes'][k] = {
+                'cardinal': len(self.values[k]),
+                'density': float(len(self.values[k])) / self.count
+            }
+        return stats
+
 
+def print_statistics(stats):
     table = Table()
     table.add_column("Attribute", style="cyan", no_wrap=True)
     table.add_column("Cardinal", justify="right", style="magenta")
     table.add_column("Density", justify="right", style="green")
-
-    keys = cases[0].keys()
-    except_k = []
-    stats = {'attributes': {}}
-    for k in [i for i in keys if i not in except_k]:
-        s = generate_count(k, cases)
-        s = Counter(s)
-        stats['attributes'][k] = {
-            'cardinal': len(s),
-            'density': float(len(s)) / len(cases)
-        }
-        table.add_row(k, str(len(s)), '{:.4f}'.format(float(len(s)) / len(cases)))
+    for k, v in stats['attributes'].items():
+        table.add_row(k, str(v['cardinal']), '{:.4f}'.format(v['density']))
     print(table)
+
+
+def generate_statistics(cases):
+    """
+        Generate statistics about the cases
+
+        :param cases: list of cases
+        :type cases: [dict]
+        :return: statistics about the cases
+        :rtype: dict
+    """
+    statistics = StatisticsAccumulator()
+    for c in cases:
+        statistics.add(c)
+    stats = statistics.statistics()
+    print_statistics(stats)
     return stats
 
 
-def run(console, build, title, doc_ids=None, force=False):
+def run(console, build, title, doc_ids=None, force=False, workers=1):
     __console = console
     global print
     print = __console.print
@@ -438,16 +560,16 @@ def run(console, build, title, doc_ids=None, force=False):
     output_folder = path.join(build, 'raw', 'cases_info')
     print(TAB + '> Step folder: {}'.format(path.join(build, 'cases_info')))
     make_build_folder(console, output_folder, force, strict=False)
+    workers = max(1, int(workers or 1))
+    print(TAB + '> Workers: {}'.format(workers))
 
     cases = []
     files = [path.join(input_folder, f) for f in listdir(input_folder) if path.isfile(path.join(input_folder, f)) if
              '.json' in f]
     for p in files:
         try:
-            with open(p, 'r') as f:
-                content = f.read()
-                index = json.loads(content)
-                cases.extend(index["results"])
+            index = serializer.load(p)
+            cases.extend(index["results"])
         except Exception as e:
             log.info(p, e)
     cases = [c["columns"] for c in cases]
@@ -455,16 +577,14 @@ def run(console, build, title, doc_ids=None, force=False):
     print(Markdown("- **Filter cases**"))
     cases = filter_cases(cases)
     print(Markdown("- **Format cases metadata**"))
-    cases = format_cases(console, cases)
+    statistics = StatisticsAccumulator()
+    cases = format_cases(console, cases, workers, statistics)
 
     print(Markdown("- **Generate statistics**"))
-    stats = generate_statistics(cases)
+    stats = statistics.statistics()
+    print_statistics(stats)
 
-    with open(path.join(output_folder, 'filter.statistics.json'), 'w') as outfile:
-        json.dump(stats, outfile, indent=4, sort_keys=True)
-
-    with open(path.join(output_folder, 'raw_cases_info_all.json'), 'w') as outfile:
-        json.dump(cases, outfile, indent=4, sort_keys=True)
+    serializer.dump(stats, path.join(output_folder, 'filter.statistics.json'), sort_keys=True)
 
     filtered_cases = []
     for c in cases:
@@ -501,6 +621,7 @@ def run(console, build, title, doc_ids=None, force=False):
                     cases_per_articles[e['article']].append(c)
 
     print(Markdown("- **Generate case listing for datasets**"))
+    splits = {}
     multilabel_cases = []
     multilabel_index = set()
     with Progress(
@@ -519,8 +640,7 @@ def run(console, build, title, doc_ids=None, force=False):
         task = progress.add_task("Generate datasets cases", total=len(outcomes), progress_array="[]")
         for k in outcomes.keys():
             progress_array.append(k)
-            with open(path.join(output_folder, 'raw_cases_info_article_{}.json'.format(k)), 'w') as outfile:
-                json.dump(cases_per_articles[k], outfile, indent=4, sort_keys=True)
+            splits['article_{}'.format(k)] = [c['itemid'] for c in cases_per_articles[k]]
             multilabel_cases.extend(cases_per_articles[k])
             for c in cases_per_articles[k]:
                 multilabel_index.add(c['itemid'])
@@ -532,8 +652,7 @@ def run(console, build, title, doc_ids=None, force=False):
             multilabel_cases_unique.append(c)
             multilabel_index.discard(c['itemid'])
 
-    with open(path.join(output_folder, 'raw_cases_info_multilabel.json'), 'w') as outfile:
-        json.dump(multilabel_cases_unique, outfile, indent=4, sort_keys=True)
+    splits['multilabel'] = [c['itemid'] for c in multilabel_cases_unique]
     print(TAB + "> Generate case info for multilabel dataset [green][DONE]", )
     multiclass_index = {}  # Key: case ID / Value = number of different dataset it appears in
     multiclass_cases = []
@@ -560,14 +679,17 @@ def run(console, build, title, doc_ids=None, force=False):
                                                                                               list(set(nb_datasets))))
                              )
 
-    with open(path.join(output_folder, 'raw_cases_info_multiclass.json'), 'w') as outfile:
-        json.dump(multiclass_cases, outfile, indent=4, sort_keys=True)
+    splits['multiclass'] = [c['itemid'] for c in multiclass_cases]
     print(TAB + "> Generate case info for multiclass [green][DONE]", )
 
+    # The cases are stored once, the datasets only list their cases identifiers
+    write_cases(output_folder, cases, splits, split_columns={'multiclass': ['mc_conclusion']})
+    print(TAB + "> Save cases information [green][DONE]", )
+
 
 def main(args):
     console = Console(record=True)
-    run(console, args.build, args.title, args.doc_ids, args.force)
+    run(console, args.build, args.title, args.doc_ids, args.f, args.workers)
 
 
 def parse_args(parser):
@@ -581,6 +703,7 @@ if __name__ == "__main__":
     parser.add_argument('--title', type=str)
     parser.add_argument('--doc_ids', type=str, default=None, nargs='+')
     parser.add_argument('-f', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
     args = parse_args(parser)
 
     main(args)
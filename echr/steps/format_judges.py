@@ -1,10 +1,10 @@
 #!/usr/bin/python
 import argparse
-import json
 import os
 from os import path
 from docx import Document
 
+from echr.utils import serializer
 from echr.utils.folders import make_build_folder
 from echr.utils.logger import getlogger
 from echr.utils.cli import TAB
@@ -64,13 +64,13 @@ def run(console, build, title, doc_ids=None, force=False):
     print(Markdown("- **Step configuration**"))
     output_folder = path.join(build, 'raw', )
     print(TAB + '> Step folder: {}'.format(path.join(build, 'judges')))
-    make_build_folder(console, output_folder, force, strict=False)
+    # The raw folder is shared with other steps and must not be deleted
+    make_build_folder(console, output_folder, force=False, strict=False)
 
     print(Markdown("- **Extract of judges**"))
     judges_per_country = extract_judge_list(JUDGE_LIST)
 
-    with open(path.join(output_folder, 'judges_per_country.json'), 'w') as outfile:
-        json.dump(judges_per_country, outfile, indent=4, sort_keys=True)
+    serializer.dump(judges_per_country, path.join(output_folder, 'judges_per_country.json'), sort_keys=True)
 
     print(TAB + "> Extract the list of judges [green][DONE]", )
 
@@ -1,104 +1,104 @@
 import argparse
-import json
 import os
-from os import listdir
-from os.path import isfile, join
 import shutil
 
+import numpy as np
+from scipy import sparse
+
+from echr.steps.process_documents import BOW_MATRIX, TFIDF_MATRIX, ROW_INDEX
+from echr.utils import serializer
+from echr.utils.case_store import CaseStore
+from echr.utils.dataset_export import export_dataset, one_hot
 from echr.utils.folders import make_build_folder
 from echr.utils.cli import TAB
 from rich.markdown import Markdown
 from rich.console import Console
 
 
+def load_matrices(processed_folder):
+    """
+        Load the Bag-of-Words and TF-IDF matrices saved by the processing step
+
+        :param processed_folder: folder of the processing step
+        :type processed_folder: str
+        :return: Bag-of-Words matrix, TF-IDF matrix and row of each case
+        :rtype: (scipy.sparse.csr_matrix, scipy.sparse.csr_matrix, dict)
+    """
+    bow = sparse.load_npz(os.path.join(processed_folder, BOW_MATRIX)).tocsr()
+    tfidf = sparse.load_npz(os.path.join(processed_folder, TFIDF_MATRIX)).tocsr()
+    itemids = serializer.load(os.path.join(processed_folder, ROW_INDEX))
+    return bow, tfidf, {itemid: i for i, itemid in enumerate(itemids)}
+
+
 def generate_dataset(cases, keys, keys_list, encoded_outcomes, feature_index, feature_to_encoded, output_path, name,
                      offset, processed_folder, filter_classes=None, force=False):
     output_path = output_path
 
     dataset_size = 0
-    dataset_full_doc_id = []
     min_feature = 1000000
     max_feature = 0
     avg_feature = 0
     outcome_distribution = {}
     conclusion_key = 'conclusion' if name != 'multiclass' else 'mc_conclusion'
-    with open(os.path.join(output_path, 'descriptive.txt'), 'w') as f_d, \
-            open(os.path.join(output_path, 'BoW.txt'), 'w') as f_b, \
-            open(os.path.join(output_path, 'TF_IDF.txt'), 'w') as f_t, \
-            open(os.path.join(output_path, 'descriptive+BoW.txt'), 'w') as f_db, \
-            open(os.path.join(output_path, 'descriptive+TF_IDF.txt'), 'w') as f_dt, \
-            open(os.path.join(output_path, 'outcomes.txt'), 'w') as f:
-        for c in cases:
-            nb_features = 0
-            encoded_case = []
-            classes = []
+    bow, tfidf, row_of = load_matrices(processed_folder)
+    itemids = []
+    labels = []
+    descriptive = []
+    rows = []
+    for c in cases:
+        classes = set()
+        for e in c[conclusion_key]:
+            if e['type'] in ['violation', 'no-violation']:
+                if 'base_article' in e and e['base_article'] in encoded_outcomes:
+                    g = encoded_outcomes[e['base_article']]
+                    if filter_classes is None or e['base_article'] in filter_classes:
+                        classes.add(g if e['type'] == 'violation' else -g)
+        opposed_classes = any(-g in classes for g in classes)
+        if len(classes) > 0 and not opposed_classes:
             for e in c[conclusion_key]:
                 if e['type'] in ['violation', 'no-violation']:
                     if 'base_article' in e and e['base_article'] in encoded_outcomes:
-                        g = encoded_outcomes[e['base_article']]
                         if filter_classes is None or e['base_article'] in filter_classes:
-                            classes.append('{}:{}'.format(g, 1 if e['type'] == 'violation' else 0))
-            classes = list(set(classes))
-            opposed_classes = any(
-                [e for e in classes if e.split(':')[0] + ':' + str(abs(1 - int(e.split(':')[-1]))) in classes])
-            if len(classes) > 0 and not opposed_classes:
-                f.write('0:{} '.format(feature_to_encoded[u'{}={}'.format('itemid', c['itemid'])]))
-                f.write(' '.join(classes) + '\n')
-                for e in c[conclusion_key]:
-                    if e['type'] in ['violation', 'no-violation']:
-                        if 'base_article' in e and e['base_article'] in encoded_outcomes:
-                            if filter_classes is None or e['base_article'] in filter_classes:
-                                if e['base_article'] not in outcome_distribution:
-                                    outcome_distribution[e['base_article']] = {'violation': 0, 'no-violation': 0}
-                                outcome_distribution[e['base_article']][e['type']] += 1
-                                if name != 'multilabel':
-                                    break
-                for k, v in c.items():
-                    if k in keys:
-                        encoded_case.append('{}:{}'.format(feature_index[k], feature_to_encoded[u'{}={}'.format(k, v)]))
-                    elif k in keys_list:
-                        for e in v:
-                            encoded_case.append(
-                                '{}:{}'.format(feature_index[k], feature_to_encoded[u'{}_has_{}'.format(k, e)]))
-
-                nb_features += len(encoded_case)
-                f_d.write(' '.join(map(str, encoded_case)) + '\n')
-                f_db.write(' '.join(map(str, encoded_case)) + ' ')
-                f_dt.write(' '.join(map(str, encoded_case)) + ' ')
-                dataset_size += 1
-                dataset_full_doc_id.append(c['itemid'])
-                with open(os.path.join(processed_folder, 'bow', '{}_bow.txt'.format(c['itemid'])), 'r') as bow_doc:
-                    bow = bow_doc.read()
-                    bow = bow.split()
-                    bow = ['{}:{}'.format(offset + int(b.split(':')[0]), b.split(':')[1]) for b in bow]
-                    f_db.write(' '.join(map(str, bow)) + ' \n')
-                    f_b.write(' '.join(map(str, bow)) + ' \n')
-                    nb_features += len(bow)
-                with open(os.path.join(processed_folder, 'tfidf', '{}_tfidf.txt'.format(c['itemid'])),
-                          'r') as tfidf_doc:
-                    tfidf = tfidf_doc.read()
-                    tfidf = tfidf.split()
-                    tfidf = ['{}:{}'.format(offset + int(b.split(':')[0]), b.split(':')[1]) for b in tfidf]
-                    f_t.write(' '.join(map(str, tfidf)) + ' \n')
-                    f_dt.write(' '.join(map(str, tfidf)) + ' \n')
-
-                max_feature = nb_features if nb_features > max_feature else max_feature
-                min_feature = nb_features if nb_features < min_feature else min_feature
-                avg_feature += nb_features
-
-        f.close()
-        f_db.close()
-        f_dt.close()
-        f_d.close()
-
-    with open(os.path.join(processed_folder, 'feature_to_id.dict'), 'r') as d, open(
-            os.path.join(output_path, 'features_text.json'), 'w') as f:
-        features = json.loads(d.read())
-        for k in features.keys():
-            features[k] = int(features[k]) + offset
-        json.dump(features, f, indent=4)
-        d.close()
-        f.close()
+                            if e['base_article'] not in outcome_distribution:
+                                outcome_distribution[e['base_article']] = {'violation': 0, 'no-violation': 0}
+                            outcome_distribution[e['base_article']][e['type']] += 1
+                            if name != 'multilabel':
+                                break
+            encoded_case = []
+            for k, v in c.items():
+                if k in keys:
+                    encoded_case.append(feature_to_encoded[u'{}={}'.format(k, v)])
+                elif k in keys_list:
+                    for e in v:
+                        encoded_case.append(feature_to_encoded[u'{}_has_{}'.format(k, e)])
+            row = row_of[c['itemid']]
+            nb_features = len(encoded_case) + int(bow.indptr[row + 1] - bow.indptr[row])
+            itemids.append(c['itemid'])
+            labels.append(sorted(classes, key=abs))
+            descriptive.append(encoded_case)
+            rows.append(row)
+            dataset_size += 1
+            max_feature = nb_features if nb_features > max_feature else max_feature
+            min_feature = nb_features if nb_features < min_feature else min_feature
+            avg_feature += nb_features
+
+    # All the representations share the same feature indices: descriptive features then text features
+    export_dataset(output_path, {
+        'descriptive': (one_hot(descriptive, offset), 0),
+        'BoW': (bow[rows], offset),
+        'TF_IDF': (tfidf[rows], offset),
+    }, {
+        'descriptive': ['descriptive'],
+        'BoW': ['BoW'],
+        'TF_IDF': ['TF_IDF'],
+        'descriptive+BoW': ['descriptive', 'BoW'],
+        'descriptive+TF_IDF': ['descriptive', 'TF_IDF'],
+    }, itemids, labels, len(encoded_outcomes))
+
+    features = serializer.load(os.path.join(processed_folder, 'feature_to_id.dict'))
+    for k in features.keys():
+        features[k] = int(features[k]) + offset
+    serializer.dump(features, os.path.join(output_path, 'features_text.json'))
 
     statistics = {
         name: {
@@ -119,34 +119,20 @@ def generate_dataset(cases, keys, keys_list, encoded_outcomes, feature_index, fe
         statistics[name]['prevalence'][cl]['violation_normalized'] = 1. * statistics[name]['prevalence'][cl][
             'violation'] / dataset_size
 
-    with open(os.path.join(output_path, 'statistics_datasets.json'), 'w') as f:
-        json.dump(statistics, f, indent=4)
-        f.close()
+    serializer.dump(statistics, os.path.join(output_path, 'statistics_datasets.json'))
 
-    with open(os.path.join(output_path, 'variables_descriptive.json'), 'w') as f:
-        json.dump(feature_index, f, indent=4)
-        f.close()
+    serializer.dump(feature_index, os.path.join(output_path, 'variables_descriptive.json'))
 
-    with open(os.path.join(output_path, 'features_descriptive.json'), 'w') as f:
-        json.dump(feature_to_encoded, f, indent=4)
-        f.close()
+    serializer.dump(feature_to_encoded, os.path.join(output_path, 'features_descriptive.json'))
 
-    with open(os.path.join(output_path, 'outcomes_variables.json'), 'w') as f:
-        json.dump(encoded_outcomes, f, indent=4)
-        f.close()
+    serializer.dump(encoded_outcomes, os.path.join(output_path, 'outcomes_variables.json'))
 
 
-def get_files(doc_ids, input_folder_bow, input_folder):
+def get_files(doc_ids, input_folder):
+    itemids = serializer.load(os.path.join(input_folder, ROW_INDEX))
     if doc_ids:
-        files = []
-        for f in listdir(input_folder_bow):
-            if isfile(join(input_folder_bow, f)) and '_bow.txt' in f and f.split('_')[0] in doc_ids:
-                files.append(os.path.join(input_folder, f))
-    else:
-        files = [os.path.join(input_folder, f) for f in listdir(input_folder_bow) if isfile(join(input_folder_bow, f))
-                 if '_bow.txt' in f]
-
-    return files
+        itemids = [i for i in itemids if i in doc_ids]
+    return itemids
 
 
 def run(console, build, title, doc_ids=None, articles=[], processed_folder='all', force=True):
@@ -154,11 +140,9 @@ def run(console, build, title, doc_ids=None, articles=[], processed_folder='all'
     global print
     print = __console.print
 
-    suffix = '_{}'.format(processed_folder)
-    input_file = os.path.join(build, 'raw', 'cases_info', 'raw_cases_info{}.json'.format(suffix))
+    input_folder_cases = os.path.join(build, 'raw', 'cases_info')
     input_folder = os.path.join(build, 'structured')
     output_folder = os.path.join(build, 'datasets')
-    input_folder_bow = os.path.join(input_folder, 'bow')
 
     print(Markdown("- **Step configuration**"))
     print(TAB + '> Step folder: {}'.format(output_folder))
@@ -166,22 +150,17 @@ def run(console, build, title, doc_ids=None, articles=[], processed_folder='all'
 
     # Get the list of cases s.t. we have a BoW and TF-IDF representation
 
-    files = get_files(doc_ids, input_folder_bow, input_folder)
-
-    id_list = [f.split('/')[-1].split('_')[0] for f in files]
+    id_list = get_files(doc_ids, input_folder)
 
     # Read the case info
     cases = []
     try:
-        with open(input_file, 'r') as f:
-            content = f.read()
-            cases = json.loads(content)
+        # Keep only the items in id_list
+        cases = CaseStore(input_folder_cases).load(processed_folder, itemids=id_list)
     except Exception as e:
         print(e)
         exit(1)
 
-    # Filter the cases info to keep only the items in id_list
-    cases = [c for c in cases if c['itemid'] in id_list]
     conclusion_key = 'conclusion' if processed_folder != 'multiclass' else 'mc_conclusion'
     cases = [c for c in cases if conclusion_key in c]
 
@@ -225,7 +204,7 @@ def run(console, build, title, doc_ids=None, articles=[], processed_folder='all'
     feature_to_encoded = {}
     count = 0
     for k, s in feature_to_value.items():
-        for v in s:
+        for v in s or []:
             if k in keys:
                 feature_to_encoded[u'{}={}'.format(k, v)] = count
             elif k in keys_list:
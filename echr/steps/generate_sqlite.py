@@ -1,10 +1,10 @@
 from playhouse.shortcuts import dict_to_model
 from datetime import datetime
 import argparse
-import json
 import os
 from os import listdir
 from os.path import isfile
+from echr.utils import serializer
 from echr.utils.logger import getlogger
 from echr.utils.cli import TAB
 from rich.markdown import Markdown
@@ -86,8 +86,7 @@ def populate_database(console, build, update, doc_ids):
         ) as progress:
             task = progress.add_task("Adding...", total=len(cases_files), error="", doc=cases_files[0].split('/')[-1])
             for f in cases_files:
-                with open(f, 'r') as f:
-                    case = json.load(f)
+                case = serializer.load(f)
                 entity = Case.get_or_none(Case.itemid == case['itemid'])
                 error = ""
                 if entity is None:
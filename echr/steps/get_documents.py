@@ -1,12 +1,22 @@
 #!/bin/python3
 import argparse
-import requests
-import json
+import asyncio
+import functools
+import hashlib
 import os
+import random
+import ssl
 import urllib3
-from concurrent.futures import ThreadPoolExecutor
+import zipfile
+from datetime import datetime
+from urllib.parse import urlsplit
 
+import aiohttp
+
+from echr.utils import serializer
+from echr.utils.case_store import CaseStore
 from echr.utils.folders import make_build_folder
+from echr.utils.http import get_client
 from echr.utils.logger import getlogger
 from echr.utils.cli import TAB
 from rich.markdown import Markdown
@@ -25,6 +35,11 @@ urllib3.util.ssl_.DEFAULT_CIPHERS = 'ALL:@SECLEVEL=1'
 BASE_URL = "https://hudoc.echr.coe.int/app/conversion/"
 PERMA_URL = "https://hudoc.echr.coe.int/eng?i="
 MAX_RETRY = 5
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 30
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_SAVE_INTERVAL = 100
+WRITE_BUFFER_SIZE = 1 << 20  # bytes received before a write to disk
 
 
 def get_files(doc_ids, id_list):
@@ -41,6 +56,321 @@ def get_files(doc_ids, id_list):
     return id_list, in_build, not_in_build
 
 
+def get_url(doc_id):
+    if doc_id[1]:
+        return BASE_URL + "docx/?library=ECHR&filename=please_give_me_the_document.docx&id=" + doc_id[0].strip()
+    return BASE_URL + "docx/pdf?library=ECHR&filename=please_give_me_the_document.pdf&id=" + doc_id[0].strip()
+
+
+def get_filename(doc_id, folder):
+    if doc_id[1]:
+        filename = "%s.docx" % (doc_id[0].strip())
+    else:
+        filename = "%s.pdf" % (doc_id[0].strip())
+    return os.path.join(folder, filename)
+
+
+def get_ssl_context():
+    # HUDOC requires the same weak ciphers as the ones allowed for urllib3
+    context = ssl.create_default_context()
+    context.set_ciphers('ALL:@SECLEVEL=1')
+    return context
+
+
+def backoff(attempt):
+    """
+        Delay before retrying a request, using exponential backoff with full jitter
+
+        :param attempt: number of failed attempts
+        :type attempt: int
+        :return: delay in seconds
+        :rtype: float
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+def file_checksum(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(folder):
+    try:
+        return serializer.load(os.path.join(folder, MANIFEST_FILE))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_FILE)
+    serializer.dump(manifest, path + '.tmp', sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_complete(filename):
+    """
+        Check if a document downloaded without manifest entry is complete
+
+        :param filename: path to a .docx or .pdf document
+        :type filename: str
+        :return: True if the document is not truncated
+        :rtype: bool
+    """
+    if filename.endswith('.docx'):
+        return zipfile.is_zipfile(filename)
+    with open(filename, 'rb') as f:
+        f.seek(max(0, os.path.getsize(filename) - 1024))
+        return b'%%EOF' in f.read()
+
+
+def manifest_entry(filename, etag=None, last_modified=None):
+    return {
+        'filename': os.path.basename(filename),
+        'size': os.path.getsize(filename),
+        'sha256': file_checksum(filename),
+        'etag': etag,
+        'last_modified': last_modified,
+        'fetched_at': datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+    }
+
+
+def load_validators(tmp_filename):
+    """
+        Get the server validators of a partial download and the number of bytes already received
+
+        :return: validators and size of the partial file
+        :rtype: (dict, int)
+    """
+    if os.path.isfile(tmp_filename) and os.path.isfile(tmp_filename + '.json'):
+        return serializer.load(tmp_filename + '.json'), os.path.getsize(tmp_filename)
+    return {}, 0
+
+
+async def run_in_thread(fn, *args, **kwargs):
+    """
+        Run a blocking function in the default executor such that the event loop keeps serving the downloads
+
+        Equivalent to asyncio.to_thread, which is not available before Python 3.9.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+
+def write_file(filename, mode, data):
+    with open(filename, mode) as f:
+        f.write(data)
+
+
+async def write_response(response, filename, mode):
+    """
+        Write the body of a response to a file
+
+        The body is written by blocks of WRITE_BUFFER_SIZE bytes, in a thread such that the event loop keeps
+        serving the other downloads. The bytes received before an interruption are written as well, to resume
+        the download.
+
+        :param response: response to a document request
+        :type response: aiohttp.ClientResponse
+        :param filename: path to the file
+        :type filename: str
+        :param mode: 'wb' to write a new file, 'ab' to append to a partial download
+        :type mode: str
+    """
+    buffer = []
+    size = 0
+    try:
+        async for block in response.content.iter_chunked(1 << 16):
+            buffer.append(block)
+            size += len(block)
+            if size >= WRITE_BUFFER_SIZE:
+                await run_in_thread(write_file, filename, mode, b''.join(buffer))
+                buffer, size, mode = [], 0, 'ab'
+    finally:
+        if buffer or mode == 'wb':
+            await run_in_thread(write_file, filename, mode, b''.join(buffer))
+
+
+def complete_download(tmp_filename, filename, expected=None):
+    """
+        Check the size of a downloaded document and move it to its final location
+
+        :param expected: expected size in bytes, if known
+        :type expected: int
+    """
+    size = os.path.getsize(tmp_filename)
+    if expected is not None and size != expected:
+        raise IncompleteDownload('{} bytes received, {} expected'.format(size, expected))
+    os.replace(tmp_filename, filename)
+    remove_partial(tmp_filename)
+
+
+def remove_partial(tmp_filename):
+    for f in [tmp_filename, tmp_filename + '.json']:
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+
+
+async def download(session, client, semaphore, url, filename, entry=None):
+    """
+        Download a document to a temporary file renamed once the download is complete
+
+        An interrupted download is resumed with a Range request if the server validators of the partial file
+        are known. If a manifest entry is given, the document is revalidated with a conditional request.
+
+        :param entry: manifest entry of the current version of the document
+        :type entry: dict
+        :return: number of attempts, last error (None on success) and manifest entry of the document
+        :rtype: (int, str, dict)
+    """
+    tmp_filename = filename + '.part'
+    error = None
+    for attempt in range(MAX_RETRY):
+        if attempt:
+            await asyncio.sleep(backoff(attempt - 1))
+        try:
+            async with semaphore:
+                await asyncio.sleep(client.bucket(urlsplit(url).netloc).reserve())
+                # Documents are already compressed: the body is requested as is, such that its size can be checked
+                # and a partial download resumed with a byte range
+                headers = {'Accept-Encoding': 'identity'}
+                offset = 0
+                validators, size = await run_in_thread(load_validators, tmp_filename)
+                if validators.get('etag') or validators.get('last_modified'):
+                    offset = size
+                    headers['Range'] = 'bytes={}-'.format(offset)
+                    headers['If-Range'] = validators.get('etag') or validators.get('last_modified')
+                elif entry is not None and os.path.isfile(filename):
+                    if entry.get('etag'):
+                        headers['If-None-Match'] = entry['etag']
+                    if entry.get('last_modified'):
+                        headers['If-Modified-Since'] = entry['last_modified']
+                async with session.get(url, headers=headers) as r:
+                    if r.status == 304:
+                        return attempt + 1, None, entry
+                    encoded = r.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+                    if r.status == 206 and r.headers.get('Content-Range', '').startswith('bytes {}-'.format(offset)) \
+                            and not encoded:
+                        expected = int(r.headers['Content-Range'].split('/')[-1])
+                        mode = 'ab'
+                    elif r.status == 200:
+                        # aiohttp decodes the body: its size is not the length sent by the server
+                        expected = None if encoded else r.content_length
+                        mode = 'wb'
+                        validators = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+                    else:
+                        raise aiohttp.ClientResponseError(r.request_info, r.history, status=r.status,
+                                                          message=r.reason or '')
+                    try:
+                        # The body is read before any other await: aiohttp drops the bytes already received
+                        # once the connection fails
+                        await write_response(r, tmp_filename, mode)
+                    finally:
+                        if mode == 'wb' and not encoded:  # An encoded body cannot be resumed
+                            await run_in_thread(serializer.dump, validators, tmp_filename + '.json', pretty=False)
+            await run_in_thread(complete_download, tmp_filename, filename, expected)
+            new_entry = await run_in_thread(manifest_entry, filename, validators.get('etag'),
+                                            validators.get('last_modified'))
+            return attempt + 1, None, new_entry
+        except aiohttp.ClientResponseError as e:
+            error = '{}: {}'.format(e.__class__.__name__, e)
+            remove_partial(tmp_filename)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError, IncompleteDownload) as e:
+            # The partial file is kept to resume the download
+            error = '{}: {}'.format(e.__class__.__name__, e)
+        log.debug('({}/{}) {} {}'.format(attempt + 1, MAX_RETRY, url, error))
+    return MAX_RETRY, error, None
+
+
+async def download_documents(id_list, folder, force, progress=None, task=None):
+    """
+        Download the documents concurrently
+
+        Documents recorded in the manifest with the same size are considered complete. With force,
+        they are revalidated with a conditional request instead of being downloaded again.
+
+        :param id_list: list of documents (id, is_docx)
+        :type id_list: [(str, bool)]
+        :param folder: path where to save the documents
+        :type folder: str
+        :param force: revalidate existing documents
+        :type force: bool
+        :return: download report
+        :rtype: dict
+    """
+    client = get_client()
+    report = {'downloaded': [], 'not_modified': [], 'skipped': [], 'failed': []}
+    manifest = load_manifest(folder)
+    changes = [0]
+    semaphore = asyncio.Semaphore(client.concurrency)
+    connector = aiohttp.TCPConnector(limit=client.concurrency, ssl=get_ssl_context())
+    timeout = aiohttp.ClientTimeout(total=client.timeout)
+
+    save_lock = asyncio.Lock()
+
+    async def save():
+        # A copy is saved such that the downloads can record their entries meanwhile
+        async with save_lock:
+            await run_in_thread(save_manifest, folder, dict(manifest))
+
+    async def record(doc_id, entry):
+        manifest[doc_id] = entry
+        changes[0] += 1
+        if changes[0] % MANIFEST_SAVE_INTERVAL == 0:
+            await save()
+
+    async def get_document(session, doc_id):
+        filename = get_filename(doc_id, folder)
+        entry = manifest.get(doc_id[0])
+        exists = os.path.isfile(filename)
+        if exists and entry is None and await run_in_thread(is_complete, filename):
+            # Document downloaded before the manifest existed
+            entry = await run_in_thread(manifest_entry, filename)
+            await record(doc_id[0], entry)
+        complete = exists and entry is not None and entry.get('size') == os.path.getsize(filename)
+        if complete and not force:
+            report['skipped'].append(doc_id[0])
+            error = "\n| Skip as document exists already"
+        else:
+            url = client.resolve(get_url(doc_id))
+            attempts, error, new_entry = await download(session, client, semaphore, url, filename,
+                                                        entry if complete else None)
+            if error is None and new_entry is entry:
+                report['not_modified'].append(doc_id[0])
+                error = "\n| Document not modified"
+            elif error is None:
+                await record(doc_id[0], new_entry)
+                report['downloaded'].append(doc_id[0])
+                error = "\n| Request complete, see [cyan]%s" % (filename)
+            else:
+                report['failed'].append({
+                    'doc_id': doc_id[0],
+                    'url': url,
+                    'permalink': PERMA_URL + doc_id[0].strip(),
+                    'attempts': attempts,
+                    'error': error
+                })
+                log.error('Failed to fetch document {}: {}'.format(doc_id[0], error))
+                error = '\n| Failed to fetch document {}'.format(doc_id[0])
+        if progress is not None:
+            progress.update(task, advance=1, error=error, doc=doc_id[0])
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[get_document(session, doc_id) for doc_id in id_list])
+    finally:
+        if changes[0]:
+            await save()
+    return report
+
+
 def get_documents(console, id_list, folder, update, force):
     """
         Get documents according to the specified list
@@ -51,45 +381,12 @@ def get_documents(console, id_list, folder, update, force):
         :type folder: str
         :param update: overwrite existing documents
         :type: bool
+        :param force: revalidate existing documents
+        :type: bool
+        :return: download report with the downloaded, not modified, skipped and failed documents
+        :rtype: dict
     """
-
-    def get_documents_step(doc_id, progress, task):
-        if doc_id[1]:
-            filename = "%s.docx" % (doc_id[0].strip())
-        else:
-            filename = "%s.pdf" % (doc_id[0].strip())
-        filename = os.path.join(folder, filename)
-        if not os.path.isfile(filename) or force:
-            if doc_id[1]:
-                url = BASE_URL + "docx/?library=ECHR&filename=please_give_me_the_document.docx&id=" + doc_id[0].strip()
-            else:
-                url = BASE_URL + "docx/pdf?library=ECHR&filename=please_give_me_the_document.pdf&id=" + doc_id[
-                    0].strip()
-            for j in range(MAX_RETRY):
-                try:
-                    r = requests.get(url, stream=True, timeout=5)
-                    if not r.ok:
-                        raise Exception()
-                    with open(filename, 'wb') as f:
-                        for block in r.iter_content(1024):
-                            f.write(block)
-                    error = "\n| Request complete, see [cyan]%s" % (filename)
-                    break
-                except Exception as e:
-                    try:  # Delete the incorrect file if it exists
-                        os.remove(filename)
-                    except OSError:
-                        pass
-                    log.debug(e)
-                    error = '\n| ({}/{}) Failed to fetch document {}'.format(
-                        j + 1, MAX_RETRY, doc_id[0])
-                    error += '\n| URL: %s' % (url)
-                    error += '\n| Permalink: %s' % (PERMA_URL + doc_id[0].strip())
-                    progress.update(task, advance=0, error=error, doc=doc_id[0])
-        else:
-            error = "\n| Skip as document exists already"
-        progress.update(task, advance=1, error=error, doc=doc_id[0])
-
+    report = {'downloaded': [], 'not_modified': [], 'skipped': [], 'failed': []}
     if id_list:
         with Progress(
                 TAB + "> Downloading... [IN PROGRESS]\n",
@@ -101,13 +398,21 @@ def get_documents(console, id_list, folder, update, force):
                 console=console
         ) as progress:
             task = progress.add_task("Downloading...", total=len(id_list), error="", doc=id_list[0][0])
-            f = lambda x: get_documents_step(x, progress, task)
-            with ThreadPoolExecutor(16) as executor:
-                executor.map(f, id_list)
+            report = asyncio.run(download_documents(id_list, folder, force, progress, task))
 
-        print(TAB + "> Downloading... [green][DONE]\n", )
+        print(TAB + "> Downloaded: {} | Not modified: {} | Skipped: {} | Failed: {}".format(
+            len(report['downloaded']), len(report['not_modified']), len(report['skipped']), len(report['failed'])))
+        if report['failed']:
+            print(TAB + "> Downloading... [yellow][WARNING]")
+            for failure in report['failed']:
+                print(TAB + "  [bold yellow]:warning: Failed to fetch document {} ({})".format(
+                    failure['doc_id'], failure['error']))
+                print(TAB + "    Permalink: {}".format(failure['permalink']))
+        else:
+            print(TAB + "> Downloading... [green][DONE]\n", )
     else:
         print(TAB + "> No documents to download")
+    return report
 
 
 def run(console, build, title, doc_ids=None, force=False, update=False):
@@ -116,16 +421,15 @@ def run(console, build, title, doc_ids=None, force=False, update=False):
     print = __console.print
 
     print(Markdown("- **Step configuration**"))
-    input_file = os.path.join(build, 'raw', 'cases_info', 'raw_cases_info_all.json')
+    input_folder = os.path.join(build, 'raw', 'cases_info')
     output_folder = os.path.join(build, 'raw', 'judgments')
     print(TAB + '> Step folder: {}'.format(os.path.join(build, 'raw', 'judgments')))
-    make_build_folder(console, output_folder, force, strict=False)
+    # Existing documents are revalidated against the manifest instead of deleting the folder
+    make_build_folder(console, output_folder, False, strict=False)
     id_list = []
     try:
-        with open(input_file, 'r') as f:
-            content = f.read()
-            cases = json.loads(content)
-            id_list = [(i['itemid'], i["application"].startswith("MS WORD")) for i in cases]
+        cases = CaseStore(input_folder).load(columns=['itemid', 'application'])
+        id_list = [(i['itemid'], i["application"].startswith("MS WORD")) for i in cases]
     except Exception as e:
         print(e)
         return
@@ -142,7 +446,7 @@ def run(console, build, title, doc_ids=None, force=False, update=False):
             print(TAB + "> [red] No documents to download")
             return
 
-    get_documents(console, id_list, output_folder, update, force)
+    return get_documents(console, id_list, output_folder, update, force)
 
 
 def main(args):
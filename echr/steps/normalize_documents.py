@@ -1,14 +1,17 @@
 import argparse
-import json
 import logging
 import os
 from os import listdir
 from os.path import isfile, join
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 from nlp.data import load_text_file
+from nlp.ngrams import NGramCounter
 from nlp.preprocessing import prepareText, frequencies
+from nlp.resources import LEMMAS, LEMMA_CACHE_SIZE, configure_lemmas
 
+from echr.utils import serializer
 from echr.utils.folders import make_build_folder
 from echr.utils.logger import getlogger
 from echr.utils.cli import TAB
@@ -86,7 +89,65 @@ def get_files(doc_ids, input_folder):
     return files
 
 
-def run(console, build, title, doc_ids=None, force=False, update=False):
+def init_worker(lemmatization=True, lemma_cache_size=LEMMA_CACHE_SIZE, lemma_file=None):
+    """
+        Load the NLP resources (tokenizer, stopwords, tagger and lemmatizer) once per process
+
+        :param lemmatization: whether the lemmatizer is used
+        :type lemmatization: bool
+        :param lemma_cache_size: maximal number of lemmas kept in memory
+        :type lemma_cache_size: int
+        :param lemma_file: file where the lemmas are saved between builds, if any
+        :type lemma_file: str
+    """
+    configure_lemmas(lemma_cache_size, lemma_file)
+    prepareText('The judges were sitting in chambers', lemmatization)
+
+
+def normalize_document(p, output_folder, ngrams_config, force=False, update=False, lemmatization=True):
+    """
+        Normalize a document, compute its n-grams and save them in {id}_normalized.txt
+
+        :param p: path to the document without conclusion
+        :type p: str
+        :param output_folder: folder where to save the normalized document
+        :type output_folder: str
+        :param ngrams_config: rules to extract and filter ngrams
+        :type ngrams_config: dict
+        :param update: keep the documents already normalized
+        :type update: bool
+        :return: document identifier, status, normalized tokens or n-grams of the document, error and lemma table usage
+        :rtype: dict
+    """
+    doc_id = p.split('/')[-1].split('_text_without_conclusion.txt')[0]
+    result = {'doc_id': doc_id, 'status': 'normalized', 'tokens': [], 'grams': [], 'error': None}
+    hits, misses = LEMMAS.hits, LEMMAS.misses
+    filename = os.path.join(output_folder, '{}_normalized.txt'.format(doc_id))
+    try:
+        if update and os.path.isfile(filename):
+            result['status'] = 'skipped'
+            result['grams'] = load_text_file(filename).split()
+        else:
+            tokens = normalized_step(load_text_file(p), force=force, lemmatization=lemmatization)
+            grams = ngram_step(tokens, ngrams_config, force=force)
+            merged = [g for n_grams in grams.values() for g in n_grams]
+            with open(filename, 'w') as file:
+                file.write(' '.join(merged))
+            if all(len(n_grams) == max(0, len(tokens) - i + 1) for i, n_grams in grams.items()):
+                # All the n-grams are kept: the parent process counts them from the tokens
+                result['tokens'] = tokens
+            else:
+                result['grams'] = merged
+    except Exception as e:
+        log.debug("{} {}".format(p, e))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+        result['tokens'], result['grams'] = [], []
+    result['lemmas'] = {'hits': LEMMAS.hits - hits, 'misses': LEMMAS.misses - misses, 'new': LEMMAS.new_entries()}
+    return result
+
+
+def run(console, build, title, doc_ids=None, force=False, update=False, workers=1):
     __console = console
     global print
     print = __console.print
@@ -100,17 +161,23 @@ def run(console, build, title, doc_ids=None, force=False, update=False):
     except Exception as e:
         print('Cannot retrieve n-grams configuration. Details: {}'.format(e))
         exit(5)
+    lemmas_config = config()['steps']['normalize'].get('lemmas') or {}
+    lemma_cache_size = int(lemmas_config.get('cache_size', LEMMA_CACHE_SIZE))
+    lemma_file = lemmas_config.get('file') or None
 
     print(TAB + '> Step folder: {}'.format(output_folder))
     make_build_folder(console, output_folder, force, strict=False)
+    workers = max(1, int(workers or 1))
+    print(TAB + '> Workers: {}'.format(workers))
 
     files = get_files(doc_ids, input_folder)
 
-    raw_corpus = []
-    corpus_id = []
-    print(Markdown('- **Load documents**'))
+    full_dictionary = NGramCounter()
+    lemma_stats = Counter()
+    failed = []
+    print(Markdown('- **Generate language model**'))
     with Progress(
-            TAB + "> Loading in memory... [IN PROGRESS]",
+            TAB + "> Normalize and compute ngrams... [IN PROGRESS]\n",
             BarColumn(30),
             TimeRemainingColumn(),
             "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
@@ -118,107 +185,58 @@ def run(console, build, title, doc_ids=None, force=False, update=False):
             transient=True,
             console=console
     ) as progress:
-        task = progress.add_task("Loading...", total=len(files), error="",
-                                 doc=files[0].split('/')[-1].split('_text_without_conclusion.txt')[0])
-        for i, p in enumerate(files):
-            error = ""
-            doc_id = p.split('/')[-1].split('_text_without_conclusion.txt')[0]
-            try:
-                raw_corpus.append(load_text_file(p))
-                corpus_id.append(doc_id)
-            except Exception as e:
-                error = '\n| {}'.format('Could not load the document')
-                log.debug(p, e)
-            progress.update(task, advance=1, error=error, doc=doc_id)
-    print(TAB + "> Loading in memory... [green][DONE]")
-
-    normalized_tokens = []
-    print(Markdown('- **Generate language model**'))
-    try:
-        with Progress(
-                TAB + "> Normalize... [IN PROGRESS]\n",
-                BarColumn(30),
-                TimeRemainingColumn(),
-                "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
-                "{task.fields[error]}",
-                transient=True,
-                console=console
-        ) as progress:
-            task = progress.add_task("Compute tokens...", total=len(raw_corpus), error="", doc=corpus_id[0])
-            for i, doc in enumerate(raw_corpus):
-                filename = os.path.join(output_folder, '{}_normalized.txt'.format(corpus_id[i]))
-                if not update or not os.path.isfile(filename):
-                    normalized_tokens.append(normalized_step(doc, force=force, lemmatization=True))
-                else:
-                    with open(filename, 'r') as f:
-                        normalized_tokens.extend(f.read().split())
-                        f.close()
-                progress.update(task, advance=1, error=error, doc=corpus_id[i])
-    except Exception as e:
-        print(TAB + '[bold red]:double_exclamation_mark: Could not normalized the tokens. Details: {}'.format(e))
-        exit(40)
-    print(TAB + "> Normalize... [green][DONE]")
-
-    all_grams = []
-    doc_grammed = []
-    try:
-        with Progress(
-                TAB + "> Compute ngrams... [IN PROGRESS]\n",
-                BarColumn(30),
-                TimeRemainingColumn(),
-                "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
-                "{task.fields[error]}",
-                transient=True,
-                console=console
-        ) as progress:
-            task = progress.add_task("Compute tokens...", total=len(corpus_id), error="", doc=corpus_id[0])
-            for i, doc in enumerate(normalized_tokens):
+        task = progress.add_task("Compute tokens...", total=len(files), error="",
+                                 doc=files[0].split('/')[-1].split('_text_without_conclusion.txt')[0] if files else '')
+        args = ([output_folder] * len(files), [ngrams_config] * len(files), [force] * len(files),
+                [update] * len(files))
+        init_args = (True, lemma_cache_size, lemma_file)
+        if workers > 1:
+            executor = ProcessPoolExecutor(workers, initializer=init_worker, initargs=init_args)
+            results = executor.map(normalize_document, files, *args,
+                                   chunksize=max(1, min(16, len(files) // (4 * workers))))
+        else:
+            executor = None
+            if files:
+                init_worker(*init_args)
+            results = map(normalize_document, files, *args)
+        try:
+            for result in results:
                 error = ""
-                filename = os.path.join(output_folder, '{}_normalized.txt'.format(corpus_id[i]))
-                if not update or not os.path.isfile(filename):
-                    grams = ngram_step(doc, ngrams_config, force=force)
-                    merged = []
-                    for g in grams.values():
-                        merged.extend(g)
-                    doc_grammed.append(merged)
-                    all_grams.extend(merged)
-                else:
+                if result['status'] == 'skipped':
                     error = "\n| Load document as already normalized."
-                    with open(filename, 'r') as f:
-                        all_grams.extend(f.read().split())
-                        doc_grammed.append(None)
-                        f.close()
-                progress.update(task, advance=1, error=error, doc=corpus_id[i])
-    except Exception:
-        console.print_exception()
-    print(TAB + "> Compute ngrams... [green][DONE]")
-
-    f = Counter(all_grams)
-    with open(os.path.join(output_folder, 'full_dictionary.txt'), 'w') as outfile:
-        json.dump(f, outfile, indent=4, sort_keys=True)
+                elif result['status'] == 'failed':
+                    failed.append((result['doc_id'], result['error']))
+                    error = "\n| Could not normalize {}\n| {}".format(result['doc_id'], result['error'])
+                full_dictionary.add_tokens(result['tokens'], len(ngrams_config))
+                full_dictionary.add_grams(result['grams'])
+                lemma_stats.update(hits=result['lemmas']['hits'], misses=result['lemmas']['misses'])
+                if executor is not None:
+                    LEMMAS.update(result['lemmas']['new'])
+                progress.update(task, advance=1, error=error, doc=result['doc_id'])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    if not failed:
+        print(TAB + "> Normalize and compute ngrams... [green][DONE]")
+    else:
+        print(TAB + "> Normalize and compute ngrams... [yellow][WARNING]")
+        print(TAB + "[bold yellow]:warning: Some documents could not be normalized: {}".format(
+            ', '.join(e[0] for e in failed)))
+
+    total = lemma_stats['hits'] + lemma_stats['misses']
+    print(TAB + '> Lemma cache: {} hits, {} misses ({:.2f}% hit rate)'.format(
+        lemma_stats['hits'], lemma_stats['misses'], 100. * lemma_stats['hits'] / max(1, total)))
+    if lemma_file:
+        LEMMAS.save(lemma_file)
+        print(TAB + '> Save the lemmas in {} [green][DONE]'.format(lemma_file))
+
+    serializer.dump(full_dictionary.to_dict(), os.path.join(output_folder, 'full_dictionary.txt'), sort_keys=True)
     print(TAB + '> Save the full dictionary [green][DONE]')
 
-    with Progress(
-            TAB + "> Save normalized documents... [IN PROGRESS]\n",
-            BarColumn(30),
-            TimeRemainingColumn(),
-            "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
-            "{task.fields[error]}",
-            transient=True,
-            console=console
-    ) as progress:
-        task = progress.add_task("Compute tokens...", total=len(doc_grammed), error="", doc=corpus_id[0])
-        for i, doc in enumerate(doc_grammed):
-            if doc is not None:
-                with open(os.path.join(output_folder, '{}_normalized.txt'.format(corpus_id[i])), 'a') as file:
-                    file.write(' '.join(doc))
-            progress.update(task, advance=1, error=error, doc=corpus_id[i])
-    print(TAB + '> Save normalized documents... [green][DONE]')
-
 
 def main(args):
     console = Console(record=True)
-    run(console, args.build, args.title, args.doc_ids, args.force, args.u)
+    run(console, args.build, args.title, args.doc_ids, args.f, args.u, args.workers)
 
 
 def parse_args(parser):
@@ -233,6 +251,7 @@ if __name__ == "__main__":
     parser.add_argument('--build', type=str, default="./build/echr_database/")
     parser.add_argument('--title', type=str)
     parser.add_argument('--doc_ids', type=str, default=None, nargs='+')
+    parser.add_argument('--workers', type=int, default=1)
     parser.add_argument('-f', action='store_true')
     parser.add_argument('-u', action='store_true')
     args = parse_args(parser)
@@ -1,9 +1,7 @@
 import argparse
-import json
 import os
 from os import listdir
 from os.path import isfile
-import shutil
 from genson import SchemaBuilder
 from enum import Enum
 import copy
@@ -16,6 +14,7 @@ import operator
 import sys
 import time
 
+from echr.utils import serializer
 from echr.utils.folders import make_build_folder
 from echr.utils.cli import TAB
 from echr.utils.logger import getlogger
@@ -47,8 +46,7 @@ def format_structured_json(cases_list):
     scl = {}
     decision_body = {}
     for name in cases_list:
-        with open(name, 'r') as f:
-            c = json.load(f)
+        c = serializer.load(name)
         c['representedby'] = [r for r in c['representedby'] if r != 'N/A']
         representents[c['appno']] = {'representedby': c['representedby']}
         extractedapp[c['appno']] = {'appnos': c['extractedappno']}
@@ -276,9 +274,10 @@ def run(console, build, title, doc_ids=None, output_prefix='cases', force=False)
 
     print(Markdown("- **Step configuration**"))
     print(TAB + "> Prepare release folder structure")
-    paths = ['unstructured', 'structured', 'raw']
-    for p in paths:
-        make_build_folder(console, os.path.join(build, p), force, strict=False)
+    make_build_folder(console, os.path.join(build, 'unstructured'), force, strict=False)
+    # The raw and structured folders are shared with other steps and must not be deleted
+    for p in ['structured', 'raw']:
+        make_build_folder(console, os.path.join(build, p), force=False, strict=False)
 
     print(Markdown("- **Normalize database**"))
     input_folder = os.path.join(build, 'raw', 'preprocessed_documents')
@@ -290,15 +289,13 @@ def run(console, build, title, doc_ids=None, output_prefix='cases', force=False)
     print(TAB + "> Prepare unstructured cases in {:0.4f}s [green][DONE]".format(stop - start))
     # Unstructured
     start = time.perf_counter()
-    with open(os.path.join(build, 'unstructured', 'cases.json'), 'w') as outfile:
-        outfile.write('[\n')
+    with open(os.path.join(build, 'unstructured', 'cases.json'), 'wb') as outfile:
+        outfile.write(b'[\n')
         for i, f in enumerate(cases_files):
-            with open(f) as json_file:
-                data = json.load(json_file)
-                json.dump(data, outfile, indent=4)
-                if i != len(cases_files) - 1:
-                    outfile.write(',\n')
-        outfile.write('\n]')
+            outfile.write(serializer.dumps(serializer.load(f)))
+            if i != len(cases_files) - 1:
+                outfile.write(b',\n')
+        outfile.write(b'\n]')
     stop = time.perf_counter()
 
     # Structured
@@ -330,11 +327,9 @@ def run(console, build, title, doc_ids=None, output_prefix='cases', force=False)
     }
 
     output_path = os.path.join(build, 'structured')
-    with open(os.path.join(output_path, 'flat_cases.json'), 'w') as outfile:
-        json.dump(flat_cases, outfile, indent=4)
+    serializer.dump(flat_cases, os.path.join(output_path, 'flat_cases.json'))
 
-    with open(os.path.join(output_path, 'schema_hint.json'), 'w') as outfile:
-        json.dump(schema_hints, outfile, indent=4)
+    serializer.dump(schema_hints, os.path.join(output_path, 'schema_hint.json'))
 
     X = flat_cases
     start = time.perf_counter()
@@ -349,8 +344,7 @@ def run(console, build, title, doc_ids=None, output_prefix='cases', force=False)
         ('flat_domain_mapping', flat_domain_mapping)
     ]
     for f in json_files:
-        with open(os.path.join(output_path, '{}_{}.json'.format(output_prefix, f[0])), 'w') as outfile:
-            json.dump(f[1], outfile, indent=4)
+        serializer.dump(f[1], os.path.join(output_path, '{}_{}.json'.format(output_prefix, f[0])))
 
     os.remove(os.path.join(output_path, 'flat_cases.json'))
     os.remove(os.path.join(output_path, 'cases_flat_schema.json'))
@@ -362,46 +356,25 @@ def run(console, build, title, doc_ids=None, output_prefix='cases', force=False)
     matrice_appnos = {}
     for k, v in extractedapp.items():
         matrice_appnos[k] = {e: 1 for e in v['appnos']}
-    with open(os.path.join(output_path, 'matrice_appnos.json'), 'w') as outfile:
-        json.dump(matrice_appnos, outfile, indent=4)
+    serializer.dump(matrice_appnos, os.path.join(output_path, 'matrice_appnos.json'))
 
     print(TAB + '> Generate scl matrice [green][DONE]')
     matrice_scl = {}
     for k, v in scl.items():
         matrice_scl[k] = {e: 1 for e in v['scl']}
-    with open(os.path.join(output_path, 'matrice_scl.json'), 'w') as outfile:
-        json.dump(matrice_scl, outfile, indent=4)
+    serializer.dump(matrice_scl, os.path.join(output_path, 'matrice_scl.json'))
 
     print(TAB + '> Generate representatives matrice [green][DONE]')
     matrice_representedby = {}
     for k, v in representatives.items():
         matrice_representedby[k] = {e: 1 for e in v['representedby']}
-    with open(os.path.join(output_path, 'matrice_representatives.json'), 'w') as outfile:
-        json.dump(matrice_representedby, outfile, indent=4)
+    serializer.dump(matrice_representedby, os.path.join(output_path, 'matrice_representatives.json'))
 
     print(TAB + '> Generate decision body matrice [green][DONE]')
     matrice_decision_body = {}
     for k, v in decision_body.items():
         matrice_decision_body[k] = {k: v for k, v in v['role'].items()}
-    with open(os.path.join(output_path, 'matrice_decision_body.json'), 'w') as outfile:
-        json.dump(matrice_decision_body, outfile, indent=4)
-
-    print(TAB + '> Create archives [green][DONE]')
-    # Raw
-    shutil.make_archive(os.path.join(build, 'raw', 'judgments'), 'zip',
-                        os.path.join(build, 'raw', 'judgments'))
-
-    # All
-    from zipfile import ZipFile
-    with ZipFile(os.path.join(build, 'all.zip'), 'w') as zipObj:
-        # Iterate over all the files in directory
-        folders = ['unstructured', 'raw', 'structured']
-        for f in folders:
-            for folderName, _, filenames in os.walk(os.path.join(build, f)):
-                for filename in filenames:
-                    if not filename.endswith('.zip'):
-                        filePath = os.path.join(folderName, filename)
-                        zipObj.write(filePath)
+    serializer.dump(matrice_decision_body, os.path.join(output_path, 'matrice_decision_body.json'))
 
 
 def main(args):
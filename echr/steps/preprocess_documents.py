@@ -1,10 +1,10 @@
 import argparse
-import json
+import io
 import os
 from os import listdir
 from os.path import isfile, join
 import re
-import shutil
+from collections import Counter
 from pathlib import Path
 import pandas as pd
 from docx.api import Document
@@ -13,10 +13,14 @@ from docx.oxml.text.paragraph import CT_P
 from docx.table import Table as DocTable
 from docx.text.paragraph import Paragraph
 import zipfile
-from unidecode import unidecode
+from concurrent.futures import ProcessPoolExecutor
 
+from echr.utils import serializer
+from echr.utils.case_store import CaseStore
+from echr.utils.docx_reader import DocxBodyReader, UnsupportedDocument
 from echr.utils.folders import make_build_folder
 from echr.utils.logger import getlogger, get_log_folder
+from echr.utils.matching import JudgeMatcher, PrefixMatcher
 from echr.utils.cli import TAB
 from rich.markdown import Markdown
 from rich.console import Console
@@ -31,7 +35,13 @@ log = getlogger()
 
 __console = Console(record=True)
 
-TMP = '/tmp/echr_tmp_doc'
+DOCUMENT_XML = 'word/document.xml'
+BACKENDS = ['python-docx', 'lxml']
+DEFAULT_BACKEND = 'python-docx'
+# Comments and CDATA sections are matched to be skipped, attribute values may contain '>'
+SMART_TAG = re.compile(rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>'
+                       rb'|<(/?)w:(smartTag|smartTagPr)(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*?(/?)>', re.S)
+SECTIONS = [(b'<!--', b'-->'), (b'<![CDATA[', b']]>')]
 
 # Possible tags for each type of section
 tags = {
@@ -197,17 +207,18 @@ internal_section_reference = {
 }
 
 JUDGES_PER_COUNTRY = None
+JUDGE_MATCHER = None
+SECTION_TAGGER = PrefixMatcher(internal_section_reference)
 
 
 def load_judges_info(build):
     global JUDGES_PER_COUNTRY
     if JUDGES_PER_COUNTRY is None:
-        with open(Path(build) / 'raw/judges_per_country.json') as json_file:
-            JUDGES_PER_COUNTRY = json.load(json_file)
+        JUDGES_PER_COUNTRY = serializer.load(Path(build) / 'raw/judges_per_country.json')
     return JUDGES_PER_COUNTRY
 
 
-def tag_elements(parsed):
+def tag_elements(parsed, stats=None):
     """
         Tag the elements in the parsed document.
 
@@ -216,20 +227,99 @@ def tag_elements(parsed):
 
         :param parsed: parsed document
         :type parsed: dict
+        :param stats: if provided, updated with the number of tagged and untagged elements
+                      and the number of matches per reference string
+        :type stats: dict
         :return: parsed document with internal section references
         :rtype: dict
     """
     for i, section in enumerate(parsed['elements']):
-        for section_reference, values in internal_section_reference.items():
-            if any(section['content'].strip().upper().startswith(v.upper()) for v in values):
-                parsed['elements'][i]['section_name'] = section_reference
-                break
-        # if not 'section_name' in parsed['elements'][i]:
-        #    print('Could not tag section {}'.format(section['content']))
-        #    print(section['content'])
+        section_reference, value = SECTION_TAGGER.match(section['content'].strip())
+        if section_reference is not None:
+            parsed['elements'][i]['section_name'] = section_reference
+        if stats is not None:
+            stats['tagged' if value is not None else 'untagged'] += 1
+            if value is not None:
+                stats['references'][value] += 1
     return parsed
 
 
+def new_tagging_stats():
+    return {'tagged': 0, 'untagged': 0, 'references': Counter()}
+
+
+def retag_document(filename_parsed, stats=None):
+    """
+        Tag again the elements of a preprocessed document and regenerate its text without conclusion
+
+        :param filename_parsed: path to the preprocessed document
+        :type filename_parsed: str
+        :param stats: tagging statistics to update
+        :type stats: dict
+    """
+    parsed = serializer.load(filename_parsed)
+    for doc_name, elements in parsed['content'].items():
+        for e in elements:
+            e.pop('section_name', None)
+        tag_elements({'elements': elements}, stats)
+        id_doc = doc_name.split('.')[0]
+        with open(os.path.join(os.path.dirname(filename_parsed), '{}_text_without_conclusion.txt'.format(id_doc)),
+                  'w') as toutfile:
+            toutfile.write(json_to_text({'elements': elements},
+                                        text_only=True,
+                                        except_section=['conclusion'],
+                                        attachments=parsed.get('attachments', {}).get(doc_name)))
+    serializer.dump(parsed, filename_parsed, sort_keys=True)
+
+
+def retag_documents(console, folder):
+    """
+        Tag again all the preprocessed documents of a folder without parsing the judgments
+
+        :param folder: folder containing the preprocessed documents
+        :type folder: str
+        :return: tagging statistics
+        :rtype: dict
+    """
+    files = sorted(os.path.join(folder, f) for f in listdir(folder) if f.endswith('_parsed.json'))
+    stats = new_tagging_stats()
+    failed = []
+    with Progress(
+            TAB + "> Tag documents... [IN PROGRESS]\n",
+            BarColumn(30),
+            TimeRemainingColumn(),
+            "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})",
+            transient=True,
+            console=console
+    ) as progress:
+        task = progress.add_task("Tagging...", total=len(files), doc='')
+        for f in files:
+            id_doc = os.path.basename(f).split('_parsed')[0]
+            try:
+                retag_document(f, stats)
+            except Exception as e:
+                log.debug("{} {}".format(f, e))
+                failed.append((id_doc, e))
+            progress.update(task, advance=1, doc=id_doc)
+    if failed:
+        print(TAB + "> Tag documents... [yellow][WARNING]")
+        for id_doc, e in failed:
+            print(TAB + "  [bold yellow]:warning: Could not tag {}: {}".format(id_doc, e))
+    else:
+        print(TAB + "> Tag documents... [green][DONE]")
+    print_tagging_stats(stats)
+    return stats
+
+
+def print_tagging_stats(stats):
+    total = stats['tagged'] + stats['untagged']
+    print(TAB + '> Top-level elements tagged: {}/{} ({:.2f}%)'.format(stats['tagged'], total,
+                                                                    100. * stats['tagged'] / max(1, total)))
+    unused = [v for values in internal_section_reference.values() for v in values if v not in stats['references']]
+    print(TAB + '> Section references never matched: {}/{}'.format(
+        len(unused), sum(len(values) for values in internal_section_reference.values())))
+
+
 def format_title(line):
     """
         Format title
@@ -275,6 +365,7 @@ class Node:
     """
         Represent a rooted tree
     """
+    __slots__ = ('parent', 'level', 'content', 'elements', 'node_type')
 
     def __init__(self, parent=None, level=0, content=None, node_type=None):
         """
@@ -334,24 +425,50 @@ def sanitize_decision_body_line(line):
     return line
 
 
-def map_judge(line, build):
+def get_judge_matcher(build):
+    """
+        Get the judge matcher built from the judges information, rebuilt only if the information changes
+    """
+    global JUDGE_MATCHER
     judges_per_country = load_judges_info(build)
-    for _, v in judges_per_country.items():
-        for name, judge in v.items():
-            matching_name = name.upper()
-            if unidecode(matching_name) in unidecode(line.upper().replace('-', ' ')):
-                return name, judge
-    return None, None
+    if JUDGE_MATCHER is None or JUDGE_MATCHER[0] is not judges_per_country:
+        JUDGE_MATCHER = (judges_per_country, JudgeMatcher(judges_per_country))
+    return JUDGE_MATCHER[1]
+
+
+def map_judge(line, build):
+    return get_judge_matcher(build).match(line)
 
 
-def parse_document(doc, doc_id, build):
+def docx_elements(doc):
     """
-        Parse a document object to a tree
+        Iterate over the children of the body of a python-docx document
 
         :param doc: document object
         :type doc: Document
-        :return: tree
-        :rtype: Node
+        :return: kind ('paragraph', 'table' or 'other'), content and function returning the paragraph style name
+        :rtype: generator of (str, object, callable)
+    """
+    for e in doc.element.body:
+        if isinstance(e, CT_Tbl):
+            yield 'table', DocTable(e, doc), None
+        elif isinstance(e, CT_P):
+            p = Paragraph(e, doc)
+            yield 'paragraph', p.text, lambda p=p: p.style.name
+        else:
+            yield 'other', None, None
+
+
+def build_tree(elements):
+    """
+        Build the tree of a document from the children of its body
+
+        Tables and other elements are placed according to the style of the previous paragraph.
+
+        :param elements: children of the body as returned by docx_elements or DocxBodyReader
+        :type elements: iterable
+        :return: root of the tree, tables and decision body
+        :rtype: (Node, dict, str)
     """
 
     def format_table_tag(table_index):
@@ -361,22 +478,21 @@ def parse_document(doc, doc_id, build):
     decision_body = ""
     appender = Node()  # Top level node
     table_index = 0
-    for e in doc.element.body:
+    for kind, content, paragraph_style in elements:
         node_type = None
-        if isinstance(e, CT_Tbl):
-            table = DocTable(e, doc)
+        if kind == 'table':
             table_tag = format_table_tag(table_index)
             table_index += 1
-            attachments[table_tag] = word_table_to_json(table)
+            attachments[table_tag] = word_table_to_json(content)
             line_content = table_tag  # Use the tag as content for the current tree node
             node_type = 'table'
-        elif isinstance(e, CT_P):
-            p = Paragraph(e, doc)
-            line_content = p.text.strip()  # para_to_text(p)
+        elif kind == 'paragraph':
+            style = paragraph_style
+            line_content = content.strip()
             if not len(line_content):
                 continue
 
-        level = tag_to_level.get(p.style.name, 0)
+        level = tag_to_level.get(style(), 0)
         if level > 0:
             if appender.level == 0 and not len(appender.elements) and level > 1:
                 pass
@@ -398,45 +514,74 @@ def parse_document(doc, doc_id, build):
 
     while (root.level != 0):
         root = root.parent
+    return root, attachments, decision_body
 
-    def print_tree(root):
-        """
-            Utilitary function to print tree
 
-            :param root: root of the tree
-            :type root: Node
-        """
-        print("LEVEL {} {} {}".format(root.level, ' ' * root.level * 2,
-                                      root.content.encode('utf-8') if root.content else 'ROOT'))
-        if len(root.elements) == 0:
-            return
-        else:
-            for e in root.elements:
-                print_tree(e)
+def node_to_json(node):
+    res = {
+        'content': node.content,
+        'elements': []
+    }
+    if node.node_type:
+        res['type'] = node.node_type
+    return res
 
-    def tree_to_json(root, res):
-        """
-            Recursively convert a tree into json
-
-            :param root: root of the tree
-            :type root: Node
-            :param res: where to store result
-            :type: res: dict
-            :return: remaining tree
-            :rtype: Node
-        """
-        node = {
-            'content': root.content,
-            'elements': []
-        }
-        if root.node_type:
-            node['type'] = root.node_type
-        for e in root.elements:
-            node['elements'].append(tree_to_json(e, node))
-        return node
-
-    parsed = {'elements': []}
-    parsed['elements'] = tree_to_json(root, parsed)['elements']
+
+def tree_to_json(root):
+    """
+        Convert a tree into json
+
+        The tree is traversed with an explicit stack rather than recursively.
+
+        :param root: root of the tree
+        :type root: Node
+        :return: JSON representation of the tree
+        :rtype: dict
+    """
+    res = node_to_json(root)
+    stack = [(root, res)]
+    while stack:
+        node, json_node = stack.pop()
+        for e in node.elements:
+            json_child = node_to_json(e)
+            json_node['elements'].append(json_child)
+            if e.elements:
+                stack.append((e, json_child))
+    return res
+
+
+def parse_document(doc, doc_id, build, tagging_stats=None):
+    """
+        Parse a document object to a tree
+
+        :param doc: document object
+        :type doc: Document
+        :param tagging_stats: section tagging statistics to update
+        :type tagging_stats: dict
+        :return: tree
+        :rtype: Node
+    """
+    root, attachments, decision_body = build_tree(docx_elements(doc))
+    return parse_tree(root, attachments, decision_body, doc_id, build, tagging_stats)
+
+
+def parse_tree(root, attachments, decision_body, doc_id, build, tagging_stats=None):
+    """
+        Convert a document tree to JSON and parse its decision body
+
+        :param root: root of the tree
+        :type root: Node
+        :param attachments: tables of the document
+        :type attachments: dict
+        :param decision_body: decision body lines
+        :type decision_body: str
+        :param tagging_stats: section tagging statistics to update
+        :type tagging_stats: dict
+        :return: parsed document, tables and decision body members not parsed
+        :rtype: (dict, dict, list)
+    """
+
+    parsed = {'elements': tree_to_json(root)['elements']}
     decision_body_not_parsed = []
     parsed['_decision_body'] = decision_body
     decision_body, not_parsed = parse_body(decision_body, build) if decision_body else ([], [])
@@ -445,7 +590,7 @@ def parse_document(doc, doc_id, build):
             {'doc_id': doc_id, 'token': t}
         )
     parsed['decision_body'] = decision_body
-    parsed = tag_elements(parsed)
+    parsed = tag_elements(parsed, tagging_stats)
 
     return parsed, attachments, decision_body_not_parsed
 
@@ -493,19 +638,21 @@ def json_table_to_text(table):
 def json_to_text_(doc, text_only=True, except_section=None, attachments=None):
     except_section = [] if except_section is None else except_section
     res = []
-    if not len(doc['elements']):
-        node_type = doc.get('type')
-        attachment = None
-        if attachments:
-            attachment = attachments.get(doc['content'])
-        if node_type == 'table' and attachment:
-            res.append(json_table_to_text(attachment))
-        else:
-            res.append(format_paragraph(doc['content']))
-    # text_only: remove the titles
-    for e in doc['elements']:
-        if not 'section_name' in e or e['section_name'] not in except_section:
-            res.extend(json_to_text_(e, text_only=text_only, except_section=except_section, attachments=attachments))
+    stack = [doc]
+    while stack:
+        doc = stack.pop()
+        if not len(doc['elements']):
+            node_type = doc.get('type')
+            attachment = None
+            if attachments:
+                attachment = attachments.get(doc['content'])
+            if node_type == 'table' and attachment:
+                res.append(json_table_to_text(attachment))
+            else:
+                res.append(format_paragraph(doc['content']))
+        # text_only: remove the titles
+        stack.extend(e for e in reversed(doc['elements'])
+                     if not 'section_name' in e or e['section_name'] not in except_section)
     return res
 
 
@@ -541,50 +688,170 @@ def select_parser(doc):
         return PARSER['new']
 
 
+def stream_document(docx):
+    """
+        Build the tree of a document with the lxml backend
+
+        The body is read once: the parser is selected while the tree is built.
+        If the tree cannot be built, the rest of the body is still read to select the parser.
+
+        :param docx: document
+        :type docx: file
+        :return: parser name, tree (root, tables and decision body) and error raised while building the tree
+        :rtype: (str, tuple, Exception)
+    """
+    reader = DocxBodyReader(docx, OLD_PARSER_TAGS)
+    elements = iter(reader)
+    tree, error = None, None
+    try:
+        tree = build_tree(elements)
+    except UnsupportedDocument:
+        raise
+    except Exception as e:
+        for _ in elements:
+            pass
+        if not reader.done:
+            raise
+        error = e
+    return PARSER['old'] if reader.old_parser else PARSER['new'], tree, error
+
+
 def get_files(doc_ids, input_folder):
     if doc_ids:
         files = []
         for f in listdir(input_folder):
-            if isfile(join(input_folder, f)) and '.docx' in f and f.split('.')[0] in doc_ids:
+            if isfile(join(input_folder, f)) and f.endswith('.docx') and f.split('.')[0] in doc_ids:
                 files.append(os.path.join(input_folder, f))
     else:
         files = [os.path.join(input_folder, f) for f in listdir(input_folder) if isfile(join(input_folder, f)) if
-                 '.docx' in f]
+                 f.endswith('.docx')]
     return files
 
 
-def run(console, build, title, doc_ids=None, force=False, update=False):
+def preprocess_document(p, output_folder, build, case, update=False, backend=DEFAULT_BACKEND):
+    """
+        Preprocess a judgment and save the result
+
+        The function is executed in the worker processes and returns everything the parent process
+        needs to aggregate the statistics of the step.
+
+        :param p: path to the document
+        :type p: str
+        :param output_folder: folder where to save the preprocessed document
+        :type output_folder: str
+        :param build: build path
+        :type build: str
+        :param case: case information, None if the document is not in the case information
+        :type case: dict
+        :param update: skip the document if it has already been preprocessed
+        :type update: bool
+        :param backend: library used to read the document body, 'python-docx' or 'lxml'
+        :type backend: str
+        :return: document id, status (parsed, skipped or failed), parser, error, decision body members not parsed,
+                 judge matching and section tagging statistics
+        :rtype: dict
+    """
+    id_doc = p.split('/')[-1].split('.')[0]
+    result = {'id_doc': id_doc, 'status': 'parsed', 'parser': None, 'error': None, 'decision_body_not_parsed': [],
+              'judges': {'lines': 0, 'matched': 0}, 'tagging': new_tagging_stats()}
+    filename_parsed = os.path.join(output_folder, '{}_parsed.json'.format(id_doc))
+    if update and os.path.isfile(filename_parsed):
+        result['status'] = 'skipped'
+        return result
+    try:
+        p_ = update_docx(p)
+        streamed = None
+        if backend == 'lxml':
+            try:
+                streamed = stream_document(p_)
+            except UnsupportedDocument:  # e.g. no styles part, python-docx uses its default styles
+                p_.seek(0)
+        if streamed is None:
+            doc = Document(p_)
+            parser, tree, error = select_parser(doc), None, None
+        else:
+            parser, tree, error = streamed
+        result['parser'] = parser
+        if parser == 'NEW':
+            if error is not None:
+                raise error
+            if tree is None:
+                tree = build_tree(docx_elements(doc))
+            matcher = get_judge_matcher(build)
+            before = dict(matcher.stats)
+            parsed, attachments, db_not_parsed = parse_tree(*tree, id_doc, build, result['tagging'])
+            result['decision_body_not_parsed'] = db_not_parsed
+            result['judges'] = {k: matcher.stats[k] - v for k, v in before.items()}
+            if case is None:
+                raise KeyError(id_doc)
+            parsed.update(case)
+            with open(os.path.join(output_folder, '{}_text_without_conclusion.txt'.format(id_doc)),
+                      'w') as toutfile:
+                toutfile.write(json_to_text(parsed,
+                                            text_only=True,
+                                            except_section=['conclusion'],
+                                            attachments=attachments))
+            parsed['documents'] = ['{}.docx'.format(id_doc)]
+            parsed['content'] = {
+                '{}.docx'.format(id_doc): parsed['elements']
+            }
+            parsed['attachments'] = {
+                '{}.docx'.format(id_doc): attachments
+            }
+            del parsed['elements']
+            serializer.dump(parsed, filename_parsed, sort_keys=True)
+        else:
+            raise Exception("OLD parser is not available yet.")
+    except Exception as e:
+        log.debug("{} {}".format(p, e))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    return result
+
+
+def run(console, build, title, doc_ids=None, force=False, update=False, workers=1, retag=False,
+        backend=DEFAULT_BACKEND):
     __console = console
     global print
     print = __console.print
 
     print(Markdown("- **Step configuration**"))
-    input_file = os.path.join(build, 'raw', 'cases_info', 'raw_cases_info_all.json')
+    input_folder_cases = os.path.join(build, 'raw', 'cases_info')
     input_folder = os.path.join(build, 'raw', 'judgments')
     output_folder = os.path.join(build, 'raw', 'preprocessed_documents')
     print(TAB + '> Step folder: {}'.format(output_folder))
+    if retag:
+        print(Markdown('- **Tag preprocessed documents**'))
+        retag_documents(console, output_folder)
+        return
     make_build_folder(console, output_folder, force, strict=False)
+    workers = max(1, int(workers or 1))
+    print(TAB + '> Workers: {}'.format(workers))
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError('Unknown DOCX backend {}, expected one of {}'.format(backend, ', '.join(BACKENDS)))
+    print(TAB + '> DOCX backend: {}'.format(backend))
 
     stats = {
         'parser_type': {
             'OLD': 0,
             'NEW': 0
-        }
+        },
+        'judges': {
+            'lines': 0,
+            'matched': 0
+        },
+        'tagging': new_tagging_stats()
     }
 
-    with open(input_file, 'r') as f:
-        content = f.read()
-        cases = json.loads(content)
-        if doc_ids:
-            cases_index = {c['itemid']: i for i, c in enumerate(cases) if c['itemid'] in doc_ids}
-        else:
-            cases_index = {c['itemid']: i for i, c in enumerate(cases)}
-        f.close()
-
     correctly_parsed = 0
     failed = []
 
     files = get_files(doc_ids, input_folder)
+    cases = CaseStore(input_folder_cases).lookup([p.split('/')[-1].split('.')[0] for p in files])
+
+    def get_case(p):
+        return cases.get(p.split('/')[-1].split('.')[0])
 
     decision_body_not_parsed = []
     print(Markdown('- **Preprocess documents**'))
@@ -598,50 +865,40 @@ def run(console, build, title, doc_ids=None, force=False, update=False):
             console=console
     ) as progress:
         task = progress.add_task("Preprocessing...", total=len(files), error="",
-                                 doc=files[0].split('/')[-1].split('.')[0])
-        for _, p in enumerate(files):
-            error = ""
-            id_doc = p.split('/')[-1].split('.')[0]
-            filename_parsed = os.path.join(output_folder, '{}_parsed.json'.format(id_doc))
-            if not update or not os.path.isfile(filename_parsed):
-                try:
-                    p_ = update_docx(p)
-                    doc = Document(p_)
-                    parser = select_parser(doc)
-                    stats['parser_type'][parser] += 1
-                    if parser == 'NEW':
-                        parsed, attachments, db_not_parsed = parse_document(doc, id_doc, build)
-                        decision_body_not_parsed.extend(db_not_parsed)
-                        parsed.update(cases[cases_index[id_doc]])
-                        with open(os.path.join(output_folder, '{}_text_without_conclusion.txt'.format(id_doc)),
-                                  'w') as toutfile:
-                            toutfile.write(json_to_text(parsed,
-                                                        text_only=True,
-                                                        except_section=['conclusion'],
-                                                        attachments=attachments))
-                        parsed['documents'] = ['{}.docx'.format(id_doc)]
-                        parsed['content'] = {
-                            '{}.docx'.format(id_doc): parsed['elements']
-                        }
-                        parsed['attachments'] = {
-                            '{}.docx'.format(id_doc): attachments
-                        }
-                        del parsed['elements']
-                        with open(filename_parsed, 'w') as outfile:
-                            json.dump(parsed, outfile, indent=4, sort_keys=True)
-                        correctly_parsed += 1
-                    else:
-                        raise Exception("OLD parser is not available yet.")
-                except Exception as e:
-                    # __console.print_exception()
-                    failed.append((id_doc, e))
+                                 doc=files[0].split('/')[-1].split('.')[0] if files else '')
+        args = ([output_folder] * len(files), [build] * len(files), [get_case(p) for p in files],
+                [update] * len(files), [backend] * len(files))
+        if workers > 1:
+            executor = ProcessPoolExecutor(workers)
+            results = executor.map(preprocess_document, files, *args,
+                                   chunksize=max(1, min(32, len(files) // (4 * workers))))
+        else:
+            executor = None
+            results = map(preprocess_document, files, *args)
+        try:
+            for result in results:
+                error = ""
+                id_doc = result['id_doc']
+                if result['parser'] is not None:
+                    stats['parser_type'][result['parser']] += 1
+                decision_body_not_parsed.extend(result['decision_body_not_parsed'])
+                for k, v in result['judges'].items():
+                    stats['judges'][k] += v
+                for k, v in result['tagging'].items():
+                    stats['tagging'][k] += v
+                if result['status'] == 'parsed':
+                    correctly_parsed += 1
+                elif result['status'] == 'skipped':
+                    error = '\n| Skip document because it is already processed'
+                    correctly_parsed += 1
+                else:
+                    failed.append((id_doc, result['error']))
                     error = "\n| Could not preprocess {}".format(id_doc)
-                    error += "\n| {}".format(e)
-                    log.debug("{} {}".format(p, e))
-            else:
-                error = '\n| Skip document because it is already processed'
-                correctly_parsed += 1
-            progress.update(task, advance=1, error=error, doc=id_doc)
+                    error += "\n| {}".format(result['error'])
+                progress.update(task, advance=1, error=error, doc=id_doc)
+        finally:
+            if executor is not None:
+                executor.shutdown()
     if correctly_parsed == len(files):
         print(TAB + "> Preprocess documents... [green][DONE]")
     else:
@@ -650,7 +907,10 @@ def run(console, build, title, doc_ids=None, force=False, update=False):
         print(TAB + "  [bold yellow]THE FINAL DATABASE WILL BE INCOMPLETE!")
     print(
         TAB + '> Correctly parsed: {}/{} ({:.4f}%)'.format(correctly_parsed, len(files),
-                                                           (100. * correctly_parsed) / len(files)))
+                                                           (100. * correctly_parsed) / max(1, len(files))))
+    print(TAB + '> Parser type: {}'.format(', '.join('{}: {}'.format(k, v) for k, v in stats['parser_type'].items())))
+    print(TAB + '> Decision body members matched: {}/{}'.format(stats['judges']['matched'], stats['judges']['lines']))
+    print_tagging_stats(stats['tagging'])
 
     if correctly_parsed != len(files):
         print(TAB + '> List of failed documents:')
@@ -667,64 +927,109 @@ def run(console, build, title, doc_ids=None, force=False, update=False):
         decision_body_not_parsed.to_html(f)
 
 
+def safe_cut(buffer):
+    """
+        Find the position up to which an XML buffer only contains complete tags
+
+        '<' is escaped in the text and in the attribute values: the content before the last '<' only contains
+        complete tags, unless the cut falls inside a comment or a CDATA section.
+
+        :param buffer: XML content
+        :type buffer: bytes
+        :return: position where to cut the buffer
+        :rtype: int
+    """
+    end = buffer.rfind(b'<')
+    moved = True
+    while moved and end > 0:
+        moved = False
+        for start, stop in SECTIONS:
+            i = buffer.rfind(start, 0, end)
+            if i == -1:
+                continue
+            j = buffer.find(stop, i + len(start))
+            if j == -1 or j + len(stop) > end:  # The cut would be inside the section
+                end, moved = i, True
+    return max(end, 0)
+
+
+def strip_smart_tags(chunks):
+    """
+        Remove the smartTag wrappers and their properties from a stream of XML chunks
+
+        The content of the smartTag elements (i.e. the runs) is kept. Chunks are cut before the last tag, which
+        might be incomplete, such that a tag spanning over two chunks is processed once complete.
+
+        :param chunks: XML content
+        :type chunks: iterable of bytes
+        :return: sanitized XML content
+        :rtype: generator of bytes
+    """
+    buffer = b''
+    in_properties = False
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks, None)
+        if chunk is not None:
+            buffer += chunk
+            end = safe_cut(buffer)
+            if not end:
+                continue
+            complete, buffer = buffer[:end], buffer[end:]
+        else:
+            complete, buffer = buffer, b''
+        position = 0
+        for tag in SMART_TAG.finditer(complete):
+            name = tag.group(2)
+            if name is None:  # Comment or CDATA section
+                continue
+            if not in_properties:
+                yield complete[position:tag.start()]
+            closing, self_closing = tag.group(1), tag.group(3)
+            if name == b'smartTagPr' and not self_closing:
+                in_properties = not closing
+            position = tag.end()
+        if not in_properties:
+            yield complete[position:]
+        if chunk is None:
+            break
+
+
 def update_docx(docname):
     """
         Update a docx such that it can be read by docx library.
 
         MSWord documents are a zip folder containing several XML files.
         As docx library cannot read 'smartTag', it is required to remove them.
-        To do so, we open the zip, access the main XML file and manually sanitize it.
+        To do so, we read the zip in memory and sanitize the main XML file while streaming it.
+        The original document is returned if it does not contain any 'smartTag'.
 
         :param docname: path to the document
         :type docname: str
-        :return: path to the new document
-        :rtype: str
+        :return: sanitized document
+        :rtype: io.BytesIO
     """
-    # Remove temporary folder and files
-    try:
-        shutil.rmtree(TMP)
-    except OSError:
-        pass
-
-    try:
-        os.remove('./_proxy.docx')
-    except OSError:
-        pass
-
-    # Extract the document
-    zip_ref = zipfile.ZipFile(docname, 'r')
-    zip_ref.extractall(TMP)
-    zip_ref.close()
-
-    # Sanitize
-    with open(os.path.join(TMP, 'word/document.xml'), 'r') as file:
-        content = file.read()
-        lines = content.split('>')
-        remove_open = True
-        for i, l in enumerate(lines):
-            if '<w:smartTag ' in l and remove_open:
-                del lines[i]
-                remove_open = False
-            if '</w:smartTag' == l and not remove_open:
-                del lines[i]
-                remove_open = True
-        file.close()
-    content = '>'.join(lines)
-
-    # Recompress the archive
-    with open(os.path.join(TMP, 'word/document.xml'), 'w') as file:
-        file.write(content)
-    shutil.make_archive('./proxy', 'zip', TMP)
-
-    output_file = './_proxy.docx'
-    os.rename('./proxy.zip', output_file)
-
-    return output_file
+    with open(docname, 'rb') as f:
+        content = f.read()
+    with zipfile.ZipFile(io.BytesIO(content), 'r') as zip_in:
+        with zip_in.open(DOCUMENT_XML) as f:
+            document = b''.join(strip_smart_tags(iter(lambda: f.read(1 << 16), b'')))
+        if len(document) == zip_in.getinfo(DOCUMENT_XML).file_size:  # Nothing removed
+            return io.BytesIO(content)
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as zip_out:
+            for item in zip_in.infolist():
+                data = document if item.filename == DOCUMENT_XML else zip_in.read(item.filename)
+                info = zipfile.ZipInfo(item.filename, item.date_time)
+                info.external_attr = item.external_attr
+                zip_out.writestr(info, data)
+    output.seek(0)
+    return output
 
 
 def main(args):
     console = Console(record=True)
-    run(console, args.build, args.title, args.doc_ids, args.force, args.u)
+    run(console, args.build, args.title, args.doc_ids, args.f, args.u, args.workers, args.retag, args.backend)
 
 
 def parse_args(parser):
@@ -740,6 +1045,10 @@ if __name__ == "__main__":
     parser.add_argument('--doc_ids', type=str, default=None, nargs='+')
     parser.add_argument('-f', action='store_true')
     parser.add_argument('-u', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--retag', action='store_true', help='Tag again the preprocessed documents')
+    parser.add_argument('--backend', type=str, default=DEFAULT_BACKEND, choices=BACKENDS,
+                        help='Library used to read the documents')
     args = parse_args(parser)
 
     main(args)
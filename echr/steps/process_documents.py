@@ -1,13 +1,20 @@
+from array import array
 import argparse
-import json
 import os
 from os import listdir
 from os.path import isfile, join
 from collections import Counter
 
-from gensim import corpora, models
+from gensim import corpora
+from gensim.corpora import HashDictionary
+import numpy as np
+from scipy import sparse
 from nlp.data import load_text_file
+from nlp.tfidf import tfidf as tfidf_matrix
+from nlp.topk import MisraGries
 
+from echr.utils import serializer
+from echr.utils.case_store import CaseStore
 from echr.utils.folders import make_build_folder
 from echr.utils.logger import getlogger
 from echr.utils.cli import TAB
@@ -24,6 +31,13 @@ log = getlogger()
 
 __console = Console(record=True)
 
+BOW_MATRIX = 'bow.npz'
+TFIDF_MATRIX = 'tfidf.npz'
+ROW_INDEX = 'itemids.json'
+VOCABULARY_MODES = ['exact', 'approximate', 'hashing']
+DEFAULT_VOCABULARY_MODE = 'exact'
+CANDIDATES_FACTOR = 10
+
 
 def get_files(doc_ids, input_folder, cases_index):
     if doc_ids:
@@ -40,12 +54,121 @@ def get_files(doc_ids, input_folder, cases_index):
     return files
 
 
-def run(console, build, title, limit_tokens, doc_ids=None, processed_folder='all', force=False, update=False):
+def load_documents(files):
+    """
+        Read the normalized documents one at a time
+
+        :param files: paths to the normalized documents
+        :type files: [str]
+        :return: document identifier, tokens and error message
+        :rtype: generator of (str, [str], str)
+    """
+    for p in files:
+        doc_id = p.split('/')[-1].split('_normalized.txt')[0]
+        try:
+            yield doc_id, load_text_file(p).split(), None
+        except Exception as e:
+            log.debug(p, e)
+            yield doc_id, None, 'Could not load the document'
+
+
+def bow_matrix(dictionary, documents):
+    """
+        Build the Bag-of-Words matrix of a stream of documents
+
+        :param dictionary: dictionary of the features
+        :type dictionary: gensim.corpora.Dictionary
+        :param documents: tokens of each document
+        :type documents: iterable of [str]
+        :return: one row per document, one column per feature
+        :rtype: scipy.sparse.csr_matrix
+    """
+    indptr = array('q', [0])
+    indices = array('i')
+    data = array('i')
+    for tokens in documents:
+        for f, v in dictionary.doc2bow(tokens):
+            indices.append(f)
+            data.append(v)
+        indptr.append(len(indices))
+    return sparse.csr_matrix((np.frombuffer(data, dtype=np.int32), np.frombuffer(indices, dtype=np.int32),
+                              np.frombuffer(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(dictionary)))
+
+
+def loaded_tokens(files, corpus_id):
+    """
+        Read the tokens of the documents which can be loaded and record their identifier in corpus_id
+    """
+    for doc_id, tokens, _ in load_documents(files):
+        if tokens is not None:
+            corpus_id.append(doc_id)
+            yield tokens
+
+
+def select_features(bow, candidates, limit):
+    """
+        Keep the most frequent features of a Bag-of-Words matrix
+
+        The occurrences of the candidates are counted exactly from the matrix, so the approximate counts
+        used to select the candidates do not change the final dictionary as long as it contains the most
+        frequent features.
+
+        :param bow: Bag-of-Words matrix over the candidates
+        :type bow: scipy.sparse.csr_matrix
+        :param candidates: dictionary of the candidates
+        :type candidates: gensim.corpora.Dictionary
+        :param limit: number of features to keep
+        :type limit: int
+        :return: dictionary of the kept features and Bag-of-Words matrix over these features
+        :rtype: (gensim.corpora.Dictionary, scipy.sparse.csr_matrix)
+    """
+    counts = np.asarray(bow.sum(axis=0)).ravel()
+    kept = np.argsort(-counts, kind='stable')[:limit]
+    dictionary = corpora.Dictionary([[candidates[i] for i in kept]])
+    columns = [candidates.token2id[dictionary[i]] for i in range(len(dictionary))]
+    bow = bow[:, columns].tocsr()
+    bow.sort_indices()
+    return dictionary, bow
+
+
+def export_text(console, matrix, corpus_id, output_folder, suffix, title):
+    """
+        Save each row of a matrix in {id}_{suffix}.txt as 'feature:value' pairs
+
+        :param matrix: document representation
+        :type matrix: scipy.sparse.csr_matrix
+        :param corpus_id: document identifier of each row
+        :type corpus_id: [str]
+        :param output_folder: folder where to save the documents
+        :type output_folder: str
+    """
+    with Progress(
+            TAB + "> {}... [IN PROGRESS]".format(title),
+            BarColumn(30),
+            TimeRemainingColumn(),
+            "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
+            "{task.fields[error]}",
+            transient=True,
+            console=console
+    ) as progress:
+        task = progress.add_task("Loading...", total=len(corpus_id), error="",
+                                 doc=corpus_id[0] if corpus_id else '')
+        for i, doc_id in enumerate(corpus_id):
+            row = slice(matrix.indptr[i], matrix.indptr[i + 1])
+            with open(os.path.join(output_folder, '{}_{}.txt'.format(doc_id, suffix)), 'w') as file:
+                for f, v in zip(matrix.indices[row].tolist(), matrix.data[row].tolist()):
+                    file.write('{}:{} '.format(f, v))
+            progress.update(task, advance=1, error="", doc=doc_id)
+    print(TAB + "> {}... [green][DONE]".format(title))
+
+
+def run(console, build, title, limit_tokens, doc_ids=None, processed_folder='all', force=False, update=False,
+        export_text_files=True, workers=1, vocabulary=DEFAULT_VOCABULARY_MODE):
     __console = console
     global print
     print = __console.print
 
-    input_file = os.path.join(build, 'raw', 'cases_info', 'raw_cases_info_{}.json'.format(processed_folder))
+    input_folder_cases = os.path.join(build, 'raw', 'cases_info')
     input_folder = os.path.join(build, 'raw', 'normalized_documents')
     output_folder = os.path.join(build, 'structured')
     output_folder_tfidf = os.path.join(output_folder, 'tfidf')
@@ -64,102 +187,80 @@ def run(console, build, title, limit_tokens, doc_ids=None, processed_folder='all
         exit(5)
     print(TAB + '> Read configuration [green][DONE]')
 
-    cases_index = {}
-    with open(input_file, 'r') as f:
-        content = f.read()
-        cases = json.loads(content)
-        cases_index = {c['itemid']: i for i, c in enumerate(cases)}
-        f.close()
+    cases_index = {itemid: i for i, itemid in enumerate(CaseStore(input_folder_cases).itemids(processed_folder))}
 
     files = get_files(doc_ids, input_folder, cases_index)
 
-    raw_corpus = []
-    corpus_id = []
+    vocabulary = vocabulary or DEFAULT_VOCABULARY_MODE
+    if vocabulary not in VOCABULARY_MODES:
+        raise ValueError('Unknown vocabulary mode {}, expected one of {}'.format(vocabulary,
+                                                                               ', '.join(VOCABULARY_MODES)))
+    print(TAB + '> Vocabulary: {}'.format(vocabulary))
+    limit_tokens = int(limit_tokens)
+
     print(Markdown('- **Create dictionary**'))
-    with Progress(
-            TAB + "> Loading in memory... [IN PROGRESS]",
-            BarColumn(30),
-            TimeRemainingColumn(),
-            "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
-            "{task.fields[error]}",
-            transient=True,
-            console=console
-    ) as progress:
-        task = progress.add_task("Loading...", total=len(files), error="",
-                                 doc=files[0].split('/')[-1].split('_normalized.txt')[0])
-        for i, p in enumerate(files):
-            error = ""
-            try:
-                doc_id = p.split('/')[-1].split('_normalized.txt')[0]
-                raw_corpus.append(load_text_file(p).split())
-                corpus_id.append(doc_id)
-            except Exception as e:
-                error = '\n| {}'.format('Could not load the document')
-                log.debug(p, e)
-            progress.update(task, advance=1, error=error, doc=doc_id)
-    print(TAB + "> Loading in memory... [green][DONE]")
-
-    # data = json.load(open('./full_dictionary.txt'))
-    f = [t for doc in raw_corpus for t in doc]
-    f = Counter(f)
-    # Load the raw dictionary
-    f = f.most_common(int(limit_tokens))
-    words = [w[0] for w in f]
-
-    # dictionary = corpora.Dictionary([all_grams])
+    loaded = files
+    if vocabulary != 'hashing':
+        counter = Counter() if vocabulary == 'exact' else MisraGries(CANDIDATES_FACTOR * limit_tokens)
+        loaded = []
+        with Progress(
+                TAB + "> Count the tokens... [IN PROGRESS]",
+                BarColumn(30),
+                TimeRemainingColumn(),
+                "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
+                "{task.fields[error]}",
+                transient=True,
+                console=console
+        ) as progress:
+            task = progress.add_task("Loading...", total=len(files), error="",
+                                     doc=files[0].split('/')[-1].split('_normalized.txt')[0] if files else '')
+            for p, (doc_id, tokens, error) in zip(files, load_documents(files)):
+                if tokens is not None:
+                    counter.update(tokens)
+                    loaded.append(p)
+                progress.update(task, advance=1, error='\n| {}'.format(error) if error else '', doc=doc_id)
+        print(TAB + "> Count the tokens... [green][DONE]")
+
+    corpus_id = []
+    documents = loaded_tokens(loaded, corpus_id)
     print(TAB + '> Create dictionary')
-    dictionary = corpora.Dictionary([words])
+    if vocabulary == 'exact':
+        # Load the raw dictionary
+        dictionary = corpora.Dictionary([[w[0] for w in counter.most_common(limit_tokens)]])
+        del counter
+        bow = bow_matrix(dictionary, documents)
+    elif vocabulary == 'approximate':
+        print(TAB + '> Candidates: {} (count error lower than {:.1f})'.format(len(counter), counter.error_bound()))
+        candidates = corpora.Dictionary([counter.candidates()])
+        del counter
+        dictionary, bow = select_features(bow_matrix(candidates, documents), candidates, limit_tokens)
+    else:
+        dictionary = HashDictionary(id_range=limit_tokens, debug=False)
+        bow = bow_matrix(dictionary, documents)
     dictionary.save(os.path.join(output_folder, 'dictionary.dict'))
-    with open(os.path.join(output_folder, 'feature_to_id.dict'), 'w') as outfile:
-        json.dump(dictionary.token2id, outfile, indent=4, sort_keys=True)
-    corpus = [dictionary.doc2bow(text) for text in raw_corpus]
+    feature_to_id = dictionary.token2id if vocabulary != 'hashing' else \
+        {'hash_{}'.format(i): i for i in range(limit_tokens)}
+    serializer.dump(feature_to_id, os.path.join(output_folder, 'feature_to_id.dict'), sort_keys=True)
+
     print(Markdown('- **Create language models**'))
-    with Progress(
-            TAB + "> Create Bag of Word... [IN PROGRESS]",
-            BarColumn(30),
-            TimeRemainingColumn(),
-            "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
-            "{task.fields[error]}",
-            transient=True,
-            console=console
-    ) as progress:
-        task = progress.add_task("Loading...", total=len(corpus), error="",
-                                 doc=corpus_id[0])
-        for i, doc in enumerate(corpus):
-            error = ""
-            filename = os.path.join(output_folder_bow, '{}_bow.txt'.format(corpus_id[i]))
-            # if update and not os.path.isfile(filename):
-            with open(filename, 'w') as file:
-                for f, v in doc:
-                    file.write('{}:{} '.format(f, v))
-            progress.update(task, advance=1, error=error, doc=corpus_id[i])
+    sparse.save_npz(os.path.join(output_folder, BOW_MATRIX), bow)
+    serializer.dump(corpus_id, os.path.join(output_folder, ROW_INDEX))
     print(TAB + "> Create Bag of Word... [green][DONE]")
 
-    tfidf = models.TfidfModel(corpus)
-    corpus_tfidf = tfidf[corpus]
-    with Progress(
-            TAB + "> Create TF-IDF... [IN PROGRESS]",
-            BarColumn(30),
-            TimeRemainingColumn(),
-            "| Document [blue]{task.fields[doc]} [white]({task.completed}/{task.total})"
-            "{task.fields[error]}",
-            transient=True,
-            console=console
-    ) as progress:
-        task = progress.add_task("Loading...", total=len(corpus_tfidf), error="",
-                                 doc=corpus_id[0])
-        for i, doc in enumerate(corpus_tfidf):
-            error = ""
-            with open(os.path.join(output_folder_tfidf, '{}_tfidf.txt'.format(corpus_id[i])), 'w') as file:
-                for f, v in doc:
-                    file.write('{}:{} '.format(f, v))
-            progress.update(task, advance=1, error=error, doc=corpus_id[i])
+    tfidf = tfidf_matrix(bow, workers=max(1, int(workers or 1)))
+    sparse.save_npz(os.path.join(output_folder, TFIDF_MATRIX), tfidf)
     print(TAB + "> Create TF-IDF... [green][DONE]")
 
+    if export_text_files:
+        export_text(console, bow, corpus_id, output_folder_bow, 'bow', 'Export Bag of Word')
+        export_text(console, tfidf, corpus_id, output_folder_tfidf, 'tfidf', 'Export TF-IDF')
+
 
 def main(args):
     console = Console(record=True)
-    run(console, args.build, args.title, args.doc_ids, args.limit_tokens, force=args.f, update=args.u)
+    run(console, args.build, args.title, args.limit_tokens, args.doc_ids, args.processed_folder, force=args.f,
+        update=args.u, export_text_files=not args.no_text, workers=args.workers,
+        vocabulary=args.vocabulary)
 
 
 def parse_args(parser):
@@ -176,6 +277,9 @@ if __name__ == "__main__":
     parser.add_argument('--doc_ids', type=str, default=None, nargs='+')
     parser.add_argument('--processed_folder', type=str, default="all")
     parser.add_argument('--limit_tokens', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--vocabulary', type=str, default=DEFAULT_VOCABULARY_MODE, choices=VOCABULARY_MODES)
+    parser.add_argument('--no_text', action='store_true', help='Do not save each document in a text file')
     parser.add_argument('-f', action='store_true')
     parser.add_argument('-u', action='store_true')
     args = parse_args(parser)
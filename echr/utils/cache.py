@@ -0,0 +1,252 @@
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import warnings
+from datetime import datetime
+
+from echr.utils import serializer
+from echr.utils.config import config
+from echr.utils.scheduler import normalize_path
+
+CACHE_FOLDER = '.cache'
+MANIFEST_FILE = 'steps.json'
+DIGESTS_FILE = 'digests.json'
+IGNORED_ARGS = ['update', 'force', 'workers']
+# Sections of config.yml read by the steps and changing their outputs
+# (build.env is not needed: the variables are resolved in the arguments)
+CONFIG_SECTIONS = ['steps', 'serialization']
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+__local_modules = {}
+
+
+def local_origin(name):
+    """
+        Get the source file of a module if it belongs to the project
+
+        :param name: absolute module name
+        :type name: str
+        :return: path to the module source or None for standard and third-party modules
+        :rtype: str
+    """
+    top = name.split('.')[0]
+    try:
+        top_spec = importlib.util.find_spec(top)
+        if top_spec is None or not top_spec.has_location or \
+                not os.path.abspath(top_spec.origin).startswith(PROJECT_FOLDER + os.sep):
+            return None
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError, AttributeError):
+        return None
+    if spec is None or not spec.has_location or 'site-packages' in spec.origin:
+        return None
+    return spec.origin
+
+
+def imported_modules(name, origin):
+    with open(origin, 'rb') as f, warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # e.g. invalid escape sequences, reported when the module is imported
+        tree = ast.parse(f.read(), filename=origin)
+    package = name if os.path.basename(origin) == '__init__.py' else name.rpartition('.')[0]
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(a.name for a in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = '.'.join(package.split('.')[:len(package.split('.')) - node.level + 1])
+                module = '{}.{}'.format(base, node.module) if node.module else base
+            else:
+                module = node.module
+            modules.add(module)
+            # from package import module
+            modules.update('{}.{}'.format(module, a.name) for a in node.names)
+    # Importing a module executes its parent packages
+    for m in list(modules):
+        parts = m.split('.')
+        modules.update('.'.join(parts[:i]) for i in range(1, len(parts)))
+    return modules
+
+
+def local_modules(name):
+    """
+        List the project modules executed when a module is imported, including itself
+
+        The imports are read from the sources, recursively, without importing the modules.
+
+        :param name: absolute module name
+        :type name: str
+        :return: source file of each project module, by module name
+        :rtype: dict
+    """
+    if name not in __local_modules:
+        sources = {}
+        parts = name.split('.')
+        stack = ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+        while stack:
+            module = stack.pop()
+            if module in sources:
+                continue
+            origin = local_origin(module)
+            if origin is None:
+                continue
+            sources[module] = origin
+            stack.extend(m for m in imported_modules(module, origin) if m not in sources)
+        __local_modules[name] = sources
+    return __local_modules[name]
+
+
+def is_cacheable(step_info):
+    """
+        A step can be cached if it declares its outputs and is not explicitly flagged as not cacheable
+        (e.g. steps retrieving information from HUDOC).
+    """
+    return step_info.get('cacheable', True) and bool(step_info.get('outputs'))
+
+
+class StepCache:
+    """
+        Build-level cache of the workflow steps
+
+        The key of a step is a hash of the sources of its module and of the project modules it imports,
+        the configuration sections read by the steps, its resolved arguments, the documents selected
+        for the build and the content of its input files. A step whose key did not change and whose
+        outputs are the ones produced by its last execution does not need to be executed again.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.folder = os.path.join(build, CACHE_FOLDER)
+        self.manifest = self._load(MANIFEST_FILE)
+        self.digests = self._load(DIGESTS_FILE)
+
+    def _load(self, name):
+        try:
+            return serializer.load(os.path.join(self.folder, name))
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        for name, content in [(MANIFEST_FILE, self.manifest), (DIGESTS_FILE, self.digests)]:
+            path = os.path.join(self.folder, name)
+            serializer.dump(content, path + '.tmp', sort_keys=True)
+            os.replace(path + '.tmp', path)
+
+    def file_digest(self, path):
+        """
+            SHA-256 of a build file, reusing the previous digest if the size and modification time did not change
+
+            :param path: build-relative path
+            :type path: str
+            :return: hexadecimal digest
+            :rtype: str
+        """
+        full_path = os.path.join(self.build, path)
+        stat = os.stat(full_path)
+        memo = self.digests.get(path)
+        if memo and memo[0] == stat.st_size and memo[1] == stat.st_mtime_ns:
+            return memo[2]
+        h = hashlib.sha256()
+        with open(full_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        self.digests[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def list_files(self, paths, exclude=None):
+        exclude = [normalize_path(e) for e in (exclude or [])]
+
+        def excluded(p):
+            p = normalize_path(p)
+            return any(p[:len(e)] == e for e in exclude)
+
+        files = set()
+        for p in paths:
+            full_path = os.path.join(self.build, p)
+            if os.path.isfile(full_path):
+                files.add('/'.join(normalize_path(p)))
+            elif os.path.isdir(full_path):
+                for root, _, filenames in os.walk(full_path):
+                    for f in filenames:
+                        files.add('/'.join(normalize_path(os.path.relpath(os.path.join(root, f), self.build))))
+        return sorted(f for f in files if not excluded(f) and normalize_path(f)[0] != CACHE_FOLDER)
+
+    def paths_digest(self, paths, exclude=None):
+        """
+            Hash the content of a list of build-relative files and folders
+
+            :param paths: build-relative paths
+            :type paths: [str]
+            :param exclude: build-relative paths to ignore
+            :type exclude: [str]
+            :return: hexadecimal digest
+            :rtype: str
+        """
+        h = hashlib.sha256()
+        for f in self.list_files(paths, exclude):
+            h.update('{}:{}\n'.format(f, self.file_digest(f)).encode('utf-8'))
+        return h.hexdigest()
+
+    def step_key(self, step_info, doc_ids=None):
+        """
+            Compute the cache key of a step
+
+            :param step_info: step as returned by load_workflow
+            :type step_info: dict
+            :param doc_ids: documents selected for the build
+            :type doc_ids: [str]
+            :return: hexadecimal digest
+            :rtype: str
+        """
+        h = hashlib.sha256()
+        for name, origin in sorted(local_modules(step_info.get('run')).items()):
+            h.update('{}\n'.format(name).encode('utf-8'))
+            with open(origin, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        settings = {k: (config() or {}).get(k) for k in CONFIG_SECTIONS}
+        h.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+        args = {k: v for k, v in step_info.get('args', {}).items() if k not in IGNORED_ARGS}
+        h.update(json.dumps(args, sort_keys=True, default=str).encode('utf-8'))
+        h.update(json.dumps(sorted(doc_ids) if doc_ids else None).encode('utf-8'))
+        # Outputs of a step are ignored in its inputs (e.g. an archive stored in the folder it archives)
+        h.update(self.paths_digest(step_info.get('inputs') or [], exclude=step_info.get('outputs')).encode('utf-8'))
+        return h.hexdigest()
+
+    def is_up_to_date(self, step_info, key):
+        """
+            Check if a step has already been executed with the same key and if its outputs are still untouched
+
+            :param step_info: step as returned by load_workflow
+            :type step_info: dict
+            :param key: cache key of the step
+            :type key: str
+            :return: True if the step can be skipped
+            :rtype: bool
+        """
+        entry = self.manifest.get(step_info.get('run'))
+        if entry is None or entry.get('key') != key:
+            return False
+        outputs = step_info.get('outputs')
+        if not self.list_files(outputs):
+            return False
+        return entry.get('outputs') == self.paths_digest(outputs)
+
+    def store(self, step_info, key):
+        """
+            Record the execution of a step
+
+            :param step_info: step as returned by load_workflow
+            :type step_info: dict
+            :param key: cache key of the step computed before its execution
+            :type key: str
+        """
+        self.manifest[step_info.get('run')] = {
+            'key': key,
+            'outputs': self.paths_digest(step_info.get('outputs')),
+            'time': datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        }
+        self.save()
@@ -0,0 +1,193 @@
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+from echr.utils import serializer
+
+CASES_PARQUET = 'cases.parquet'
+CASES_JSON = 'cases.json'
+SPLITS_FILE = 'splits.json'
+ALL = 'all'
+JSON_COLUMNS_KEY = b'echr.json_columns'
+MISSING = object()
+
+
+def encode_columns(cases, columns):
+    """
+        Convert cases to columns
+
+        A column is stored as is if every case has a string value for it. Otherwise, the values are stored as
+        JSON strings and a missing key is stored as null, so that the cases can be restored exactly.
+
+        :param cases: cases
+        :type cases: [dict]
+        :param columns: names of the columns
+        :type columns: [str]
+        :return: values per column and names of the JSON encoded columns
+        :rtype: (dict, [str])
+    """
+    data = {}
+    json_columns = []
+    for k in columns:
+        values = [c.get(k) for c in cases]
+        if all(k in c and isinstance(c[k], str) for c in cases):
+            data[k] = values
+        else:
+            json_columns.append(k)
+            data[k] = [serializer.dumps(c[k], pretty=False).decode('utf-8') if k in c else None for c in cases]
+    return data, json_columns
+
+
+def write_cases(folder, cases, splits=None, split_columns=None):
+    """
+        Save the cases information and the datasets splits
+
+        The cases are stored once, in Parquet if pyarrow is available and in JSON otherwise. A split is the list
+        of the identifiers of its cases. The columns which are specific to a split (e.g. the conclusion of the
+        multiclass dataset) are only returned when loading this split.
+
+        :param folder: folder where to store the cases
+        :type folder: str
+        :param cases: cases information
+        :type cases: [dict]
+        :param splits: itemid list per split
+        :type splits: dict
+        :param split_columns: columns specific to a split
+        :type split_columns: dict
+    """
+    split_columns = split_columns or {}
+    splits = {k: {'itemids': v, 'columns': split_columns.get(k, [])} for k, v in (splits or {}).items()}
+    columns = []
+    for c in cases:
+        for k in c:
+            if k not in columns:
+                columns.append(k)
+    for f in [CASES_PARQUET, CASES_JSON]:
+        if os.path.isfile(os.path.join(folder, f)):
+            os.remove(os.path.join(folder, f))
+    if pa is not None:
+        data, json_columns = encode_columns(cases, columns)
+        schema = pa.schema([pa.field(k, pa.string()) for k in columns],
+                           metadata={JSON_COLUMNS_KEY: serializer.dumps(json_columns, pretty=False)})
+        pq.write_table(pa.Table.from_pydict(data, schema=schema), os.path.join(folder, CASES_PARQUET))
+    else:
+        serializer.dump(cases, os.path.join(folder, CASES_JSON), sort_keys=True)
+    serializer.dump(splits, os.path.join(folder, SPLITS_FILE))
+
+
+class CaseStore:
+    """
+        Read the cases information saved by write_cases
+
+        :param folder: folder where the cases are stored
+        :type folder: str
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        path = os.path.join(folder, SPLITS_FILE)
+        self.splits = serializer.load(path) if os.path.isfile(path) else {}
+        self.hidden = {k for s in self.splits.values() for k in s['columns']}
+        self.parquet = os.path.isfile(os.path.join(folder, CASES_PARQUET))
+        if not self.parquet and not os.path.isfile(os.path.join(folder, CASES_JSON)):
+            raise FileNotFoundError('No cases information in {}'.format(folder))
+        if self.parquet and pa is None:
+            raise ImportError('pyarrow is required to read {}'.format(os.path.join(folder, CASES_PARQUET)))
+
+    def split_names(self):
+        return [ALL] + list(self.splits.keys())
+
+    def itemids(self, split=ALL):
+        """
+            Get the identifiers of the cases of a split
+
+            :param split: name of the split, all the cases by default
+            :type split: str
+            :return: case identifiers, in the order of the split
+            :rtype: [str]
+        """
+        if split == ALL:
+            return [c['itemid'] for c in self._read(columns=['itemid'])]
+        if split not in self.splits:
+            raise KeyError('Unknown split {}'.format(split))
+        return list(self.splits[split]['itemids'])
+
+    def load(self, split=ALL, columns=None, itemids=None):
+        """
+            Load the cases of a split
+
+            :param split: name of the split, all the cases by default
+            :type split: str
+            :param columns: columns to load, all by default
+            :type columns: [str]
+            :param itemids: if provided, only load these cases
+            :type itemids: iterable
+            :return: cases, in the order of the split
+            :rtype: [dict]
+        """
+        if split != ALL:
+            selected = self.itemids(split)
+            if itemids is not None:
+                wanted = set(itemids)
+                selected = [i for i in selected if i in wanted]
+            itemids = selected
+        read_columns = None if columns is None else list(dict.fromkeys(['itemid'] + list(columns)))
+        cases = self._read(columns=read_columns, itemids=itemids)
+        hidden = self.hidden - set(self.splits[split]['columns'] if split in self.splits else [])
+        for c in cases:
+            for k in hidden:
+                c.pop(k, None)
+        if split != ALL:
+            index = {c['itemid']: c for c in cases}
+            cases = [index[i] for i in itemids if i in index]
+        if columns is not None and 'itemid' not in columns:
+            cases = [{k: v for k, v in c.items() if k != 'itemid'} for c in cases]
+        return cases
+
+    def lookup(self, itemids, columns=None):
+        """
+            Get the cases information by identifier
+
+            :param itemids: case identifiers
+            :type itemids: iterable
+            :param columns: columns to load, all by default
+            :type columns: [str]
+            :return: case information per identifier
+            :rtype: dict
+        """
+        if columns is not None:
+            columns = list(dict.fromkeys(['itemid'] + list(columns)))
+        return {c['itemid']: c for c in self.load(columns=columns, itemids=itemids)}
+
+    def get(self, itemid, columns=None):
+        return self.lookup([itemid], columns).get(itemid)
+
+    def _read(self, columns=None, itemids=None):
+        if not self.parquet:
+            cases = serializer.load(os.path.join(self.folder, CASES_JSON))
+            if itemids is not None:
+                itemids = set(itemids)
+                cases = [c for c in cases if c['itemid'] in itemids]
+            if columns is not None:
+                cases = [{k: c[k] for k in columns if k in c} for c in cases]
+            return cases
+        path = os.path.join(self.folder, CASES_PARQUET)
+        table = pq.read_table(path, columns=columns)
+        if itemids is not None:
+            value_set = pa.array(list(set(itemids)), pa.string())
+            table = table.filter(pc.is_in(table.column('itemid'), value_set=value_set))
+        metadata = table.schema.metadata or {}
+        json_columns = set(serializer.loads(metadata.get(JSON_COLUMNS_KEY, b'[]')))
+        decoded = {}
+        for k in table.column_names:
+            values = table.column(k).to_pylist()
+            if k in json_columns:
+                values = [serializer.loads(v) if v is not None else MISSING for v in values]
+            decoded[k] = values
+        return [{k: values[i] for k, values in decoded.items() if values[i] is not MISSING}
+                for i in range(table.num_rows)]
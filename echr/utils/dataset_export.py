@@ -0,0 +1,279 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+from echr.utils import serializer
+
+LABELS_PARQUET = 'labels.parquet'
+LABELS_JSON = 'labels.json'
+OUTCOMES_MATRIX = 'outcomes.npz'
+MAX_DIGITS = 19
+POWERS_OF_10 = 10 ** np.arange(MAX_DIGITS, dtype=np.int64)
+CHUNK_SIZE = 1 << 18  # non-zero values formatted at once
+
+
+def one_hot(rows, num_columns):
+    """
+        Build a sparse matrix with a 1 for each listed column of each row
+
+        :param rows: columns set for each row
+        :type rows: [[int]]
+        :param num_columns: number of columns
+        :type num_columns: int
+        :return: one-hot matrix, one row per element of rows
+        :rtype: scipy.sparse.csr_matrix
+    """
+    indptr = np.cumsum([0] + [len(r) for r in rows], dtype=np.int64)
+    indices = np.fromiter((c for r in rows for c in r), dtype=np.int32, count=indptr[-1])
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                               shape=(len(rows), num_columns))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def outcomes_matrix(labels, num_outcomes):
+    """
+        Encode the labels as a matrix with +1 (violation) or -1 (no violation) in the column of each outcome
+
+        :param labels: signed outcome codes of each case, starting at 1
+        :type labels: [[int]]
+        :param num_outcomes: number of outcomes
+        :type num_outcomes: int
+        :return: one row per case, one column per outcome
+        :rtype: scipy.sparse.csr_matrix
+    """
+    indptr = np.cumsum([0] + [len(r) for r in labels], dtype=np.int64)
+    codes = np.fromiter((c for r in labels for c in r), dtype=np.int32, count=indptr[-1])
+    return sparse.csr_matrix((np.sign(codes), np.abs(codes) - 1, indptr), shape=(len(labels), num_outcomes))
+
+
+def _char(char, present):
+    """
+        Field made of a single character, for the elements where present is True
+
+        Fields are given as a matrix with the bytes of each element and the mask of its bytes.
+    """
+    return np.full((len(present), 1), ord(char), dtype=np.uint8), present[:, None]
+
+
+def _digits(values):
+    """
+        Field with the decimal digits of non-negative integers, right-aligned
+    """
+    values = np.asarray(values, dtype=np.int64)
+    n = np.maximum(np.searchsorted(POWERS_OF_10, values, side='right'), 1)
+    columns = int(n.max()) if len(values) else 1
+    band = np.empty((len(values), columns), dtype=np.uint8)
+    remaining = values.copy()
+    for j in range(columns - 1, -1, -1):
+        remaining, digit = np.divmod(remaining, 10)
+        band[:, j] = digit
+    band += ord('0')
+    return band, np.arange(columns)[None, :] >= (columns - n)[:, None]
+
+
+def _concat(fields):
+    """
+        Concatenate the fields of each element
+
+        :param fields: fields as returned by _char, _digits, _format_integers or _format_floats
+        :type fields: [(numpy.ndarray, numpy.ndarray)]
+        :return: bytes of all the elements and length of each element
+        :rtype: (bytes, numpy.ndarray)
+    """
+    band = np.hstack([b for b, _ in fields])
+    mask = np.hstack([m for _, m in fields])
+    return band[mask].tobytes(), mask.sum(axis=1)
+
+
+def _format_integers(values):
+    values = np.asarray(values, dtype=np.int64)
+    return [_char(b'-', values < 0), _digits(np.abs(values))]
+
+
+def _format_floats(values):
+    """
+        Format floats with repr, i.e. with the fewest digits that read back as the same value
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not np.isfinite(values).all():
+        raise ValueError('Cannot export NaN or infinite values')
+    text = np.array(list(map(repr, values.tolist())), dtype=np.bytes_)
+    # Left-aligned and padded with null bytes
+    band = text.view(np.uint8).reshape(len(values), text.itemsize)
+    return [(band, band != 0)]
+
+
+def format_rows(matrix, offset=0):
+    """
+        Format the rows of a matrix as SVMLight features: '<index>:<value> ...', with zero-based indices
+
+        The features are written by chunks of non-zero values in a byte buffer with NumPy, which is then sliced
+        per row. Integer matrices are written as integers, float matrices with repr.
+
+        :param matrix: one row per sample
+        :type matrix: scipy.sparse.csr_matrix
+        :param offset: index of the first column
+        :type offset: int
+        :return: features of each row
+        :rtype: [bytes]
+    """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.sort_indices()
+    if not matrix.nnz:
+        return [b''] * matrix.shape[0]
+    integers = np.issubdtype(matrix.dtype, np.integer) or matrix.dtype == np.bool_
+    parts = []
+    bounds = np.zeros(matrix.nnz + 1, dtype=np.int64)
+    for start in range(0, matrix.nnz, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, matrix.nnz)
+        data = matrix.data[start:end]
+        separators = np.ones(end - start, dtype=bool)
+        text, lengths = _concat([_char(b' ', separators), _digits(matrix.indices[start:end].astype(np.int64) + offset),
+                                 _char(b':', separators)] +
+                                (_format_integers(data) if integers else _format_floats(data)))
+        parts.append(text)
+        bounds[start + 1:end + 1] = lengths
+    text = b''.join(parts)
+    np.cumsum(bounds, out=bounds)
+    bounds = bounds[matrix.indptr].tolist()
+    # Each pair starts with a space, removed for the first pair of each row
+    return [text[bounds[i] + 1:bounds[i + 1]] for i in range(matrix.shape[0])]
+
+
+def join_rows(blocks):
+    """
+        Concatenate the formatted features of several blocks of columns, row by row
+
+        :param blocks: features of each row, for each block
+        :type blocks: [[bytes]]
+        :return: features of each row
+        :rtype: [bytes]
+    """
+    return [b' '.join(f for f in row if f) for row in zip(*blocks)]
+
+
+def write_svmlight_rows(path, rows, labels, comments=None):
+    """
+        Save formatted rows in SVMLight format: '<labels> <index>:<value> ...'
+
+        The labels of a row are separated by commas (multilabel format). Comments, e.g. the case identifiers,
+        are written at the end of the lines after '#'.
+
+        :param path: output file
+        :type path: str
+        :param rows: features of each row, as returned by format_rows
+        :type rows: [bytes]
+        :param labels: labels of each row
+        :type labels: [[int]]
+        :param comments: comment of each row
+        :type comments: [str]
+    """
+    labels = [','.join(map(str, row_labels)).encode('utf-8') for row_labels in labels]
+    lines = [lab + b' ' + features if features else lab for lab, features in zip(labels, rows)]
+    if comments is not None:
+        lines = [line + ' # {}'.format(comment).encode('utf-8') for line, comment in zip(lines, comments)]
+    with open(path, 'wb') as f:
+        for line in lines:
+            f.write(line + b'\n')
+
+
+def write_svmlight(path, matrix, labels, comments=None):
+    """
+        Save a matrix in SVMLight format: '<labels> <index>:<value> ...', with zero-based indices
+
+        :param path: output file
+        :type path: str
+        :param matrix: one row per sample
+        :type matrix: scipy.sparse.csr_matrix
+        :param labels: labels of each row
+        :type labels: [[int]]
+        :param comments: comment of each row
+        :type comments: [str]
+    """
+    write_svmlight_rows(path, format_rows(matrix), labels, comments)
+
+
+def stack_blocks(blocks):
+    """
+        Build the matrix of a representation from its blocks of columns
+
+        :param blocks: matrix of each block with the index of its first column, by increasing index
+        :type blocks: [(scipy.sparse.csr_matrix, int)]
+        :return: matrix whose columns before and between the blocks are empty
+        :rtype: scipy.sparse.csr_matrix
+    """
+    num_rows = blocks[0][0].shape[0]
+    parts = []
+    column = 0
+    for matrix, offset in blocks:
+        if offset > column:
+            parts.append(sparse.csr_matrix((num_rows, offset - column), dtype=matrix.dtype))
+        parts.append(matrix)
+        column = offset + matrix.shape[1]
+    return sparse.hstack(parts, format='csr')
+
+
+def write_labels(folder, itemids, labels, num_outcomes):
+    """
+        Save the labels of a dataset
+
+        The signed outcome codes of each case are saved in Parquet (or JSON if pyarrow is not installed),
+        and as a sparse matrix in outcomes.npz.
+
+        :param folder: output folder
+        :type folder: str
+        :param itemids: case identifiers
+        :type itemids: [str]
+        :param labels: signed outcome codes of each case
+        :type labels: [[int]]
+        :param num_outcomes: number of outcomes
+        :type num_outcomes: int
+    """
+    if pa is not None:
+        table = pa.table({'itemid': pa.array(itemids, pa.string()), 'labels': pa.array(labels, pa.list_(pa.int32()))})
+        pq.write_table(table, os.path.join(folder, LABELS_PARQUET))
+    else:
+        serializer.dump({'itemid': itemids, 'labels': labels}, os.path.join(folder, LABELS_JSON))
+    sparse.save_npz(os.path.join(folder, OUTCOMES_MATRIX), outcomes_matrix(labels, num_outcomes))
+
+
+def export_dataset(folder, blocks, variants, itemids, labels, num_outcomes):
+    """
+        Save each representation of a dataset in SVMLight and NPZ formats, and the labels
+
+        The representations are made of blocks of columns sharing the same feature indices. Each block is
+        formatted once for all the representations using it.
+
+        :param folder: output folder
+        :type folder: str
+        :param blocks: matrix of each block of columns with the index of its first column, by name
+        :type blocks: dict
+        :param variants: names of the blocks of each representation, by representation name
+        :type variants: dict
+        :param itemids: case identifier of each row
+        :type itemids: [str]
+        :param labels: signed outcome codes of each row
+        :type labels: [[int]]
+        :param num_outcomes: number of outcomes
+        :type num_outcomes: int
+    """
+    rows = {}
+    for name, block_names in variants.items():
+        block_names = sorted(block_names, key=lambda b: blocks[b][1])
+        for b in block_names:
+            if b not in rows:
+                rows[b] = format_rows(*blocks[b])
+        write_svmlight_rows(os.path.join(folder, '{}.svmlight'.format(name)),
+                            join_rows([rows[b] for b in block_names]), labels, itemids)
+        # Not compressed: the datasets folder is compressed in an archive
+        sparse.save_npz(os.path.join(folder, '{}.npz'.format(name)),
+                        stack_blocks([blocks[b] for b in block_names]), compressed=False)
+    write_labels(folder, itemids, labels, num_outcomes)
@@ -0,0 +1,205 @@
+import posixpath
+import zipfile
+
+from docx.oxml import parse_xml
+from docx.styles import BabelFish
+from docx.table import Table as DocTable
+from lxml import etree
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+RT_OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+RT_STYLES = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles'
+W_BODY = '{%s}body' % W
+W_P = '{%s}p' % W
+W_TBL = '{%s}tbl' % W
+W_R = '{%s}r' % W
+W_T = '{%s}t' % W
+W_TAB = '{%s}tab' % W
+W_BR = '{%s}br' % W
+W_CR = '{%s}cr' % W
+W_PPR = '{%s}pPr' % W
+W_PSTYLE = '{%s}pStyle' % W
+W_STYLE = '{%s}style' % W
+W_NAME = '{%s}name' % W
+W_VAL = '{%s}val' % W
+W_TYPE = '{%s}type' % W
+W_STYLE_ID = '{%s}styleId' % W
+W_DEFAULT = '{%s}default' % W
+
+
+class UnsupportedDocument(Exception):
+    pass
+
+
+def rels_path(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', name + '.rels')
+
+
+def get_related_part(package, part, rel_type):
+    """
+        Get the target of the first relationship of a given type of a part
+
+        :param package: opened docx
+        :type package: zipfile.ZipFile
+        :param part: source part name, empty for the package
+        :type part: str
+        :param rel_type: relationship type
+        :type rel_type: str
+        :return: target part name or None
+        :rtype: str
+    """
+    try:
+        rels = etree.fromstring(package.read(rels_path(part) if part else '_rels/.rels'))
+    except KeyError:
+        return None
+    for rel in rels.iterfind('{%s}Relationship' % R_NS):
+        if rel.get('Type') == rel_type and rel.get('TargetMode') != 'External':
+            target = rel.get('Target')
+            if target.startswith('/'):
+                return target[1:]
+            return posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+    return None
+
+
+class ParagraphStyles:
+    """
+        Resolve the paragraph style names from styles.xml as python-docx does
+
+        A paragraph without style or with an unknown style, or a style which is not a paragraph style,
+        gets the default paragraph style. Style names are translated with BabelFish (e.g. 'heading 1'
+        becomes 'Heading 1').
+    """
+
+    def __init__(self, styles_xml):
+        self.styles = {}
+        self.default = None
+        for style in etree.fromstring(styles_xml).iterfind(W_STYLE):
+            style_id = style.get(W_STYLE_ID)
+            name = style.find(W_NAME)
+            entry = (style.get(W_TYPE), name.get(W_VAL) if name is not None else None)
+            if style_id not in self.styles:
+                self.styles[style_id] = entry
+            if entry[0] == 'paragraph' and style.get(W_DEFAULT) in ('1', 'true', 'on'):
+                self.default = entry
+        self.names = {}
+
+    def name(self, style_id):
+        if style_id not in self.names:
+            style = self.styles.get(style_id) if style_id is not None else None
+            if style is None or style[0] != 'paragraph':
+                style = self.default
+            self.names[style_id] = style
+        style = self.names[style_id]
+        if style is None:
+            raise AttributeError("'NoneType' object has no attribute 'name'")
+        return BabelFish.internal2ui(style[1]) if style[1] is not None else None
+
+
+def paragraph_text(p):
+    """
+        Text of a paragraph, following python-docx: concatenation of the direct runs of the paragraph,
+        with tabulations and line breaks
+    """
+    text = []
+    for r in p:
+        if r.tag != W_R:
+            continue
+        for child in r:
+            if child.tag == W_T:
+                text.append(child.text or '')
+            elif child.tag == W_TAB:
+                text.append('\t')
+            elif child.tag in (W_BR, W_CR):
+                text.append('\n')
+    return ''.join(text)
+
+
+def paragraph_style_id(p):
+    ppr = p.find(W_PPR)
+    if ppr is None:
+        return None
+    pstyle = ppr.find(W_PSTYLE)
+    return pstyle.get(W_VAL) if pstyle is not None else None
+
+
+class DocxBodyReader:
+    """
+        Stream the children of the body of a docx
+
+        The body is read with lxml iterparse and each child is released once processed. Each child is
+        returned as a tuple (kind, content, style):
+        - ('paragraph', text, function returning the style name)
+        - ('table', python-docx Table, None)
+        - ('other', None, None) for any other element (e.g. section properties)
+
+        Once the body is read, old_parser tells if all the paragraphs have one of the given styles.
+
+        :param docx: path or file object of the document
+        :type docx: str or file
+        :param old_parser_tags: styles of the documents to parse with the old parser
+        :type old_parser_tags: [str]
+    """
+
+    def __init__(self, docx, old_parser_tags):
+        self.docx = docx
+        self.old_parser_tags = set(old_parser_tags)
+        self.all_old = True
+        self.style_error = None
+        self.done = False
+
+    @property
+    def old_parser(self):
+        if not self.done:
+            raise RuntimeError('The document body has not been read entirely')
+        if self.style_error is not None:
+            raise self.style_error
+        return self.all_old
+
+    def __iter__(self):
+        with zipfile.ZipFile(self.docx) as package:
+            document_part = get_related_part(package, '', RT_OFFICE_DOCUMENT)
+            styles_part = get_related_part(package, document_part, RT_STYLES) if document_part else None
+            if styles_part is None or styles_part not in package.namelist():
+                raise UnsupportedDocument('Document without styles')
+            styles = ParagraphStyles(package.read(styles_part))
+            with package.open(document_part) as f:
+                yield from self._iter_body(f, styles)
+        self.done = True
+
+    def _iter_body(self, f, styles):
+        depth = 0
+        in_body = False
+        for event, e in etree.iterparse(f, events=('start', 'end', 'comment', 'pi'),
+                                        remove_blank_text=True, resolve_entities=False):
+            if event == 'start':
+                depth += 1
+                if e.tag == W_BODY and depth == 2:
+                    in_body = True
+                continue
+            if event in ('comment', 'pi'):
+                if in_body and depth == 2:
+                    yield 'other', None, None
+                continue
+            depth -= 1
+            if not in_body or depth != 2:
+                if e.tag == W_BODY:
+                    in_body = False
+                continue
+            if e.tag == W_P:
+                style_id = paragraph_style_id(e)
+                if self.all_old and self.style_error is None:
+                    try:
+                        self.all_old = styles.name(style_id) in self.old_parser_tags
+                    except AttributeError as error:
+                        self.style_error = error
+                yield 'paragraph', paragraph_text(e), lambda style_id=style_id: styles.name(style_id)
+            elif e.tag == W_TBL:
+                yield 'table', DocTable(parse_xml(etree.tostring(e)), None), None
+            else:
+                yield 'other', None, None
+            # Release the processed elements
+            e.clear()
+            while e.getprevious() is not None:
+                del e.getparent()[0]
@@ -0,0 +1,146 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from echr.utils.config import config
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = 60
+DEFAULT_CONCURRENCY = 128
+
+__client = None
+__client_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+        Thread-safe token bucket
+
+        Tokens are added at a constant rate up to the burst size. Each request consumes one token
+        and waits until a token is available. Tokens can be reserved in advance so that asynchronous
+        callers can wait without blocking the event loop.
+
+        :param rate: number of tokens added per second, 0 to disable the limit
+        :type rate: float
+        :param burst: maximal number of tokens
+        :type burst: int
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+            Take a token, possibly in advance
+
+            :return: number of seconds to wait before using the token
+            :rtype: float
+        """
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            return max(0., -self.tokens / self.rate)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+class HttpClient:
+    """
+        HTTP client sharing a pool of keep-alive connections between threads
+
+        Requests are rate limited per host and can be redirected to another server (e.g. a local test server)
+        by mapping a URL prefix to another one.
+
+        :param pool_size: maximal number of connections per host
+        :type pool_size: int
+        :param rate: maximal number of requests per second and per host, 0 for no limit
+        :type rate: float
+        :param burst: maximal number of requests sent at once
+        :type burst: int
+        :param endpoints: URL prefixes to replace
+        :type endpoints: dict
+        :param timeout: default timeout in seconds
+        :type timeout: float
+        :param concurrency: maximal number of requests in flight for asynchronous downloads
+        :type concurrency: int
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, rate=0, burst=None, endpoints=None, timeout=DEFAULT_TIMEOUT,
+                 concurrency=DEFAULT_CONCURRENCY):
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst or pool_size
+        self.endpoints = endpoints or {}
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, url):
+        for prefix, target in self.endpoints.items():
+            if url.startswith(prefix):
+                return target + url[len(prefix):]
+        return url
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def get(self, url, **kwargs):
+        """
+            Send a GET request through the connection pool
+
+            :param url: URL to request
+            :type url: str
+            :return: response
+            :rtype: requests.Response
+        """
+        url = self.resolve(url)
+        kwargs.setdefault('timeout', self.timeout)
+        self.bucket(urlsplit(url).netloc).acquire()
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def get_client():
+    """
+        Get the HTTP client of the process, configured from the `http` section of the configuration
+
+        :return: HTTP client
+        :rtype: HttpClient
+    """
+    global __client
+    with __client_lock:
+        if __client is None:
+            http_config = config().get('http') or {}
+            __client = HttpClient(
+                pool_size=http_config.get('pool_size', DEFAULT_POOL_SIZE),
+                rate=http_config.get('rate', 0),
+                burst=http_config.get('burst'),
+                endpoints=http_config.get('endpoints'),
+                timeout=http_config.get('timeout', DEFAULT_TIMEOUT),
+                concurrency=http_config.get('concurrency', DEFAULT_CONCURRENCY)
+            )
+        return __client
@@ -0,0 +1,150 @@
+from collections import Counter, deque
+
+from unidecode import unidecode
+
+
+class AhoCorasick:
+    """
+        Aho-Corasick automaton returning the first pattern (in the order of the patterns) found in a text
+
+        :param patterns: patterns to search
+        :type patterns: [str]
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        # Smallest index of the patterns ending at each state, following the failure links
+        self.first = [None]
+        for i, pattern in enumerate(patterns):
+            state = 0
+            for c in pattern:
+                if c not in self.goto[state]:
+                    self.goto.append({})
+                    self.first.append(None)
+                    self.goto[state][c] = len(self.goto) - 1
+                state = self.goto[state][c]
+            if self.first[state] is None:
+                self.first[state] = i
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(c, 0)
+                inherited = self.first[self.fail[next_state]]
+                if inherited is not None and (self.first[next_state] is None or inherited < self.first[next_state]):
+                    self.first[next_state] = inherited
+                queue.append(next_state)
+
+    def search(self, text):
+        """
+            Find the first pattern contained in a text
+
+            :param text: text to search in
+            :type text: str
+            :return: index of the first pattern found, None if no pattern is found
+            :rtype: int
+        """
+        best = self.first[0]
+        state = 0
+        for c in text:
+            while state and c not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(c, 0)
+            found = self.first[state]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+        return best
+
+
+class JudgeMatcher:
+    """
+        Match decision body lines against the judges of each country
+
+        Names are transliterated once when the matcher is built. A line matches the first judge, in the order of
+        the judges file, whose name is contained in the line.
+
+        :param judges_per_country: judges per country as stored in judges_per_country.json
+        :type judges_per_country: dict
+    """
+
+    def __init__(self, judges_per_country):
+        self.judges = [(name, judge) for v in judges_per_country.values() for name, judge in v.items()]
+        self.automaton = AhoCorasick([unidecode(name.upper()) for name, _ in self.judges])
+        self.stats = {'lines': 0, 'matched': 0}
+        self.matches = Counter()
+
+    @staticmethod
+    def normalize(line):
+        return unidecode(line.upper().replace('-', ' '))
+
+    def match(self, line):
+        """
+            Find the judge mentioned in a line
+
+            :param line: decision body line
+            :type line: str
+            :return: name and information of the judge, (None, None) if no judge is found
+            :rtype: (str, dict)
+        """
+        self.stats['lines'] += 1
+        i = self.automaton.search(self.normalize(line))
+        if i is None:
+            return None, None
+        self.stats['matched'] += 1
+        name, judge = self.judges[i]
+        self.matches[name] += 1
+        return name, judge
+
+
+class PrefixMatcher:
+    """
+        Prefix trie over groups of strings
+
+        A text matches the first group, in the order of the groups, having one of its strings as a prefix of
+        the text. The comparison is case insensitive. Matching is linear in the length of the text.
+
+        :param groups: list of strings per group
+        :type groups: dict
+    """
+
+    def __init__(self, groups):
+        self.root = {}
+        # Rank, group and string of the string ending at the root, i.e. the empty string
+        self.root_value = None
+        for i, (group, values) in enumerate(groups.items()):
+            for j, v in enumerate(values):
+                node = self.root
+                for c in v.upper():
+                    node = node.setdefault(c, {})
+                if node is self.root:
+                    self.root_value = min(self.root_value or ((i, j), group, v), ((i, j), group, v))
+                elif None not in node or (i, j) < node[None][0]:
+                    node[None] = ((i, j), group, v)
+
+    def match(self, text):
+        """
+            Find the group of a text
+
+            :param text: text to tag
+            :type text: str
+            :return: group and matching string, (None, None) if no string is a prefix of the text
+            :rtype: (str, str)
+        """
+        best = self.root_value
+        node = self.root
+        for c in text.upper():
+            node = node.get(c)
+            if node is None:
+                break
+            value = node.get(None)
+            if value is not None and (best is None or value[0] < best[0]):
+                best = value
+        if best is None:
+            return None, None
+        return best[1], best[2]
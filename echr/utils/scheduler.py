@@ -0,0 +1,166 @@
+import importlib
+import io
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from rich.console import Console
+
+
+def normalize_path(path):
+    """
+        Split a build-relative path into its components
+
+        :param path: build-relative path
+        :type path: str
+        :return: path components
+        :rtype: tuple
+    """
+    return tuple(p for p in os.path.normpath(path).replace('\\', '/').split('/') if p not in ['', '.'])
+
+
+def paths_overlap(a, b):
+    """
+        Check if two build-relative paths overlap, i.e. if one is a parent of or equal to the other
+
+        :param a: first path
+        :type a: str
+        :param b: second path
+        :type b: str
+        :return: True if the paths overlap
+        :rtype: bool
+    """
+    a, b = normalize_path(a), normalize_path(b)
+    n = min(len(a), len(b))
+    return a[:n] == b[:n]
+
+
+def any_overlap(paths_a, paths_b):
+    return any(paths_overlap(a, b) for a in paths_a for b in paths_b)
+
+
+def is_declared(step):
+    """
+        A step is declared if its action lists its inputs or its outputs.
+        Undeclared steps (e.g. deployment) act as barriers in the workflow.
+    """
+    return 'inputs' in step or 'outputs' in step
+
+
+def build_dependencies(workflow_steps):
+    """
+        Build the dependency graph of a flattened workflow
+
+        A step depends on a previous step if it reads something the previous step writes,
+        writes something the previous step reads or writes. Steps without declared inputs
+        and outputs depend on all the previous steps and all the following steps depend on them.
+
+        :param workflow_steps: flattened workflow as returned by load_workflow
+        :type workflow_steps: [dict]
+        :return: for each step, the indices of the steps it depends on
+        :rtype: [set]
+    """
+    dependencies = []
+    for j, step in enumerate(workflow_steps):
+        deps = set()
+        inputs_j = step.get('inputs') or []
+        outputs_j = step.get('outputs') or []
+        for i, previous in enumerate(workflow_steps[:j]):
+            if not is_declared(step) or not is_declared(previous):
+                deps.add(i)
+                continue
+            inputs_i = previous.get('inputs') or []
+            outputs_i = previous.get('outputs') or []
+            if any_overlap(outputs_i, inputs_j) or any_overlap(outputs_i, outputs_j) \
+                    or any_overlap(inputs_i, outputs_j):
+                deps.add(i)
+        dependencies.append(deps)
+    return dependencies
+
+
+def run_step_in_process(module, build, title, doc_ids, args, width):
+    """
+        Execute a step in a worker process and capture its console output
+
+        :return: dictionary with the return code, the console output and the execution time
+        :rtype: dict
+    """
+    console = Console(record=True, file=io.StringIO(), width=width)
+    start = datetime.now()
+    rc = 0
+    try:
+        step = importlib.import_module(module)
+        step.run(console=console, build=build, title=title, doc_ids=doc_ids, **args)
+    except SystemExit as e:
+        rc = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        console.print(traceback.format_exc(), markup=False, highlight=False)
+        rc = 1
+    return {
+        'rc': rc,
+        'output': console.export_text(styles=True),
+        'delta': datetime.now() - start
+    }
+
+
+def run_workflow(workflow_steps, jobs, task, on_start=None, on_done=None):
+    """
+        Execute the workflow steps, running independent steps concurrently
+
+        :param workflow_steps: flattened workflow
+        :type workflow_steps: [dict]
+        :param jobs: maximal number of steps executed at the same time
+        :type jobs: int
+        :param task: function returning, for a step index, the function to execute in a worker process and its
+                     arguments, or None if the step does not need to be executed.
+                     The function must return a dictionary with at least the key 'rc'
+        :type task: callable
+        :param on_start: callback called with the step index when a step is submitted
+        :type on_start: callable
+        :param on_done: callback called with the step index and the result of the step
+        :type on_done: callable
+        :return: indices of the failed steps
+        :rtype: [int]
+    """
+    jobs = max(1, jobs)
+    dependencies = build_dependencies(workflow_steps)
+    pending = list(range(len(workflow_steps)))
+    done = set()
+    failed = []
+    running = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            skipped = False
+            if not failed:
+                ready = [i for i in pending if dependencies[i] <= done]
+                for i in ready[:jobs - len(running)]:
+                    pending.remove(i)
+                    if on_start:
+                        on_start(i)
+                    t = task(i)
+                    if t is None:  # Nothing to execute for this step
+                        if on_done:
+                            on_done(i, {'rc': 0, 'output': '', 'delta': None, 'skipped': True})
+                        done.add(i)
+                        skipped = True
+                        continue
+                    fn, args = t
+                    running[executor.submit(fn, *args)] = i
+            if skipped:
+                continue
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    result = {'rc': 1, 'output': traceback.format_exc(), 'delta': None}
+                if on_done:
+                    on_done(i, result)
+                if result.get('rc'):
+                    failed.append(i)
+                else:
+                    done.add(i)
+    return failed
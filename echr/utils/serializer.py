@@ -0,0 +1,176 @@
+import json
+import math
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from echr.utils.config import config
+
+PRETTY = 'pretty'
+COMPACT = 'compact'
+FORMATS = [PRETTY, COMPACT]
+BACKENDS = ['auto', 'orjson', 'json']
+
+
+def get_settings():
+    """
+        Get the serialization settings from the `serialization` section of the configuration
+
+        :return: format (pretty or compact) and backend (auto, orjson or json)
+        :rtype: (str, str)
+    """
+    settings = config().get('serialization') or {}
+    output_format = settings.get('format', PRETTY)
+    backend = settings.get('backend', 'auto')
+    if output_format not in FORMATS:
+        raise ValueError('Unknown serialization format {}, expected one of {}'.format(output_format,
+                                                                                      ', '.join(FORMATS)))
+    if backend not in BACKENDS:
+        raise ValueError('Unknown serialization backend {}, expected one of {}'.format(backend,
+                                                                                       ', '.join(BACKENDS)))
+    return output_format, backend
+
+
+def use_orjson(backend=None):
+    backend = backend or get_settings()[1]
+    if backend == 'orjson' and orjson is None:
+        raise ImportError('orjson is not installed')
+    return orjson is not None and backend != 'json'
+
+
+def to_builtin(obj):
+    """
+        Convert the NumPy values the json module cannot serialize, as orjson does
+    """
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+    raise TypeError('Object of type {} is not JSON serializable'.format(obj.__class__.__name__))
+
+
+def replace_non_finite(obj):
+    """
+        Replace NaN and infinite values by None, as orjson does
+
+        :param obj: object to serialize
+        :type obj: object
+        :return: copy of the object without non-finite values
+        :rtype: object
+    """
+    if isinstance(obj, dict):
+        return {k: replace_non_finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [replace_non_finite(v) for v in obj]
+    if np is not None and isinstance(obj, (np.ndarray, np.generic)):
+        return replace_non_finite(obj.tolist())
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def dumps(obj, pretty=None, sort_keys=False, backend=None):
+    """
+        Serialize an object to JSON
+
+        Both backends use the same layout (UTF-8 without escaping, two spaces indentation in pretty format and
+        no whitespace in compact format) and the same conversions: NumPy values are written as numbers and lists,
+        NaN and infinite values as null. The documents are equal once parsed, but not always byte for byte:
+        the exponents of floats are written differently (1e-07 with json, 1e-7 with orjson), and orjson
+        rejects the integers larger than 64 bits.
+
+        :param obj: object to serialize
+        :type obj: object
+        :param pretty: indent the output, use the configured format if None
+        :type pretty: bool
+        :param sort_keys: sort the keys of the dictionaries
+        :type sort_keys: bool
+        :param backend: auto, orjson or json, use the configured backend if None
+        :type backend: str
+        :return: JSON document
+        :rtype: bytes
+    """
+    if pretty is None:
+        pretty = get_settings()[0] == PRETTY
+    if use_orjson(backend):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+    options = {'indent': 2} if pretty else {'separators': (',', ':')}
+    try:
+        data = json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, allow_nan=False, default=to_builtin,
+                          **options)
+    except ValueError as e:
+        if 'Out of range float values' not in str(e):
+            raise
+        # Only copy the object if it contains non-finite values
+        data = json.dumps(replace_non_finite(obj), sort_keys=sort_keys, ensure_ascii=False, allow_nan=False,
+                          default=to_builtin, **options)
+    return data.encode('utf-8')
+
+
+def loads(data, backend=None):
+    """
+        Deserialize a JSON document
+
+        Documents that orjson rejects but the standard library accepts (e.g. containing NaN) are read with the
+        standard library.
+
+        :param data: JSON document
+        :type data: bytes or str
+        :param backend: auto, orjson or json, use the configured backend if None
+        :type backend: str
+        :return: deserialized object
+        :rtype: object
+    """
+    if use_orjson(backend):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # e.g. NaN values written by the standard library
+    return json.loads(data)
+
+
+def dump(obj, path, pretty=None, sort_keys=False, backend=None):
+    """
+        Serialize an object to a JSON file
+
+        :param obj: object to serialize
+        :type obj: object
+        :param path: path of the file
+        :type path: str
+        :param pretty: indent the output, use the configured format if None
+        :type pretty: bool
+        :param sort_keys: sort the keys of the dictionaries
+        :type sort_keys: bool
+        :param backend: auto, orjson or json, use the configured backend if None
+        :type backend: str
+    """
+    with open(path, 'wb') as f:
+        f.write(dumps(obj, pretty=pretty, sort_keys=sort_keys, backend=backend))
+
+
+def load(path, backend=None):
+    """
+        Deserialize a JSON file
+
+        :param path: path of the file
+        :type path: str
+        :param backend: auto, orjson or json, use the configured backend if None
+        :type backend: str
+        :return: deserialized object
+        :rtype: object
+    """
+    with open(path, 'rb') as f:
+        return loads(f.read(), backend=backend)
@@ -0,0 +1,152 @@
+from collections import Counter
+
+SEPARATOR = '_'
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+def pack(ids):
+    """
+        Pack a sequence of token ids into a single integer
+
+        The ids start at 1 such that the length of the sequence is implied by the packed value.
+
+        :param ids: token ids
+        :type ids: [int]
+        :return: packed n-gram
+        :rtype: int
+    """
+    key = 0
+    for k, i in enumerate(ids):
+        key |= i << (ID_BITS * k)
+    return key
+
+
+def unpack(key):
+    """
+        Unpack an n-gram packed by pack
+
+        :param key: packed n-gram
+        :type key: int
+        :return: token ids
+        :rtype: [int]
+    """
+    ids = []
+    while key:
+        ids.append(key & ID_MASK)
+        key >>= ID_BITS
+    return ids
+
+
+class Vocabulary:
+    """
+        Bidirectional mapping between tokens and integer ids, starting at 1
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.tokens = [None]
+
+    def __len__(self):
+        return len(self.tokens) - 1
+
+    def id(self, token):
+        i = self.ids.get(token)
+        if i is None:
+            i = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return i
+
+    def encode(self, tokens):
+        return [self.id(t) for t in tokens]
+
+
+class NGramCounter:
+    """
+        Running counter of n-grams stored as packed integer token ids
+
+        The n-grams are only turned back into strings (tokens joined by '_') when the counts are read, such that
+        the memory needed to count the n-grams of a corpus grows with its number of distinct n-grams and not with
+        the length of their string representation. A counter can be sent to another process and merged into
+        another counter with update.
+    """
+
+    def __init__(self):
+        self.vocabulary = Vocabulary()
+        self.counts = Counter()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add_tokens(self, tokens, n):
+        """
+            Count the n-grams of a sequence of tokens, from 1 to n
+
+            :param tokens: sequence of tokens
+            :type tokens: [str]
+            :param n: maximal size of the n-grams
+            :type n: int
+        """
+        ids = self.vocabulary.encode(tokens)
+        keys = ids
+        self.counts.update(keys)
+        for i in range(1, n):
+            shift = ID_BITS * i
+            keys = [k | (j << shift) for k, j in zip(keys, ids[i:])]
+            self.counts.update(keys)
+
+    def add_grams(self, grams):
+        """
+            Count n-grams given as strings
+
+            :param grams: n-grams, whose tokens are separated by '_'
+            :type grams: [str]
+        """
+        encode = self.vocabulary.encode
+        counts = self.counts
+        for gram, count in Counter(grams).items():
+            counts[pack(encode(gram.split(SEPARATOR)))] += count
+
+    def update(self, other):
+        """
+            Add the counts of another counter
+
+            :param other: counter to merge
+            :type other: NGramCounter
+        """
+        mapping = [0] + self.vocabulary.encode(other.vocabulary.tokens[1:])
+        counts = self.counts
+        for key, count in other.counts.items():
+            new_key = 0
+            shift = 0
+            while key:
+                new_key |= mapping[key & ID_MASK] << shift
+                key >>= ID_BITS
+                shift += ID_BITS
+            counts[new_key] += count
+
+    def decode(self, key):
+        tokens = self.vocabulary.tokens
+        return SEPARATOR.join(tokens[i] for i in unpack(key))
+
+    def items(self):
+        """
+            Iterate over the n-grams and their counts
+
+            :return: n-gram and count
+            :rtype: generator of (str, int)
+        """
+        for key, count in self.counts.items():
+            yield self.decode(key), count
+
+    def to_dict(self):
+        """
+            Get the counts indexed by n-gram
+
+            :return: count per n-gram
+            :rtype: Counter
+        """
+        res = Counter()
+        for gram, count in self.items():
+            res[gram] += count
+        return res
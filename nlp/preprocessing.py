@@ -2,10 +2,9 @@ from collections import defaultdict
 import re
 import logging
 from unidecode import unidecode
-import nltk
 from nltk.corpus import wordnet
-from nltk.stem.wordnet import WordNetLemmatizer
-from nltk.tokenize import WordPunctTokenizer
+
+from nlp import resources
 
 log = logging.getLogger(__name__)
 
@@ -88,7 +87,7 @@ def cleanTokens(tokens):
         :return: List of cleaned tokens
         :rtype: [String]
     """
-    stopset = set(nltk.corpus.stopwords.words('english'))
+    stopset = resources.stopwords()
     punctuation = [',', "\"", ")", "(", "\\", "\\\"),", "."]
     clean = [token.lower() for token in tokens if token.lower() not in stopset and token.lower() not in punctuation]
     for i, _ in enumerate(clean):
@@ -112,9 +111,7 @@ def generateNGrams(tokens, n):
     """
     results = {}
     for i in range(1, n + 1):
-        results[i] = []
-        ngrams = nltk.ngrams(tokens, i)
-        results[i].extend(['_'.join(words) for words in ngrams])
+        results[i] = ['_'.join(words) for words in zip(*[tokens[k:] for k in range(i)])]
     return results
 
 
@@ -154,6 +151,10 @@ def correctTheFrequencies(frequencies):
     """
         Correct the frequencies to avoid multiple counting due to n-grams.
 
+        The frequency of a n-gram is decreased by one for each distinct (n+1)-gram starting with it
+        and for each distinct (n+1)-gram ending with it. The (n+1)-grams are indexed by prefix and suffix,
+        so the correction is linear in the number of n-grams.
+
         :param frequencies: Map of n-grams occurrences
         :type frequencies: {Int:{String:Int}}
 
@@ -163,14 +164,11 @@ def correctTheFrequencies(frequencies):
     for i, ngrams in frequencies.items():
         if i + 1 not in frequencies:
             break
-        for gram in ngrams:
-            for nextgram in frequencies[i + 1]:
-                if '_' + gram in nextgram:
-                    frequencies[i][gram] -= 1
-                if '_' + gram + '_' in nextgram:
-                    frequencies[i][gram] -= 1
-                if gram + '_' in nextgram:
-                    frequencies[i][gram] -= 1
+        for nextgram in frequencies[i + 1]:
+            words = nextgram.split('_')
+            for gram in ['_'.join(words[:-1]), '_'.join(words[1:])]:
+                if gram in ngrams:
+                    ngrams[gram] -= 1
     return frequencies
 
 
@@ -222,17 +220,39 @@ def prepareText(text, lemmatization=True):
         :return: Prepared text
         :rtype: String
     """
-    tokens = WordPunctTokenizer().tokenize(text)
+    tokens = resources.tokenizer().tokenize(text)
     tokens = cleanTokens(tokens)
-    tokens = nltk.pos_tag(tokens)
+    tokens = resources.pos_tag(tokens)
     tokens = convertToWordnetTag(tokens)
     if lemmatization:
-        lemmatizer = WordNetLemmatizer()
-        tokens = [(lemmatizer.lemmatize(i, j), j) for i, j in tokens]
+        tokens = [(resources.lemmatize(i, j), j) for i, j in tokens]
     return tokens
 
 def frequencies(tokens, n=3, minlimits=None):
-    return generateNGrams(tokens, n)
+    """
+        Generate the n-grams from 1 to n and remove the ones occurring less than a certain amount.
+
+        The occurrences are corrected with correctTheFrequencies before being compared to the limits.
+        A limit lower or equal to 1 keeps all the n-grams of this size, so the occurrences are only counted
+        when a limit is higher than 1. The kept n-grams are returned in the order of the text.
+
+        :param tokens: List of tokens
+        :type tokens: [String]
+        :param n: Limit of n-grams to generate
+        :type n: Int
+        :param minlimits: Minimal number of occurrences per size of n-grams
+        :type minlimits: {Int:Int}
+
+        :return: Map of n-grams
+        :rtype: {Int:[String]}
+    """
+    allgrams = generateNGrams(tokens, n)
+    limits = {i: minlimits.get(i, 1) for i in allgrams} if minlimits else {}
+    if all(limit <= 1 for limit in limits.values()):
+        return allgrams
+    kept = correctTheFrequencies(countOccurrenceForNGrams(allgrams))
+    kept = filterByFrequency(kept, {i: limit if limit > 1 else float('-inf') for i, limit in limits.items()})
+    return {i: [g for g in ngrams if g in kept[i]] for i, ngrams in allgrams.items()}
 
 p = re.compile('(\d+)(\D+)')
 
@@ -0,0 +1,203 @@
+from collections import OrderedDict
+from functools import lru_cache
+import logging
+import os
+
+import nltk
+from nltk.stem.wordnet import WordNetLemmatizer
+from nltk.tag.perceptron import PerceptronTagger
+from nltk.tokenize import WordPunctTokenizer
+
+from echr.utils import serializer
+
+log = logging.getLogger(__name__)
+
+LEMMA_CACHE_SIZE = 200000
+
+
+@lru_cache(maxsize=None)
+def stopwords():
+    """
+        English stopwords, loaded once per process
+
+        :return: stopwords
+        :rtype: frozenset
+    """
+    return frozenset(nltk.corpus.stopwords.words('english'))
+
+
+@lru_cache(maxsize=None)
+def tokenizer():
+    return WordPunctTokenizer()
+
+
+@lru_cache(maxsize=None)
+def tagger():
+    return PerceptronTagger()
+
+
+@lru_cache(maxsize=None)
+def lemmatizer():
+    return WordNetLemmatizer()
+
+
+def pos_tag(tokens):
+    """
+        Tag the tokens with the Treebank tags, as nltk.pos_tag does, reusing the same tagger
+
+        :param tokens: List of tokens
+        :type tokens: [String]
+        :return: List of tagged tokens
+        :rtype: [(String, String)]
+    """
+    return tagger().tag(tokens)
+
+
+class LemmaCache:
+    """
+        Bounded LRU memo table (token, Wordnet tag) -> lemma
+
+        The same pairs are lemmatized over and over across the corpus. The least recently used pairs are
+        evicted once the table is full. The entries added since the last call to new_entries are tracked such
+        that the lemmas computed by several processes can be gathered before saving the table.
+
+        :param maxsize: maximal number of lemmas kept in memory
+        :type maxsize: int
+        :param lemmatize: function (token, tag) -> lemma, the Wordnet lemmatizer by default
+        :type lemmatize: callable
+    """
+
+    def __init__(self, maxsize=LEMMA_CACHE_SIZE, lemmatize=None):
+        self.maxsize = maxsize
+        self._lemmatize = lemmatize
+        self.lemmas = OrderedDict()
+        self.added = {}
+        self.track = False
+        self.hits = 0
+        self.misses = 0
+
+    def lemmatize(self, token, tag):
+        key = (token, tag)
+        lemma = self.lemmas.get(key)
+        if lemma is not None:
+            self.hits += 1
+            self.lemmas.move_to_end(key)
+            return lemma
+        self.misses += 1
+        lemma = self._lemmatize(token, tag) if self._lemmatize else lemmatizer().lemmatize(token, tag)
+        self.add(key, lemma)
+        if self.track:
+            self.added[key] = lemma
+        return lemma
+
+    def add(self, key, lemma):
+        if self.maxsize <= 0:
+            return
+        self.lemmas[key] = lemma
+        self.lemmas.move_to_end(key)
+        while len(self.lemmas) > self.maxsize:
+            self.lemmas.popitem(last=False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.lemmas) > max(0, maxsize):
+            self.lemmas.popitem(last=False)
+
+    def update(self, entries):
+        """
+            Add lemmas computed elsewhere (e.g. by another process)
+
+            :param entries: list of (token, tag, lemma)
+            :type entries: [(str, str, str)]
+        """
+        for token, tag, lemma in entries:
+            self.add((token, tag), lemma)
+
+    def new_entries(self):
+        """
+            Get and forget the lemmas computed since the last call
+
+            :return: list of (token, tag, lemma)
+            :rtype: [(str, str, str)]
+        """
+        entries = [(token, tag, lemma) for (token, tag), lemma in self.added.items()]
+        self.added = {}
+        return entries
+
+    def info(self):
+        """
+            Usage statistics of the table
+
+            :return: hits, misses, hit rate, current and maximal size
+            :rtype: dict
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.,
+            'size': len(self.lemmas),
+            'maxsize': self.maxsize
+        }
+
+    def clear(self):
+        self.lemmas.clear()
+        self.added = {}
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, path):
+        """
+            Save the table, from the least to the most recently used lemma
+
+            :param path: path of the JSON file
+            :type path: str
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        serializer.dump([[token, tag, lemma] for (token, tag), lemma in self.lemmas.items()], path, pretty=False)
+
+    def load(self, path):
+        """
+            Load a table saved by save. A missing or corrupted file is ignored.
+
+            :param path: path of the JSON file
+            :type path: str
+            :return: number of loaded lemmas
+            :rtype: int
+        """
+        if not os.path.isfile(path):
+            return 0
+        try:
+            entries = serializer.load(path)
+        except (OSError, ValueError) as e:
+            log.warning('Could not load the lemmas from {}: {}'.format(path, e))
+            return 0
+        self.update(entries)
+        return min(len(entries), len(self.lemmas))
+
+
+LEMMAS = LemmaCache()
+
+
+def lemmatize(token, tag):
+    return LEMMAS.lemmatize(token, tag)
+
+
+def configure_lemmas(maxsize=LEMMA_CACHE_SIZE, path=None):
+    """
+        Set the size of the lemma table of the process and load the lemmas saved in a previous build
+
+        :param maxsize: maximal number of lemmas kept in memory
+        :type maxsize: int
+        :param path: file where the lemmas are saved, if any
+        :type path: str
+        :return: the lemma table
+        :rtype: LemmaCache
+    """
+    LEMMAS.resize(maxsize)
+    LEMMAS.track = bool(path)
+    if path:
+        LEMMAS.load(path)
+    return LEMMAS
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+CHUNK_SIZE = 4096
+EPS = 1e-12
+
+
+def document_frequencies(bow):
+    """
+        Count the number of documents containing each feature
+
+        :param bow: Bag-of-Words matrix, one row per document
+        :type bow: scipy.sparse.csr_matrix
+        :return: document frequency of each feature
+        :rtype: numpy.ndarray
+    """
+    return np.bincount(bow.indices, minlength=bow.shape[1])
+
+
+def idf_weights(dfs, num_docs, log_base=2.0):
+    """
+        Compute the inverse document frequencies as gensim's df2idf: log(num_docs / df)
+
+        :param dfs: document frequency of each feature
+        :type dfs: numpy.ndarray
+        :param num_docs: number of documents
+        :type num_docs: int
+        :param log_base: base of the logarithm
+        :type log_base: float
+        :return: weight of each feature, 0 for the features which are in no document
+        :rtype: numpy.ndarray
+    """
+    idfs = np.zeros(len(dfs), dtype=np.float64)
+    present = dfs > 0
+    idfs[present] = np.log(float(num_docs) / dfs[present]) / np.log(log_base)
+    return idfs
+
+
+def _tfidf_rows(bow, idfs, eps):
+    weights = sparse.csr_matrix(bow, dtype=np.float64, copy=True)
+    weights.data *= idfs[weights.indices]
+    weights.data[np.abs(idfs[weights.indices]) <= eps] = 0.
+    weights.eliminate_zeros()
+    norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+    rows = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+    weights.data /= norms[rows]
+    weights.data[np.abs(weights.data) <= eps] = 0.
+    weights.eliminate_zeros()
+    return weights
+
+
+def tfidf(bow, idfs=None, workers=1, chunk_size=CHUNK_SIZE, eps=EPS):
+    """
+        Compute the TF-IDF representation of a Bag-of-Words matrix
+
+        The weighting is the default one of gensim's TfidfModel: raw term frequency, idf = log2(N / df),
+        features whose idf is lower than eps dropped, L2 normalization of each document and weights lower
+        than eps dropped. The rows are processed by chunks, in several threads if workers > 1.
+
+        :param bow: Bag-of-Words matrix, one row per document
+        :type bow: scipy.sparse.csr_matrix
+        :param idfs: weight of each feature, computed from bow if not provided
+        :type idfs: numpy.ndarray
+        :param workers: number of threads
+        :type workers: int
+        :param chunk_size: number of documents per chunk
+        :type chunk_size: int
+        :param eps: threshold under which a weight is considered null
+        :type eps: float
+        :return: TF-IDF matrix
+        :rtype: scipy.sparse.csr_matrix
+    """
+    bow = sparse.csr_matrix(bow)
+    bow.sort_indices()
+    if idfs is None:
+        idfs = idf_weights(document_frequencies(bow), bow.shape[0])
+    chunks = [bow[i:i + chunk_size] for i in range(0, bow.shape[0], chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(lambda chunk: _tfidf_rows(chunk, idfs, eps), chunks))
+    else:
+        results = [_tfidf_rows(chunk, idfs, eps) for chunk in chunks]
+    if not results:
+        return sparse.csr_matrix(bow.shape, dtype=np.float64)
+    return sparse.vstack(results, format='csr')
@@ -0,0 +1,90 @@
+from collections import Counter
+import heapq
+
+
+class MisraGries:
+    """
+        Approximate counter of the most frequent tokens of a stream (Misra-Gries summary)
+
+        Each document is counted exactly and merged into the summary. When the summary holds more than
+        2 x `capacity` tokens, it is reduced: the (capacity + 1)-th largest count is subtracted from every count
+        and the tokens whose count drops to zero are forgotten. A token occurring more than N / (capacity + 1)
+        times in a stream of N tokens is guaranteed to be kept, and its count is underestimated by at most
+        N / (capacity + 1).
+
+        :param capacity: maximal number of tokens in the summary
+        :type capacity: int
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('The capacity must be positive, got {}'.format(capacity))
+        self.capacity = capacity
+        self.counts = Counter()
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def update(self, tokens):
+        """
+            Count the tokens of a document
+
+            :param tokens: tokens of the document
+            :type tokens: [str]
+        """
+        self.merge(Counter(tokens))
+
+    def merge(self, counts):
+        """
+            Merge exact counts or another summary
+
+            :param counts: count per token
+            :type counts: dict or MisraGries
+        """
+        if isinstance(counts, MisraGries):
+            self.total += counts.total
+            counts = counts.counts
+        else:
+            self.total += sum(counts.values())
+        self.counts.update(counts)
+        if len(self.counts) > 2 * self.capacity:
+            self.reduce()
+
+    def reduce(self):
+        """
+            Keep at most `capacity` tokens
+        """
+        if len(self.counts) > self.capacity:
+            threshold = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+            self.counts = Counter({t: c - threshold for t, c in self.counts.items() if c > threshold})
+
+    def error_bound(self):
+        return self.total / (self.capacity + 1)
+
+    def candidates(self):
+        """
+            Tokens kept in the summary, by decreasing (approximate) count
+
+            :return: tokens
+            :rtype: [str]
+        """
+        self.reduce()
+        return [t for t, _ in self.counts.most_common()]
+
+
+def recall(exact, approximate):
+    """
+        Proportion of the exact top-k which is found by an approximate top-k
+
+        :param exact: exact top-k tokens
+        :type exact: iterable
+        :param approximate: approximate top-k tokens
+        :type approximate: iterable
+        :return: recall, between 0 and 1
+        :rtype: float
+    """
+    exact = set(exact)
+    if not exact:
+        return 1.
+    return len(exact.intersection(approximate)) / len(exact)
@@ -0,0 +1,121 @@
+from mock import patch
+import os
+import pytest
+
+from echr.utils import cache as cache_module
+from echr.utils.cache import StepCache, is_cacheable, local_modules
+
+
+def write(build, path, content):
+    path = os.path.join(build, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class TestStepCache:
+    @staticmethod
+    @pytest.fixture
+    def build(tmpdir):
+        build = tmpdir.strpath
+        write(build, 'raw/input/a.txt', 'a')
+        write(build, 'raw/input/b.txt', 'b')
+        write(build, 'out/result.txt', 'result')
+        return build
+
+    @staticmethod
+    @pytest.fixture
+    def step():
+        return {'run': 'echr.steps.archive', 'args': {'limit': 10}, 'inputs': ['raw/input'], 'outputs': ['out']}
+
+    @staticmethod
+    def test_cacheable():
+        assert is_cacheable({'outputs': ['a']})
+        assert not is_cacheable({'outputs': ['a'], 'cacheable': False})
+        assert not is_cacheable({'run': 'echr.steps.deploy'})
+
+    @staticmethod
+    def test_hit_after_store(build, step):
+        cache = StepCache(build)
+        key = cache.step_key(step)
+        assert not cache.is_up_to_date(step, key)
+        cache.store(step, key)
+        cache = StepCache(build)  # Reload from disk
+        assert cache.is_up_to_date(step, cache.step_key(step))
+
+    @staticmethod
+    def test_update_force_and_workers_are_ignored(build, step):
+        cache = StepCache(build)
+        key = cache.step_key(step)
+        step['args']['update'] = True
+        step['args']['force'] = True
+        step['args']['workers'] = 8
+        assert cache.step_key(step) == key
+
+    @staticmethod
+    def test_local_modules():
+        modules = local_modules('echr.steps.normalize_documents')
+        for m in ['echr.steps.normalize_documents', 'nlp.preprocessing', 'nlp.ngrams', 'nlp.resources',
+                  'echr.utils.serializer', 'echr.utils.config']:
+            assert m in modules
+        assert not any(m.split('.')[0] in ['os', 'rich', 'yaml'] for m in modules)
+        assert 'echr.steps.process_documents' not in modules
+
+    @staticmethod
+    @pytest.mark.parametrize("section,changed", [('steps', True), ('serialization', True), ('build', False),
+                                                 ('http', False)])
+    def test_configuration(build, step, section, changed):
+        settings = {'steps': {'normalize': {'ngrams': {1: 1}}}, 'serialization': {'format': 'pretty'},
+                    'build': {'env': {'WORKERS': 1}}, 'http': {'rate': 20}}
+        cache = StepCache(build)
+        with patch.object(cache_module, 'config', return_value=settings):
+            key = cache.step_key(step)
+            settings = dict(settings, **{section: {'changed': True}})
+        with patch.object(cache_module, 'config', return_value=settings):
+            assert (cache.step_key(step) != key) == changed
+
+    @staticmethod
+    def test_miss_on_imported_module_change(build, step, tmpdir):
+        cache = StepCache(build)
+        key = cache.step_key(step)
+        modules = dict(local_modules(step['run']))
+        source = tmpdir.join('cli.py')
+        with open(modules['echr.utils.cli']) as f:
+            source.write(f.read() + '\n# changed\n')
+        modules['echr.utils.cli'] = source.strpath
+        with patch.object(cache_module, 'local_modules', return_value=modules):
+            assert cache.step_key(step) != key
+
+    @staticmethod
+    @pytest.mark.parametrize("change", ['input', 'new_input', 'args', 'doc_ids'])
+    def test_miss_on_change(build, step, change):
+        cache = StepCache(build)
+        cache.store(step, cache.step_key(step))
+        doc_ids = None
+        if change == 'input':
+            write(build, 'raw/input/a.txt', 'aa')
+        elif change == 'new_input':
+            write(build, 'raw/input/c.txt', 'c')
+        elif change == 'args':
+            step['args']['limit'] = 20
+        elif change == 'doc_ids':
+            doc_ids = ['001-1234']
+        assert not cache.is_up_to_date(step, cache.step_key(step, doc_ids))
+
+    @staticmethod
+    def test_miss_on_modified_outputs(build, step):
+        cache = StepCache(build)
+        key = cache.step_key(step)
+        cache.store(step, key)
+        write(build, 'out/result.txt', 'modified')
+        assert not cache.is_up_to_date(step, key)
+        os.remove(os.path.join(build, 'out/result.txt'))
+        assert not cache.is_up_to_date(step, key)
+
+    @staticmethod
+    def test_outputs_excluded_from_inputs(build, step):
+        step['outputs'] = ['raw/input/b.txt']
+        cache = StepCache(build)
+        key = cache.step_key(step)
+        write(build, 'raw/input/b.txt', 'bb')
+        assert cache.step_key(step) == key
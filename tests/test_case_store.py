@@ -0,0 +1,83 @@
+from copy import deepcopy
+from mock import patch
+from rich.console import Console
+import io
+import json
+import os
+
+import pytest
+
+from echr.steps.filter import run as filter_run
+from echr.utils import case_store
+from echr.utils.case_store import CaseStore, write_cases, CASES_PARQUET, CASES_JSON
+from tests.data.test_filter_samples import raw_cases_input
+
+
+CASES = [
+    {'itemid': '001-1', 'docname': 'CASE OF A v. B', 'article': ['6'], 'rank': None},
+    {'itemid': '001-2', 'docname': 'CASE OF C v. D', 'article': [], 'rank': '2',
+     'mc_conclusion': [{'article': '6', 'type': 'violation'}]},
+    {'itemid': '001-3', 'docname': 'CASE OF É v. F', 'article': ['3', '6'], 'rank': '3'},
+]
+SPLITS = {'article_6': ['001-3', '001-1', '001-3'], 'multiclass': ['001-2']}
+
+
+class TestCaseStore:
+    @staticmethod
+    @pytest.fixture(params=['parquet', 'json'])
+    def store(request, tmpdir):
+        if request.param == 'parquet' and case_store.pa is None:
+            pytest.skip('pyarrow is not installed')
+        with patch('echr.utils.case_store.pa', case_store.pa if request.param == 'parquet' else None):
+            write_cases(tmpdir.strpath, deepcopy(CASES), SPLITS, split_columns={'multiclass': ['mc_conclusion']})
+            assert os.path.isfile(tmpdir.join(CASES_PARQUET if request.param == 'parquet' else CASES_JSON).strpath)
+            yield CaseStore(tmpdir.strpath)
+
+    @staticmethod
+    def test_load_all(store):
+        expected = deepcopy(CASES)
+        del expected[1]['mc_conclusion']
+        assert store.load() == expected
+        assert store.itemids() == ['001-1', '001-2', '001-3']
+
+    @staticmethod
+    def test_load_split(store):
+        assert [c['itemid'] for c in store.load('article_6')] == SPLITS['article_6']
+        assert store.load('multiclass') == [CASES[1]]
+        assert store.load('article_6', columns=['rank'], itemids=['001-1']) == [{'rank': None}]
+        assert store.split_names() == ['all', 'article_6', 'multiclass']
+        with pytest.raises(KeyError):
+            store.load('article_13')
+
+    @staticmethod
+    def test_lookup(store):
+        res = store.lookup(['001-3', '001-1', 'unknown'], columns=['article'])
+        assert res == {'001-1': {'itemid': '001-1', 'article': ['6']},
+                       '001-3': {'itemid': '001-3', 'article': ['3', '6']}}
+        assert store.get('001-2')['docname'] == 'CASE OF C v. D'
+        assert store.get('unknown') is None
+
+    @staticmethod
+    def test_missing_store(tmpdir):
+        with pytest.raises(FileNotFoundError):
+            CaseStore(tmpdir.strpath)
+
+
+class TestFilterRun:
+    @staticmethod
+    def test_splits(tmpdir):
+        os.makedirs(tmpdir.join('raw', 'raw_cases_info').strpath)
+        with open(tmpdir.join('raw', 'raw_cases_info', '2017.json').strpath, 'w') as f:
+            json.dump({'results': [{'columns': c} for c in deepcopy(raw_cases_input)]}, f)
+
+        filter_run(Console(file=io.StringIO()), tmpdir.strpath, 'test')
+
+        store = CaseStore(tmpdir.join('raw', 'cases_info').strpath)
+        cases = store.load()
+        assert len(cases) == 2 and all('mc_conclusion' not in c for c in cases)
+        for name in store.split_names()[1:]:
+            for c in store.load(name):
+                if name.startswith('article_'):
+                    assert name[len('article_'):] in [e.get('article') for e in c['conclusion']]
+                assert ('mc_conclusion' in c) == (name == 'multiclass')
+        assert not [f for f in os.listdir(tmpdir.join('raw', 'cases_info').strpath) if 'raw_cases_info' in f]
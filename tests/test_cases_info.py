@@ -0,0 +1,148 @@
+import datetime
+import json
+import os
+
+import pytest
+
+from echr.steps.cases_info import assemble_year, BASE_URL, conditional_headers, file_checksum, get_pages, get_url, merge_cases_info, \
+    parse_kpdate, plan_sync, split_window, stitch_pages, SYNC_MARGIN
+
+
+def case(itemid, kpdate, docname=''):
+    return {'columns': {'itemid': itemid, 'kpdate': kpdate, 'docname': docname}}
+
+
+class TestCasesInfo:
+    @staticmethod
+    @pytest.mark.parametrize('kpdate,expected', [
+        ('2021-03-04T00:00:00', datetime.date(2021, 3, 4)),
+        ('04/03/2021 00:00:00', datetime.date(2021, 3, 4)),
+        ('2021-03-04', datetime.date(2021, 3, 4)),
+        ('', None),
+        (None, None),
+    ])
+    def test_parse_kpdate(kpdate, expected):
+        assert parse_kpdate(kpdate) == expected
+
+    @staticmethod
+    def test_get_url():
+        url = get_url('kpdate>="START_DATE" AND kpdate<="END_DATE"&start=OFFSET&length=LENGTH',
+                      datetime.date(2020, 1, 1), datetime.date(2020, 12, 31), 500, 250)
+        assert url == 'kpdate>="2020-01-01T00:00:00.0Z" AND kpdate<="2020-12-31T23:59:59.9Z"&start=500&length=250'
+
+    @staticmethod
+    def test_conditional_headers():
+        entry = {'count_url': 'url?start=0&length=1', 'etag': '"v1"', 'last_modified': 'Mon, 01 Mar 2021 00:00:00 GMT'}
+        assert conditional_headers(entry, 'url?start=0&length=1') == {
+            'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Mar 2021 00:00:00 GMT'}
+        # The validators of another window are not sent
+        assert conditional_headers(entry, 'other?start=0&length=1') == {}
+        assert conditional_headers({'etag': '"v1"'}, 'url?start=0&length=1') == {}
+
+    @staticmethod
+    def test_merge_cases_info():
+        existing = {'resultcount': 2, 'results': [case('001-1', '2021-01-01'), case('001-2', '2021-01-02')]}
+        new = {'resultcount': 2, 'results': [case('001-2', '2021-01-02', 'updated'), case('001-3', '2021-02-01')]}
+        merged = merge_cases_info(existing, new)
+        assert merged['resultcount'] == 3
+        assert [r['columns']['itemid'] for r in merged['results']] == ['001-1', '001-2', '001-3']
+        assert merged['results'][1]['columns']['docname'] == 'updated'
+
+    @staticmethod
+    def test_plan_sync_without_state(tmpdir):
+        windows = plan_sync({'last_kpdate': None, 'years': {}}, str(tmpdir), [2019, 2020])
+        assert windows == [
+            (2019, datetime.date(2019, 1, 1), datetime.date(2019, 12, 31), False),
+            (2020, datetime.date(2020, 1, 1), datetime.date(2020, 12, 31), False),
+        ]
+
+    @staticmethod
+    def test_plan_sync_incremental(tmpdir):
+        state = {'last_kpdate': '2020-06-15', 'years': {}}
+        for year in [2018, 2019, 2020]:
+            file_path = os.path.join(str(tmpdir), '{}.json'.format(year))
+            with open(file_path, 'w') as f:
+                json.dump({'resultcount': 0, 'results': []}, f)
+            state['years'][str(year)] = {'sha256': file_checksum(file_path)}
+        # The file of 2018 was modified since the last synchronization
+        with open(os.path.join(str(tmpdir), '2018.json'), 'w') as f:
+            f.write('{}')
+
+        windows = plan_sync(state, str(tmpdir), [2018, 2019, 2020, 2021])
+        assert windows == [
+            (2018, datetime.date(2018, 1, 1), datetime.date(2018, 12, 31), False),
+            (2020, datetime.date(2020, 6, 15) - SYNC_MARGIN, datetime.date(2020, 12, 31), True),
+            (2021, datetime.date(2021, 1, 1), datetime.date(2021, 12, 31), False),
+        ]
+
+        windows = plan_sync(state, str(tmpdir), [2018, 2019, 2020, 2021], incremental=False)
+        assert len(windows) == 4 and not any(w[3] for w in windows)
+
+    @staticmethod
+    def test_split_window():
+        # One item per day
+        def count(start, end):
+            return (end - start).days + 1
+
+        start, end = datetime.date(2020, 1, 1), datetime.date(2020, 12, 31)
+        windows = split_window(start, end, count, max_results=50)
+        assert all(n <= 50 for _, _, n in windows)
+        assert sum(n for _, _, n in windows) == 366
+        assert windows[0][0] == start and windows[-1][1] == end
+        for (_, e, _), (s, _, _) in zip(windows, windows[1:]):
+            assert s == e + datetime.timedelta(days=1)
+
+    @staticmethod
+    def test_split_window_single_day():
+        day = datetime.date(2020, 1, 1)
+        assert split_window(day, day, lambda s, e: 100, max_results=50) == [(day, day, 100)]
+
+    @staticmethod
+    def test_get_pages():
+        start, end = datetime.date(2020, 1, 1), datetime.date(2020, 12, 31)
+        assert get_pages([(start, end, 1200), (end, end, 0)], page_size=500) == [
+            (start, end, 0, 500), (start, end, 500, 500), (start, end, 1000, 200)
+        ]
+
+    @staticmethod
+    def test_stitch_pages(tmpdir):
+        parts = []
+        for k, page in enumerate([[case('001-1', ''), case('001-2', '')], [case('001-2', ''), case('001-3', '')]]):
+            parts.append(os.path.join(str(tmpdir), 'part{}.json'.format(k)))
+            with open(parts[-1], 'w') as f:
+                json.dump({'resultcount': 3, 'results': page}, f)
+        output = os.path.join(str(tmpdir), '2020.json')
+        assert stitch_pages(parts, output) == 3
+        with open(output, 'r') as f:
+            content = json.load(f)
+        assert content['resultcount'] == 3
+        assert [r['columns']['itemid'] for r in content['results']] == ['001-1', '001-2', '001-3']
+
+    @staticmethod
+    def test_pages_are_sorted():
+        assert '&sort=itemid Ascending&' in BASE_URL
+
+    @staticmethod
+    @pytest.mark.parametrize('merge', [False, True])
+    def test_assemble_year(tmpdir, merge):
+        file_path = os.path.join(str(tmpdir), '2020.json')
+        with open(file_path, 'w') as f:
+            json.dump({'resultcount': 1, 'results': [case('001-0', '')]}, f)
+        parts = []
+        for k, page in enumerate([[case('001-1', ''), case('001-2', '')], [case('001-2', ''), case('001-3', '')]]):
+            parts.append(os.path.join(str(tmpdir), 'part{}.json'.format(k)))
+            with open(parts[-1], 'w') as f:
+                json.dump({'resultcount': 4, 'results': page}, f)
+
+        # An item was skipped: the year is failed and its file kept
+        with pytest.raises(ValueError):
+            assemble_year(parts, file_path, 4, merge)
+        with open(file_path, 'r') as f:
+            assert json.load(f)['resultcount'] == 1
+        assert sorted(os.listdir(str(tmpdir))) == ['2020.json', 'part0.json', 'part1.json']
+
+        assert assemble_year(parts, file_path, 3, merge) == 3
+        with open(file_path, 'r') as f:
+            content = json.load(f)
+        expected = ['001-1', '001-2', '001-3']
+        assert [r['columns']['itemid'] for r in content['results']] == (['001-0'] + expected if merge else expected)
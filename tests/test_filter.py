@@ -1,11 +1,14 @@
 import pytest
 from copy import deepcopy
 
-from echr.steps.filter import split_and_format_article, format_cases, format_subarticle, format_article, format_parties,\
-    format_conclusion, filter_cases, generate_statistics, merge_conclusion_elements, find_base_articles
+from echr.steps.filter import split_and_format_article, parse_conclusion, format_cases, format_subarticle, format_article, format_parties,\
+    format_conclusion, filter_cases, generate_statistics, merge_conclusion_elements, find_base_articles, \
+    StatisticsAccumulator
 from echr.utils.misc import compare_two_lists
 from tests.data.test_filter_samples import merge_ccl, format_ccl, raw_cases_input, columns
 from rich.console import Console
+from mock import patch
+import io
 
 
 class TestFormatConclusion:
@@ -45,6 +48,18 @@ class TestFormatConclusion:
         res = format_conclusion(input)
         assert (compare_two_lists(res, output))
 
+    @staticmethod
+    def test_parse_conclusion_cache():
+        parse_conclusion.cache_clear()
+        ccl = format_ccl[0][0]
+        res = format_conclusion(ccl)
+        for e in res:
+            e['type'] = 'modified'
+            e.setdefault('details', []).append('modified')
+        assert compare_two_lists(format_conclusion(ccl), format_ccl[0][1])
+        assert parse_conclusion.cache_info().hits == 1
+        assert parse_conclusion.cache_info().misses == 1
+
 
 class TestFormatParties:
     @staticmethod
@@ -137,3 +152,33 @@ class TestGenerateStatistics:
         expected = {'attributes': {'conclusion': {'cardinal': 4, 'density': 4 / 3}}}
         res = generate_statistics(case)
         assert res == expected
+
+
+class TestFormatCasesWorkers:
+    @staticmethod
+    def test_same_as_serial():
+        cases = [deepcopy(c) for _ in range(5) for c in raw_cases_input]
+        expected_statistics = StatisticsAccumulator()
+        expected = format_cases(Console(file=io.StringIO()), deepcopy(cases), statistics=expected_statistics)
+        with patch('echr.steps.filter.FORMAT_CHUNK_SIZE', 4):
+            statistics = StatisticsAccumulator()
+            res = format_cases(Console(file=io.StringIO()), deepcopy(cases), workers=2, statistics=statistics)
+        normalize = lambda l: [{k: sorted(v) if k in ['article', 'paragraphs'] else v for k, v in c.items()} for c in l]
+        assert normalize(res) == normalize(expected)
+        assert statistics.statistics() == expected_statistics.statistics() == generate_statistics(expected)
+
+
+class TestStatisticsAccumulator:
+    @staticmethod
+    def test_merge():
+        cases = [{'a': 'xyz', 'b': [1, 2, 3]}, {'a': 'xy', 'b': [4, 5, 6]}, {'a': 'x', 'b': []}, {'a': ' ', 'b': [1]}]
+        first, second = StatisticsAccumulator(), StatisticsAccumulator()
+        for c in cases[:2]:
+            first.add(c)
+        for c in cases[2:]:
+            second.add(c)
+        first.update(second)
+        first.update(StatisticsAccumulator())
+        assert first.statistics() == generate_statistics(cases)
+        assert first.statistics() == {'attributes': {'a': {'cardinal': 3, 'density': 0.75},
+                                                     'b': {'cardinal': 6, 'density': 1.5}}}
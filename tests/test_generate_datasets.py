@@ -0,0 +1,157 @@
+from mock import patch
+from rich.console import Console
+import io
+import os
+
+from scipy import sparse
+import numpy as np
+import pytest
+
+from echr.steps.generate_datasets import run
+from echr.steps.process_documents import run as process_run
+from echr.utils import dataset_export
+from echr.utils.case_store import write_cases
+from echr.utils.dataset_export import export_dataset, format_rows, join_rows, one_hot, outcomes_matrix, write_svmlight
+
+DOCUMENTS = {
+    '001-1': 'applicant complain length proceeding court court',
+    '001-2': 'court dismiss complaint',
+    '001-3': 'applicant lodge application court',
+}
+CASES = [
+    {'itemid': '001-1', 'respondent': 'FRA', 'article': ['6', '6-1'],
+     'conclusion': [{'type': 'violation', 'base_article': '6'}, {'type': 'no-violation', 'base_article': '3'}]},
+    {'itemid': '001-2', 'respondent': 'ITA', 'article': ['3'],
+     'conclusion': [{'type': 'no-violation', 'base_article': '3'}]},
+    {'itemid': '001-3', 'respondent': 'FRA', 'article': ['6'],
+     'conclusion': [{'type': 'violation', 'base_article': '6'}, {'type': 'no-violation', 'base_article': '6'}]},
+]
+
+
+def read_svmlight(path):
+    with open(path) as f:
+        lines = [l.rstrip('\n').split(' # ') for l in f]
+    res = []
+    for content, itemid in lines:
+        labels, *features = content.split(' ')
+        res.append((itemid, [int(l) for l in labels.split(',')],
+                    {int(k): float(v) for k, v in (e.split(':') for e in features)}))
+    return res
+
+
+@pytest.fixture
+def build(tmpdir):
+    os.makedirs(tmpdir.join('raw', 'cases_info').strpath)
+    os.makedirs(tmpdir.join('raw', 'normalized_documents').strpath)
+    write_cases(tmpdir.join('raw', 'cases_info').strpath, CASES)
+    for doc_id, text in DOCUMENTS.items():
+        with open(tmpdir.join('raw', 'normalized_documents', '{}_normalized.txt'.format(doc_id)).strpath, 'w') as f:
+            f.write(text)
+    with patch('echr.steps.process_documents.config', return_value={'steps': {'normalize': {'ngrams': {1: 1}}}}):
+        process_run(Console(file=io.StringIO()), tmpdir.strpath, 'test', limit_tokens=100, force=True,
+                    export_text_files=False)
+    yield tmpdir
+
+
+class TestDatasetExport:
+    @staticmethod
+    def test_one_hot():
+        res = one_hot([[0, 2], [], [1, 1]], 3)
+        assert res.toarray().tolist() == [[1, 0, 1], [0, 0, 0], [0, 2, 0]]
+
+    @staticmethod
+    def test_outcomes_matrix():
+        assert outcomes_matrix([[1, -3], [-2]], 3).toarray().tolist() == [[1, 0, -1], [0, -1, 0]]
+
+    @staticmethod
+    def test_write_svmlight(tmpdir):
+        path = tmpdir.join('data.svmlight').strpath
+        write_svmlight(path, sparse.csr_matrix(np.array([[0, 1.5, 0], [0, 0, 0]])), [[1, -2], [3]], ['a', 'b'])
+        with open(path) as f:
+            assert f.read() == '1,-2 1:1.5 # a\n3 # b\n'
+
+    @staticmethod
+    def test_format_rows_integers():
+        matrix = sparse.csr_matrix(np.array([[1, 0, -25], [0, 0, 0], [0, 1234567, 0]], dtype=np.int32))
+        assert format_rows(matrix) == [b'0:1 2:-25', b'', b'1:1234567']
+        assert format_rows(matrix, offset=9) == [b'9:1 11:-25', b'', b'10:1234567']
+        assert format_rows(sparse.csr_matrix((2, 3), dtype=np.int32)) == [b'', b'']
+
+    @staticmethod
+    @pytest.mark.parametrize('value,expected', [
+        (1.5, b'1.5'), (-2.0, b'-2.0'), (0.1, b'0.1'), (1e-05, b'1e-05'), (0.0001, b'0.0001'), (123.25, b'123.25'),
+        (1e16, b'1e+16'), (9.999999999999999e-05, b'9.999999999999999e-05'),
+        (0.09999999999999999, b'0.09999999999999999'), (-3.5e-300, b'-3.5e-300'),
+    ])
+    def test_format_rows_floats(value, expected):
+        assert format_rows(sparse.csr_matrix(np.array([[0, value]]))) == [b'1:' + expected]
+
+    @staticmethod
+    def test_format_rows_read_back():
+        powers = 10.0 ** np.arange(-8, 5)
+        # The floats just below each power of 10 and random values
+        values = np.concatenate([np.nextafter(powers, 0), np.nextafter(np.nextafter(powers, 0), 0), powers,
+                                 np.random.default_rng(0).random(1000) * 1e-3])
+        values[::3] *= -1
+        tokens = format_rows(sparse.csr_matrix(values[None, :]))[0].split(b' ')
+        assert [float(t.split(b':')[1]) for t in tokens] == values.tolist()
+        with pytest.raises(ValueError):
+            format_rows(sparse.csr_matrix(np.array([[np.nan]])))
+
+    @staticmethod
+    def test_join_rows():
+        assert join_rows([[b'0:1', b'', b''], [b'5:2', b'6:1', b'']]) == [b'0:1 5:2', b'6:1', b'']
+
+    @staticmethod
+    def test_export_dataset(tmpdir):
+        descriptive = sparse.csr_matrix(np.array([[1, 0], [0, 1]], dtype=np.int32))
+        text = sparse.csr_matrix(np.array([[0.5, 0], [0, 0]]))
+        export_dataset(tmpdir.strpath, {'text': (text, 3), 'descriptive': (descriptive, 0)},
+                       {'text': ['text'], 'descriptive+text': ['text', 'descriptive']},
+                       ['001-1', '001-2'], [[1], [-1]], 1)
+        with open(tmpdir.join('descriptive+text.svmlight').strpath) as f:
+            assert f.read() == '1 0:1 3:0.5 # 001-1\n-1 1:1 # 001-2\n'
+        matrix = sparse.load_npz(tmpdir.join('descriptive+text.npz').strpath)
+        assert matrix.toarray().tolist() == [[1, 0, 0, 0.5, 0], [0, 1, 0, 0, 0]]
+        assert sparse.load_npz(tmpdir.join('text.npz').strpath).shape == (2, 5)
+
+
+class TestGenerateDatasets:
+    @staticmethod
+    @pytest.mark.parametrize('pyarrow', [True, False])
+    def test_run(build, pyarrow):
+        if pyarrow and dataset_export.pa is None:
+            pytest.skip('pyarrow is not installed')
+        with patch('echr.utils.dataset_export.pa', dataset_export.pa if pyarrow else None):
+            run(Console(file=io.StringIO()), build.strpath, 'test', processed_folder='all')
+        folder = build.join('datasets')
+        features = {}
+        for k in ['descriptive', 'BoW', 'TF_IDF', 'descriptive+BoW', 'descriptive+TF_IDF']:
+            features[k] = read_svmlight(folder.join('{}.svmlight'.format(k)).strpath)
+            matrix = sparse.load_npz(folder.join('{}.npz'.format(k)).strpath)
+            assert matrix.shape[0] == 2
+            assert [sorted(r.items()) for _, _, r in features[k]] == \
+                [sorted(zip(matrix.getrow(i).indices.tolist(), matrix.getrow(i).data.tolist())) for i in range(2)]
+
+        # 001-3 has opposed conclusions for the same article
+        assert [(i, l) for i, l, _ in features['BoW']] == [('001-1', [1, -2]), ('001-2', [-2])]
+        descriptive = features['descriptive'][0][2]
+        assert len(descriptive) == 4 and set(descriptive.values()) == {1}
+        assert max(max(r) for _, _, r in features['descriptive']) < min(features['BoW'][0][2])
+        for i in range(2):
+            assert features['descriptive+BoW'][i][2] == {**features['descriptive'][i][2], **features['BoW'][i][2]}
+            assert features['descriptive+TF_IDF'][i][2] == {**features['descriptive'][i][2],
+                                                            **features['TF_IDF'][i][2]}
+        assert sum(features['BoW'][0][2].values()) == len(DOCUMENTS['001-1'].split())
+
+        labels = sparse.load_npz(folder.join(dataset_export.OUTCOMES_MATRIX).strpath)
+        assert labels.toarray().tolist() == [[1, -1], [0, -1]]
+        if pyarrow:
+            import pyarrow.parquet as pq
+            table = pq.read_table(folder.join(dataset_export.LABELS_PARQUET).strpath).to_pydict()
+        else:
+            import json
+            with open(folder.join(dataset_export.LABELS_JSON).strpath) as f:
+                table = json.load(f)
+        assert table == {'itemid': ['001-1', '001-2'], 'labels': [[1, -2], [-2]]}
+        assert os.path.isfile(build.join('datasets.zip').strpath)
@@ -1,19 +1,67 @@
 from mock import patch
-from unittest.mock import mock_open, call
+from unittest.mock import mock_open
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 from rich.console import Console
 from rich.progress import Progress
+import asyncio
+import gzip
+import hashlib
+import json
 import sys
 import os
+import zipfile
+import threading
 import pytest
 
-from echr.steps.get_documents import get_documents
+from echr.steps.get_documents import backoff, get_documents, save_manifest, BACKOFF_MAX
+from echr.utils.http import HttpClient
 
 
-def clean_up():
-    paths = ["/tmp/101.pdf", "/tmp/202.docx", "/tmp/303.docx"]
-    for p in paths:
-        if os.path.exists(p):
-            os.remove(p)
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        doc_id = parse_qs(urlsplit(self.path).query)['id'][0]
+        self.server.requests.append((doc_id, dict(self.headers)))
+        if doc_id.startswith('404'):
+            return self.send(404)
+        body = 'content of {}'.format(doc_id).encode('utf-8')
+        etag = '"{}"'.format(self.server.versions.get(doc_id, 'v1'))
+        if self.headers.get('If-None-Match') == etag:
+            return self.send(304)
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == etag:
+            start = int(range_header.split('=')[1].split('-')[0])
+            return self.send(206, body[start:], {'ETag': etag, 'Content-Range': 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body))})
+        if doc_id.startswith('gzip'):
+            # Server ignoring Accept-Encoding
+            return self.send(200, gzip.compress(body), {'ETag': etag, 'Content-Encoding': 'gzip'})
+        if doc_id.startswith('trunc') and doc_id not in self.server.truncated:
+            # Send half of the document and close the connection
+            self.server.truncated.add(doc_id)
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.send(200, body, {'ETag': etag})
+
+    def log_message(self, *args):
+        pass
 
 
 class TestGetDocuments:
@@ -23,34 +71,174 @@ class TestGetDocuments:
         return 'builtins.open' if sys.version_info >= (3, 0) else '__builtin__.open'
 
     @staticmethod
-    def test_get_docs_ok(builtins_open):
-        with patch('requests.get') as get, patch(builtins_open, mock_open()) as mck_open:
-            get.return_value.ok = True
-            get.return_value.iter_content.return_value = []
-            id_list = [("101", 0), ("202", 1), ("303", 1)]
-            path = "/tmp"
+    @pytest.fixture
+    def server():
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.requests = []
+        server.versions = {}
+        server.truncated = set()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        local = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        client = HttpClient(endpoints={'https://hudoc.echr.coe.int': local}, concurrency=4)
+        with patch('echr.steps.get_documents.get_client', return_value=client), \
+                patch('echr.steps.get_documents.BACKOFF_BASE', 0):
+            yield server
+        server.shutdown()
+        server.server_close()
+
+    @staticmethod
+    def test_get_docs_ok(server, tmpdir):
+        id_list = [("101", 0), ("202", 1), ("303", 1)]
 
-            get_documents(Console(), id_list, path, update=False, force=False)
+        report = get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
 
-            files_list = ["101.pdf", "202.docx", "303.docx"]
-            open_args = [call(os.path.join(path, f), 'wb') for f in files_list]
-            mck_open.assert_has_calls(open_args, any_order=True)
+        assert sorted(report['downloaded']) == ["101", "202", "303"]
+        assert report['failed'] == [] and report['skipped'] == [] and report['not_modified'] == []
+        for f, doc_id in [("101.pdf", "101"), ("202.docx", "202"), ("303.docx", "303")]:
+            with open(tmpdir.join(f).strpath, 'r') as content:
+                assert content.read() == 'content of {}'.format(doc_id)
+        assert not [f for f in os.listdir(tmpdir.strpath) if f.endswith('.part')]
 
     @staticmethod
-    def test_docks_with_update(builtins_open):
-        with patch('requests.get') as get, patch(builtins_open, mock_open()) as mck_open, \
-                patch('os.path.isfile') as isfile:
-            isfile.return_value = True
-            get.return_value.ok = True
-            get.return_value.iter_content.return_value = []
-            id_list = [("101", 0), ("202", 1), ("303", 1)]
-            path = "/tmp"
+    def test_writes_out_of_event_loop(server, tmpdir):
+        threads = []
+
+        def write_file(filename, mode, data):
+            threads.append(threading.current_thread())
+            with open(filename, mode) as f:
+                f.write(data)
+
+        with patch('echr.steps.get_documents.WRITE_BUFFER_SIZE', 4), \
+                patch('echr.steps.get_documents.write_file', side_effect=write_file):
+            report = get_documents(Console(), [("202", 1)], tmpdir.strpath, update=False, force=False)
+
+        assert report['downloaded'] == ["202"]
+        assert tmpdir.join("202.docx").read() == "content of 202"
+        assert threads and threading.main_thread() not in threads
+
+    @staticmethod
+    def test_without_to_thread(server, tmpdir, monkeypatch):
+        # asyncio.to_thread is not available before Python 3.9
+        monkeypatch.delattr(asyncio, 'to_thread', raising=False)
+        with patch('echr.steps.get_documents.WRITE_BUFFER_SIZE', 4):
+            report = get_documents(Console(), [("101", 0), ("trunc-1", 1)], tmpdir.strpath, update=False,
+                                   force=False)
+
+        assert sorted(report['downloaded']) == ["101", "trunc-1"] and report['failed'] == []
+        assert tmpdir.join("trunc-1.docx").read() == "content of trunc-1"
+
+    @staticmethod
+    def test_content_encoding(server, tmpdir):
+        report = get_documents(Console(), [("gzip-1", 1)], tmpdir.strpath, update=False, force=False)
+
+        assert report['downloaded'] == ["gzip-1"] and report['failed'] == []
+        assert tmpdir.join("gzip-1.docx").read() == "content of gzip-1"
+        assert server.requests[0][1]['Accept-Encoding'] == 'identity'
+        with open(tmpdir.join("manifest.json").strpath, 'r') as f:
+            entry = json.load(f)["gzip-1"]
+        assert entry['size'] == len("content of gzip-1") and entry['etag'] == '"v1"'
+
+    @staticmethod
+    def test_manifest(server, tmpdir):
+        id_list = [("101", 0), ("202", 1)]
+        get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
+
+        with open(tmpdir.join("manifest.json").strpath, 'r') as f:
+            manifest = json.load(f)
+        assert sorted(manifest.keys()) == ["101", "202"]
+        entry = manifest["202"]
+        assert entry['filename'] == "202.docx"
+        assert entry['size'] == len("content of 202")
+        assert entry['sha256'] == hashlib.sha256(b"content of 202").hexdigest()
+        assert entry['etag'] == '"v1"'
+
+    @staticmethod
+    def test_skip_existing(server, tmpdir):
+        id_list = [("101", 0), ("202", 1)]
+        get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
+        server.requests.clear()
+
+        report = get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
+        assert sorted(report['skipped']) == ["101", "202"]
+        assert server.requests == []
 
-            get_documents(Console(), id_list, path, update=True, force=True)
+        # A truncated document is downloaded again
+        tmpdir.join("202.docx").write("content")
+        report = get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
+        assert report['skipped'] == ["101"] and report['downloaded'] == ["202"]
+        assert tmpdir.join("202.docx").read() == "content of 202"
 
-            files_list = ["101.pdf", "202.docx", "303.docx"]
-            open_args = [call(os.path.join(path, f), 'wb') for f in files_list]
-            mck_open.assert_has_calls(open_args, any_order=True)
+    @staticmethod
+    def test_revalidate(server, tmpdir):
+        id_list = [("101", 0), ("202", 1)]
+        get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
+        server.versions["202"] = 'v2'
+
+        report = get_documents(Console(), id_list, tmpdir.strpath, update=True, force=True)
+
+        assert report['not_modified'] == ["101"] and report['downloaded'] == ["202"]
+        assert dict(server.requests[-2:])["101"]['If-None-Match'] == '"v1"'
+        with open(tmpdir.join("manifest.json").strpath, 'r') as f:
+            assert json.load(f)["202"]['etag'] == '"v2"'
+
+    @staticmethod
+    def test_legacy_documents(server, tmpdir):
+        with zipfile.ZipFile(tmpdir.join("202.docx").strpath, 'w') as z:
+            z.writestr('word/document.xml', '<document/>')
+        tmpdir.join("303.docx").write("truncated")
+        id_list = [("202", 1), ("303", 1)]
+
+        report = get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
+
+        assert report['skipped'] == ["202"] and report['downloaded'] == ["303"]
+        with open(tmpdir.join("manifest.json").strpath, 'r') as f:
+            assert json.load(f)["202"]['etag'] is None
+
+    @staticmethod
+    def test_manifest_saved_out_of_event_loop(server, tmpdir, monkeypatch):
+        monkeypatch.delattr(asyncio, 'to_thread', raising=False)
+        with zipfile.ZipFile(tmpdir.join("202.docx").strpath, 'w') as z:
+            z.writestr('word/document.xml', '<document/>')
+        threads = []
+
+        def save(folder, manifest):
+            threads.append(threading.current_thread())
+            save_manifest(folder, manifest)
+
+        with patch('echr.steps.get_documents.MANIFEST_SAVE_INTERVAL', 1), \
+                patch('echr.steps.get_documents.save_manifest', side_effect=save):
+            report = get_documents(Console(), [("101", 0), ("202", 1)], tmpdir.strpath, update=False, force=False)
+
+        assert report['skipped'] == ["202"] and report['downloaded'] == ["101"]
+        assert len(threads) == 3 and threading.main_thread() not in threads
+        with open(tmpdir.join("manifest.json").strpath, 'r') as f:
+            assert sorted(json.load(f).keys()) == ["101", "202"]
+
+    @staticmethod
+    def test_resume(server, tmpdir):
+        report = get_documents(Console(), [("trunc-1", 1)], tmpdir.strpath, update=False, force=False)
+
+        assert report['downloaded'] == ["trunc-1"]
+        assert tmpdir.join("trunc-1.docx").read() == "content of trunc-1"
+        headers = [h for doc_id, h in server.requests if doc_id == "trunc-1"]
+        assert len(headers) == 2
+        assert headers[1]['Range'] == 'bytes={}-'.format(len("content of trunc-1") // 2)
+        assert not [f for f in os.listdir(tmpdir.strpath) if '.part' in f]
+
+    @staticmethod
+    def test_failures_reported(server, tmpdir):
+        id_list = [("101", 0), ("404-1", 1)]
+
+        report = get_documents(Console(), id_list, tmpdir.strpath, update=False, force=False)
+
+        assert report['downloaded'] == ["101"]
+        assert len(report['failed']) == 1
+        failure = report['failed'][0]
+        assert failure['doc_id'] == "404-1" and failure['attempts'] == 5
+        assert [doc_id for doc_id, _ in server.requests].count("404-1") == 5
+        assert not os.path.exists(tmpdir.join("404-1.docx").strpath)
+        assert not os.path.exists(tmpdir.join("404-1.docx.part").strpath)
 
     @staticmethod
     def test_empty_id_list(builtins_open):
@@ -58,24 +246,14 @@ class TestGetDocuments:
             id_list = []
             path = "/tmp"
 
-            get_documents(Console(), id_list, path, update=True, force=False)
+            report = get_documents(Console(), id_list, path, update=True, force=False)
 
             mck_open.assert_not_called()
+            assert report == {'downloaded': [], 'not_modified': [], 'skipped': [], 'failed': []}
 
     @staticmethod
-    def test_flies_created(tmpdir):
-        try:
-            with patch('requests.get') as get:
-                get.return_value.ok = True
-                get.return_value.iter_content.return_value = []
-                id_list = [("101", 0), ("202", 1), ("303", 1)]
-
-                get_documents(Console(), id_list, tmpdir.strpath, update=True, force=True)
-
-                files_list = ["101.pdf", "202.docx", "303.docx"]
-                files_exist = [os.path.exists(tmpdir.join(f)) for f in files_list]
-                assert all(files_exist)
-        finally:
-            clean_up()
-
-
+    @pytest.mark.parametrize('attempt', [0, 1, 5, 20])
+    def test_backoff(attempt):
+        delays = [backoff(attempt) for _ in range(100)]
+        assert all(0 <= d <= min(BACKOFF_MAX, 0.5 * 2 ** attempt) for d in delays)
+        assert len(set(delays)) > 1
@@ -0,0 +1,68 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from echr.utils.http import HttpClient, TokenBucket
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        body = self.path.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttp:
+    @staticmethod
+    @pytest.fixture
+    def server():
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.connections = set()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    @staticmethod
+    def test_endpoint_override(server):
+        local = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        client = HttpClient(endpoints={'https://hudoc.echr.coe.int': local})
+        r = client.get('https://hudoc.echr.coe.int/app/conversion/docx?id=001-1')
+        assert r.ok
+        assert r.text == '/app/conversion/docx?id=001-1'
+
+    @staticmethod
+    def test_keep_alive(server):
+        client = HttpClient(pool_size=1)
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        for i in range(5):
+            assert client.get(url + str(i)).text == '/' + str(i)
+        assert len(server.connections) == 1
+
+    @staticmethod
+    def test_token_bucket():
+        bucket = TokenBucket(rate=50, burst=5)
+        start = time.monotonic()
+        for _ in range(15):
+            bucket.acquire()
+        # 5 requests are sent at once, the 10 other ones at 50 requests per second
+        assert time.monotonic() - start >= 0.18
+
+    @staticmethod
+    def test_token_bucket_disabled():
+        bucket = TokenBucket(rate=0)
+        start = time.monotonic()
+        for _ in range(1000):
+            bucket.acquire()
+        assert time.monotonic() - start < 0.1
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+from unidecode import unidecode
+
+from echr.utils.matching import AhoCorasick, JudgeMatcher, PrefixMatcher
+
+
+def naive_map_judge(line, judges_per_country):
+    for _, v in judges_per_country.items():
+        for name, judge in v.items():
+            if unidecode(name.upper()) in unidecode(line.upper().replace('-', ' ')):
+                return name, judge
+    return None, None
+
+
+class TestAhoCorasick:
+    @staticmethod
+    @pytest.mark.parametrize('patterns,text,expected', [
+        (['he', 'she', 'his', 'hers'], 'ushers', 0),
+        (['hers', 'she', 'his', 'he'], 'ushers', 0),
+        (['hers', 'she'], 'ushe', 1),
+        (['abcd', 'bc'], 'abce', 1),
+        (['abc', 'xyz'], 'ab', None),
+        (['abc', ''], 'xyz', 1),
+        ([], 'abc', None),
+    ])
+    def test_search(patterns, text, expected):
+        assert AhoCorasick(patterns).search(text) == expected
+
+
+class TestJudgeMatcher:
+    @staticmethod
+    @pytest.fixture
+    def judges():
+        with open('tests/data/judges_per_country.json', 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def test_same_as_naive_matching(judges):
+        lines = [
+            'Luis López Guerra',
+            'Stéphanie Mourou-Vikström',
+            'Işıl Karakaş',
+            'Nebojša Vučinić, judges',
+            'and Stanley Naismith, Section Registrar',
+            'Gabriele Kucsko-Stadlmayer',
+            'Nobody in particular',
+            '',
+        ]
+        names = [name for v in judges.values() for name in v]
+        lines += [n.lower() for n in names] + ['{} and {}'.format(a, b) for a, b in zip(names, reversed(names))]
+        matcher = JudgeMatcher(judges)
+        for line in lines:
+            assert matcher.match(line) == naive_map_judge(line, judges)
+
+    @staticmethod
+    def test_stats(judges):
+        matcher = JudgeMatcher(judges)
+        matcher.match('Luis López Guerra')
+        matcher.match('Luis López Guerra')
+        matcher.match('Nobody in particular')
+        assert matcher.stats == {'lines': 3, 'matched': 2}
+        assert matcher.matches['LÓPEZ GUERRA'] == 2
+
+
+class TestPrefixMatcher:
+    @staticmethod
+    @pytest.mark.parametrize('text,expected', [
+        ('THE FACTS OF THE CASE', ('facts', 'THE FACTS')),
+        ('the law', ('law', 'THE LAW')),
+        ('FACTS AND PROCEDURE', ('procedure', 'FACTS AND PROCEDURE')),
+        ('FACTS', ('facts', 'FACTS')),
+        ('FACT', (None, None)),
+        ('', (None, None)),
+    ])
+    def test_match(text, expected):
+        groups = {
+            'procedure': ['FACTS AND PROCEDURE'],
+            'facts': ['THE FACTS', 'FACTS'],
+            'law': ['THE LAW'],
+        }
+        assert PrefixMatcher(groups).match(text) == expected
+
+    @staticmethod
+    def test_group_order():
+        matcher = PrefixMatcher({'first': ['THE FACTS OF'], 'second': ['THE']})
+        assert matcher.match('THE FACTS OF THE CASE') == ('first', 'THE FACTS OF')
+        matcher = PrefixMatcher({'first': ['THE'], 'second': ['THE FACTS OF']})
+        assert matcher.match('THE FACTS OF THE CASE') == ('first', 'THE')
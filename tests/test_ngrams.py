@@ -0,0 +1,103 @@
+from collections import Counter
+import pickle
+
+import pytest
+
+from nlp.ngrams import NGramCounter, pack, unpack
+from nlp.preprocessing import generateNGrams, correctTheFrequencies, countOccurrenceForNGrams, frequencies
+
+TOKENS = ['applicant', 'complain', 'length', 'proceeding', 'applicant', 'complain', 'length', 'court']
+
+
+def quadratic_correction(frequencies):
+    for i, ngrams in frequencies.items():
+        if i + 1 not in frequencies:
+            break
+        for gram in ngrams:
+            for nextgram in frequencies[i + 1]:
+                if '_' + gram in nextgram:
+                    frequencies[i][gram] -= 1
+                if '_' + gram + '_' in nextgram:
+                    frequencies[i][gram] -= 1
+                if gram + '_' in nextgram:
+                    frequencies[i][gram] -= 1
+    return frequencies
+
+
+def string_counts(tokens, n):
+    return Counter(g for grams in generateNGrams(tokens, n).values() for g in grams)
+
+
+class TestNGramCounter:
+    @staticmethod
+    def test_pack():
+        assert unpack(pack([3, 1, 2 ** 32 - 1])) == [3, 1, 2 ** 32 - 1]
+        assert pack([1]) != pack([1, 1])
+
+    @staticmethod
+    def test_generate_ngrams():
+        assert generateNGrams(['a', 'b', 'c'], 4) == {1: ['a', 'b', 'c'], 2: ['a_b', 'b_c'], 3: ['a_b_c'], 4: []}
+
+    @staticmethod
+    @pytest.mark.parametrize('n', [1, 2, 4])
+    def test_same_counts_as_strings(n):
+        counter = NGramCounter()
+        counter.add_tokens(TOKENS, n)
+        counter.add_tokens(TOKENS[:3], n)
+        expected = string_counts(TOKENS, n) + string_counts(TOKENS[:3], n)
+        assert counter.to_dict() == expected
+        assert len(counter) == len(expected)
+
+    @staticmethod
+    def test_add_grams():
+        counter = NGramCounter()
+        grams = [g for grams in generateNGrams(TOKENS, 3).values() for g in grams]
+        counter.add_grams(grams)
+        assert counter.to_dict() == Counter(grams)
+
+    @staticmethod
+    def test_separator_in_token():
+        counter = NGramCounter()
+        counter.add_tokens(['a_b', 'a', 'b'], 2)
+        assert counter.to_dict() == string_counts(['a_b', 'a', 'b'], 2)
+        assert counter.to_dict()['a_b'] == 2
+
+    @staticmethod
+    def test_update():
+        first, second = NGramCounter(), NGramCounter()
+        first.add_tokens(TOKENS[:5], 3)
+        second.add_tokens(list(reversed(TOKENS)), 3)
+        second = pickle.loads(pickle.dumps(second))
+        first.update(second)
+        first.update(NGramCounter())
+        assert first.to_dict() == string_counts(TOKENS[:5], 3) + string_counts(list(reversed(TOKENS)), 3)
+        assert len(first.vocabulary) == len(set(TOKENS))
+
+
+class TestFrequencies:
+    @staticmethod
+    @pytest.mark.parametrize('tokens', [list('abcabcaab'), list('aaaa'), list('abcdbcdecd'), []])
+    def test_same_correction_as_quadratic(tokens):
+        expected = quadratic_correction(countOccurrenceForNGrams(generateNGrams(tokens, 4)))
+        assert correctTheFrequencies(countOccurrenceForNGrams(generateNGrams(tokens, 4))) == expected
+
+    @staticmethod
+    def test_correction_is_token_aligned():
+        res = correctTheFrequencies(countOccurrenceForNGrams(generateNGrams(['court', 'high', 'courts'], 2)))
+        assert res[1] == {'court': 0, 'high': -1, 'courts': 0}
+
+    @staticmethod
+    def test_no_limit():
+        assert frequencies(TOKENS, 4) == generateNGrams(TOKENS, 4)
+        assert frequencies(TOKENS, 4, {1: 1, 2: 0, 3: 1, 4: 1}) == generateNGrams(TOKENS, 4)
+
+    @staticmethod
+    def test_min_frequency():
+        # 'applicant_complain' occurs twice, but once corrected by the 3-grams it starts or ends
+        res = frequencies(TOKENS, 3, {1: 1, 2: 2, 3: 1})
+        assert res[1] == TOKENS and res[3] == generateNGrams(TOKENS, 3)[3]
+        assert res[2] == []
+        res = frequencies(TOKENS, 2, {1: 1, 2: 2})
+        assert res[2] == ['applicant_complain', 'complain_length', 'applicant_complain', 'complain_length']
+        res = frequencies(list('aaaaab'), 2, {1: 2, 2: 1})
+        assert res == {1: list('aaaaa'), 2: ['a_a'] * 4 + ['a_b']}
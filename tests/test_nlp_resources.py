@@ -0,0 +1,79 @@
+from mock import patch
+import json
+
+import pytest
+
+from nlp import resources
+from nlp.resources import LemmaCache
+
+
+def lemmatize(token, tag):
+    return token[:-1] if token.endswith('s') else token
+
+
+class TestLemmaCache:
+    @staticmethod
+    @pytest.fixture
+    def cache():
+        return LemmaCache(maxsize=2, lemmatize=lemmatize)
+
+    @staticmethod
+    def test_counters(cache):
+        assert cache.lemmatize('judges', 'n') == 'judge'
+        assert cache.lemmatize('judges', 'n') == 'judge'
+        assert cache.lemmatize('judges', 'v') == 'judge'
+        assert cache.info() == {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'size': 2, 'maxsize': 2}
+        cache.clear()
+        assert cache.info() == {'hits': 0, 'misses': 0, 'hit_rate': 0., 'size': 0, 'maxsize': 2}
+
+    @staticmethod
+    def test_least_recently_used_evicted(cache):
+        cache.lemmatize('courts', 'n')
+        cache.lemmatize('judges', 'n')
+        cache.lemmatize('courts', 'n')
+        cache.lemmatize('rights', 'n')
+        assert list(cache.lemmas) == [('courts', 'n'), ('rights', 'n')]
+        cache.resize(1)
+        assert list(cache.lemmas) == [('rights', 'n')]
+
+    @staticmethod
+    def test_save_and_load(cache, tmpdir):
+        path = tmpdir.join('cache', 'lemmas.json').strpath
+        cache.lemmatize('courts', 'n')
+        cache.lemmatize('judges', 'n')
+        cache.save(path)
+        loaded = LemmaCache(maxsize=10, lemmatize=lemmatize)
+        assert loaded.load(path) == 2
+        assert loaded.lemmas == cache.lemmas
+        assert loaded.lemmatize('judges', 'n') == 'judge' and loaded.info()['hits'] == 1
+        assert LemmaCache().load(tmpdir.join('missing.json').strpath) == 0
+        with open(path, 'w') as f:
+            f.write('{')
+        assert LemmaCache().load(path) == 0
+
+    @staticmethod
+    def test_new_entries(cache):
+        cache.lemmatize('courts', 'n')
+        assert cache.new_entries() == []
+        cache.track = True
+        cache.lemmatize('courts', 'n')
+        cache.lemmatize('judges', 'n')
+        assert cache.new_entries() == [('judges', 'n', 'judge')]
+        assert cache.new_entries() == []
+        other = LemmaCache(lemmatize=lemmatize)
+        other.update([('judges', 'n', 'judge')])
+        assert other.lemmas == {('judges', 'n'): 'judge'}
+
+
+class TestConfigureLemmas:
+    @staticmethod
+    def test_configure(tmpdir):
+        path = tmpdir.join('lemmas.json').strpath
+        with open(path, 'w') as f:
+            json.dump([['courts', 'n', 'court'], ['judges', 'n', 'judge'], ['rights', 'n', 'right']], f)
+        with patch('nlp.resources.LEMMAS', LemmaCache(lemmatize=lemmatize)):
+            lemmas = resources.configure_lemmas(2, path)
+            assert lemmas is resources.LEMMAS and lemmas.track
+            assert list(lemmas.lemmas) == [('judges', 'n'), ('rights', 'n')]
+            assert resources.lemmatize('rights', 'n') == 'right'
+            assert lemmas.info()['hits'] == 1
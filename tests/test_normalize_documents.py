@@ -0,0 +1,112 @@
+from mock import patch
+from rich.console import Console
+import io
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from echr.steps.normalize_documents import run, normalize_document
+from nlp import resources
+from nlp.resources import LemmaCache
+
+
+DOCUMENTS = {
+    '001-1': 'The applicant complained about the length of the proceedings',
+    '001-2': 'The Court dismissed the complaint',
+    '001-3': '',
+}
+NGRAMS = {1: 1, 2: 1}
+
+
+def prepare_text(text, lemmatization=True):
+    return [(resources.lemmatize(t.lower(), 'n'), 'n') for t in text.split() if len(t) > 3]
+
+
+class Lemmatizer:
+    @staticmethod
+    def lemmatize(token, tag):
+        return token[:-1] if token.endswith('s') else token
+
+
+@pytest.fixture
+def build(tmpdir):
+    os.makedirs(tmpdir.join('raw', 'preprocessed_documents').strpath)
+    for doc_id, text in DOCUMENTS.items():
+        with open(tmpdir.join('raw', 'preprocessed_documents', '{}_text_without_conclusion.txt'.format(doc_id)).strpath,
+                  'w') as f:
+            f.write(text)
+    lemmas = LemmaCache()
+    with patch('echr.steps.normalize_documents.prepareText', side_effect=prepare_text), \
+            patch('echr.steps.normalize_documents.config', return_value={'steps': {'normalize': {
+                'ngrams': NGRAMS, 'lemmas': {'file': tmpdir.join('lemmas.json').strpath}}}}), \
+            patch('nlp.resources.lemmatizer', return_value=Lemmatizer()), \
+            patch('nlp.resources.LEMMAS', lemmas), patch('echr.steps.normalize_documents.LEMMAS', lemmas):
+        yield tmpdir
+
+
+def read_output(build):
+    folder = build.join('raw', 'normalized_documents')
+    with open(folder.join('full_dictionary.txt').strpath) as f:
+        dictionary = json.load(f)
+    documents = {}
+    for doc_id in DOCUMENTS:
+        with open(folder.join('{}_normalized.txt'.format(doc_id)).strpath) as f:
+            documents[doc_id] = f.read()
+    return dictionary, documents
+
+
+class TestNormalizeDocuments:
+    @staticmethod
+    def test_normalize_document(build):
+        output_folder = build.join('raw', 'normalized_documents').strpath
+        os.makedirs(output_folder)
+        path = build.join('raw', 'preprocessed_documents', '001-2_text_without_conclusion.txt').strpath
+        res = normalize_document(path, output_folder, NGRAMS, force=True)
+        assert res['status'] == 'normalized'
+        grams = ['court', 'dismissed', 'complaint', 'court_dismissed', 'dismissed_complaint']
+        assert res['tokens'] == grams[:3]
+        with open(os.path.join(output_folder, '001-2_normalized.txt')) as f:
+            assert f.read().split() == grams
+
+        res = normalize_document(path, output_folder, NGRAMS, force=True, update=True)
+        assert res['status'] == 'skipped' and res['grams'] == grams
+
+        res = normalize_document(path, output_folder, {1: 1, 2: 2}, force=True)
+        assert res['tokens'] == [] and res['grams'] == grams[:3]
+
+        res = normalize_document(path + '.missing', output_folder, NGRAMS, force=True)
+        assert res['status'] == 'failed' and res['tokens'] == res['grams'] == []
+
+    @staticmethod
+    def test_workers(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test', force=True)
+        expected = read_output(build)
+        assert expected[0]['court'] == 1 and expected[0]['proceeding'] == 1
+        assert expected[1]['001-3'] == ''
+        if multiprocessing.get_start_method() != 'fork':
+            pytest.skip('the workers only inherit the patched NLP functions when forked')
+        run(Console(file=io.StringIO()), build.strpath, 'test', force=True, workers=2)
+        assert read_output(build) == expected
+
+    @staticmethod
+    def test_update(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test', force=True)
+        expected = read_output(build)
+        with patch('echr.steps.normalize_documents.normalized_step') as normalized_step:
+            run(Console(file=io.StringIO()), build.strpath, 'test', update=True)
+            normalized_step.assert_not_called()
+        assert read_output(build) == expected
+
+    @staticmethod
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_lemma_file(build, workers):
+        if workers > 1 and multiprocessing.get_start_method() != 'fork':
+            pytest.skip('the workers only inherit the patched NLP functions when forked')
+        console = Console(file=io.StringIO())
+        run(console, build.strpath, 'test', force=True, workers=workers)
+        with open(build.join('lemmas.json').strpath) as f:
+            lemmas = {(t, tag): l for t, tag, l in json.load(f)}
+        assert lemmas[('proceedings', 'n')] == 'proceeding' and len(lemmas) == 12
+        assert '0 hits, 8 misses' in console.file.getvalue()
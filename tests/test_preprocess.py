@@ -1,9 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
 from mock import patch
+from rich.console import Console
 from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
 import pytest
+import io
 import json
+import os
+import shutil
+import sys
 
-from echr.steps.preprocess_documents import para_to_text, json_table_to_text, parse_document
+from echr.utils.case_store import write_cases
+from echr.steps.preprocess_documents import para_to_text, json_table_to_text, parse_document, run, \
+    strip_smart_tags, update_docx, tag_elements, internal_section_reference, new_tagging_stats, select_parser, \
+    stream_document, parse_tree, build_tree, docx_elements, Node, tree_to_json, json_to_text
 
 
 class TestPreprocessWord:
@@ -48,6 +58,117 @@ class TestPreprocessWord:
         assert any([p != prepare['expected'][i] for i, p in enumerate(prepare['broken'])])
 
 
+class TestUpdateDocx:
+    @staticmethod
+    def test_smart_tags_removed():
+        doc = Document(update_docx('tests/data/judgments/001-83979.docx'))
+        expected_doc = Document('tests/data/judgments/001-83979_without_smarttags.docx')
+        paragraphs = [p.text for p in doc.paragraphs if p.text]
+        expected_paragraphs = [p.text for p in expected_doc.paragraphs if p.text]
+        assert paragraphs == expected_paragraphs
+
+    @staticmethod
+    @pytest.mark.parametrize('chunk_size', [1, 7, 1 << 16])
+    def test_strip_smart_tags_chunks(chunk_size):
+        xml = b'<w:p><w:smartTag w:uri="urn" w:element="place"><w:smartTagPr><w:attr w:name="a" w:val="b"/>' \
+              b'</w:smartTagPr><w:r><w:t>Strasbourg</w:t></w:r></w:smartTag><w:smartTagPr/></w:p>'
+        chunks = [xml[i:i + chunk_size] for i in range(0, len(xml), chunk_size)]
+        assert b''.join(strip_smart_tags(chunks)) == b'<w:p><w:r><w:t>Strasbourg</w:t></w:r></w:p>'
+
+    @staticmethod
+    @pytest.mark.parametrize('chunk_size', [1, 2, 5, 7, 1 << 16])
+    def test_strip_smart_tags_unescaped_gt(chunk_size):
+        # '>' is allowed in the text, in the attribute values, in comments and in CDATA sections
+        xml = b'<w:p><w:smartTag w:uri="a>b" w:element=\'c>d\'><w:r><w:t>x > y</w:t></w:r></w:smartTag>' \
+              b'<!-- <w:smartTag> --><![CDATA[<w:smartTagPr>]]><w:smartTag\nw:element="place"/></w:p>'
+        chunks = [xml[i:i + chunk_size] for i in range(0, len(xml), chunk_size)]
+        assert b''.join(strip_smart_tags(chunks)) == \
+            b'<w:p><w:r><w:t>x > y</w:t></w:r><!-- <w:smartTag> --><![CDATA[<w:smartTagPr>]]></w:p>'
+
+    @staticmethod
+    def test_document_without_smart_tags():
+        file = 'tests/data/judgments/001-83979_without_smarttags.docx'
+        with open(file, 'rb') as f:
+            assert update_docx(file).getvalue() == f.read()
+
+    @staticmethod
+    def test_concurrent_calls():
+        file = 'tests/data/judgments/001-83979.docx'
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: update_docx(file).getvalue(), range(8)))
+        assert all(r == results[0] for r in results)
+
+
+class TestTagElements:
+    @staticmethod
+    def naive_tag(content):
+        for section_reference, values in internal_section_reference.items():
+            if any(content.strip().upper().startswith(v.upper()) for v in values):
+                return section_reference
+        return None
+
+    @staticmethod
+    def test_same_as_naive_tagging():
+        values = [v for values in internal_section_reference.values() for v in values]
+        contents = values + [v.lower() + ' of the case' for v in values] + [' ' + v[:-1] for v in values] + \
+            ['', 'Nothing', 'THE LAW', 'AS TO THE LAW', 'FOR THESE REASONS, THE COURT UNANIMOUSLY']
+        parsed = {'elements': [{'content': c, 'elements': []} for c in contents]}
+        stats = new_tagging_stats()
+        tag_elements(parsed, stats)
+        for e in parsed['elements']:
+            assert e.get('section_name') == TestTagElements.naive_tag(e['content'])
+        assert stats['tagged'] + stats['untagged'] == len(contents)
+        assert stats['tagged'] == len([e for e in parsed['elements'] if 'section_name' in e])
+
+
+class TestTree:
+    @staticmethod
+    def test_node_slots():
+        with pytest.raises(AttributeError):
+            Node().extra = None
+
+    @staticmethod
+    def test_tree_to_json():
+        root = Node()
+        title = Node(parent=root, level=1, content='THE FACTS')
+        root.elements.append(title)
+        title.elements.append(Node(parent=title, level=5, content='table-0', node_type='table'))
+        title.elements.append(Node(parent=title, level=5, content='1. Text'))
+        assert tree_to_json(root) == {'content': None, 'elements': [
+            {'content': 'THE FACTS', 'elements': [
+                {'content': 'table-0', 'elements': [], 'type': 'table'},
+                {'content': '1. Text', 'elements': []}
+            ]}
+        ]}
+
+    @staticmethod
+    def test_deep_tree():
+        depth = 10 * sys.getrecursionlimit()
+        root = node = Node()
+        for i in range(depth):
+            node.elements.append(Node(parent=node, level=i + 1, content='{}. line {}'.format(i, i)))
+            node = node.elements[0]
+        doc = tree_to_json(root)
+        text = json_to_text(doc)
+        assert text == 'line {}'.format(depth - 1)
+
+    @staticmethod
+    def test_json_to_text_order():
+        doc = {'elements': [
+            {'content': 'THE FACTS', 'section_name': 'facts', 'elements': [
+                {'content': '1. First', 'elements': []},
+                {'content': 'table-0', 'type': 'table', 'elements': []},
+            ]},
+            {'content': 'THE LAW', 'section_name': 'law', 'elements': [
+                {'content': '2. Second', 'elements': []}
+            ]},
+            {'content': '3. Third', 'elements': []}
+        ]}
+        attachments = {'table-0': [{'a': 1}]}
+        assert json_to_text(doc, attachments=attachments) == 'First\na\n1\n\nSecond\nThird'
+        assert json_to_text(doc, except_section=['law']) == 'First\ntable-0\nThird'
+
+
 class TestProcessTableAttachment:
     @staticmethod
     def test_json_table_to_text_emtpy():
@@ -189,3 +310,131 @@ class TestParseDecisionBody:
                 parsed, _, _ = parse_document(prep['docs'][i], prep['doc_ids'][i], prep['build'])
                 res = parsed['decision_body']
                 assert res == prep['output'][i]
+
+
+class TestDocxBackends:
+    @staticmethod
+    @pytest.fixture
+    def judges():
+        with patch('echr.steps.preprocess_documents.load_judges_info') as judges, open(
+                'tests/data/judges_per_country.json', 'r') as f:
+            judges.return_value = json.load(f)
+            yield judges
+
+    @staticmethod
+    def read_both(docx):
+        doc = Document(update_docx(docx))
+        return (select_parser(doc), build_tree(docx_elements(doc))), stream_document(update_docx(docx))
+
+    @staticmethod
+    @pytest.mark.parametrize('doc_id', ['001-175180', '001-176769', '001-177299', '001-83979'])
+    def test_same_output(judges, doc_id):
+        doc = Document(update_docx('tests/data/judgments/{}.docx'.format(doc_id)))
+        expected = parse_document(doc, doc_id, './build/echr_database/')
+        parser, tree, error = stream_document(update_docx('tests/data/judgments/{}.docx'.format(doc_id)))
+        assert error is None
+        assert parser == select_parser(doc)
+        assert parse_tree(*tree, doc_id, './build/echr_database/') == expected
+
+    @staticmethod
+    def test_text_and_styles(tmpdir):
+        doc = Document()
+        doc.styles.add_style('Ju_H_Head', WD_STYLE_TYPE.PARAGRAPH)
+        doc.add_paragraph('THE FACTS', style='Ju_H_Head')
+        p = doc.add_paragraph('First', style='Normal')
+        p.add_run().add_tab()
+        p.add_run('second').add_break()
+        doc.add_paragraph('')
+        doc.add_table(rows=2, cols=2).cell(1, 0).text = 'cell'
+        doc.add_paragraph('Unknown style')._p.get_or_add_pPr().get_or_add_pStyle().val = 'Unknown'
+        doc.save(tmpdir.join('doc.docx').strpath)
+
+        expected, streamed = TestDocxBackends.read_both(tmpdir.join('doc.docx').strpath)
+        assert streamed[0] == expected[0] == 'NEW'
+        root, expected_attachments, _ = expected[1]
+        streamed_root, attachments, _ = streamed[1]
+        assert attachments == expected_attachments
+        assert [e.content for e in streamed_root.elements[0].elements] == [e.content for e in root.elements[0].elements]
+        # The section properties at the end of the body repeat the last paragraph
+        assert [e.content for e in root.elements[0].elements] == ['First\tsecond', 'table-0', 'Unknown style',
+                                                                   'Unknown style']
+
+    @staticmethod
+    def test_table_before_paragraphs(tmpdir):
+        doc = Document()
+        doc.element.body.remove_all()
+        doc.add_table(rows=1, cols=1)
+        doc.add_paragraph('Text')
+        doc.save(tmpdir.join('doc.docx').strpath)
+        doc = Document(tmpdir.join('doc.docx').strpath)
+        with pytest.raises(NameError):
+            build_tree(docx_elements(doc))
+        parser, tree, error = stream_document(update_docx(tmpdir.join('doc.docx').strpath))
+        assert parser == select_parser(doc) and tree is None and isinstance(error, NameError)
+
+
+class TestPreprocessRun:
+    @staticmethod
+    @pytest.fixture
+    def build(tmpdir):
+        doc_ids = ['001-175180', '001-176769', '001-177299', '001-83979']
+        os.makedirs(tmpdir.join('raw', 'judgments').strpath)
+        os.makedirs(tmpdir.join('raw', 'cases_info').strpath)
+        os.makedirs(tmpdir.join('logs').strpath)
+        for doc_id in doc_ids:
+            shutil.copy('tests/data/judgments/{}.docx'.format(doc_id), tmpdir.join('raw', 'judgments').strpath)
+        shutil.copy('tests/data/judges_per_country.json', tmpdir.join('raw').strpath)
+        # The last document is not in the case information
+        write_cases(tmpdir.join('raw', 'cases_info').strpath, [{'itemid': i, 'docname': i} for i in doc_ids[:-1]])
+        return tmpdir
+
+    @staticmethod
+    def outputs(build):
+        folder = build.join('raw', 'preprocessed_documents').strpath
+        res = {}
+        for f in sorted(os.listdir(folder)):
+            with open(os.path.join(folder, f), 'r') as content:
+                res[f] = content.read()
+        return res
+
+    @staticmethod
+    def test_workers(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test', workers=1)
+        serial = TestPreprocessRun.outputs(build)
+        assert len(serial) == 6
+
+        console = Console(file=io.StringIO(), record=True)
+        run(console, build.strpath, 'test', force=True, workers=2)
+        assert TestPreprocessRun.outputs(build) == serial
+        output = console.export_text()
+        assert 'Correctly parsed: 3/4' in output
+        assert '001-83979' in output
+
+    @staticmethod
+    def test_lxml_backend(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test')
+        expected = TestPreprocessRun.outputs(build)
+        run(Console(file=io.StringIO()), build.strpath, 'test', force=True, workers=2, backend='lxml')
+        assert TestPreprocessRun.outputs(build) == expected
+
+    @staticmethod
+    def test_retag(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test')
+        expected = TestPreprocessRun.outputs(build)
+        folder = build.join('raw', 'preprocessed_documents').strpath
+        for f in os.listdir(folder):
+            if f.endswith('_parsed.json'):
+                with open(os.path.join(folder, f), 'r') as content:
+                    parsed = json.load(content)
+                for elements in parsed['content'].values():
+                    for e in elements:
+                        e['section_name'] = 'unknown'
+                with open(os.path.join(folder, f), 'w') as content:
+                    json.dump(parsed, content)
+            else:
+                os.remove(os.path.join(folder, f))
+
+        console = Console(file=io.StringIO(), record=True)
+        run(console, build.strpath, 'test', retag=True)
+        assert TestPreprocessRun.outputs(build) == expected
+        assert 'Top-level elements tagged' in console.export_text()
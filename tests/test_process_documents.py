@@ -0,0 +1,97 @@
+from mock import patch
+from rich.console import Console
+import io
+import json
+import os
+
+from gensim import corpora, models
+from scipy import sparse
+import numpy as np
+import pytest
+
+from echr.steps.process_documents import run, BOW_MATRIX, TFIDF_MATRIX, ROW_INDEX
+from echr.utils.case_store import write_cases
+
+DOCUMENTS = {
+    '001-1': 'applicant complain length proceeding applicant_complain court court',
+    '001-2': 'court dismiss complaint court_dismiss',
+    '001-3': 'applicant lodge application court',
+    '001-4': '',
+}
+
+
+@pytest.fixture
+def build(tmpdir):
+    os.makedirs(tmpdir.join('raw', 'cases_info').strpath)
+    os.makedirs(tmpdir.join('raw', 'normalized_documents').strpath)
+    write_cases(tmpdir.join('raw', 'cases_info').strpath, [{'itemid': k} for k in DOCUMENTS])
+    for doc_id, text in DOCUMENTS.items():
+        with open(tmpdir.join('raw', 'normalized_documents', '{}_normalized.txt'.format(doc_id)).strpath, 'w') as f:
+            f.write(text)
+    with patch('echr.steps.process_documents.config', return_value={'steps': {'normalize': {'ngrams': {1: 1}}}}):
+        yield tmpdir
+
+
+def read_text(path):
+    with open(path) as f:
+        return [(int(e.split(':')[0]), float(e.split(':')[1])) for e in f.read().split()]
+
+
+class TestProcessDocuments:
+    @staticmethod
+    def test_matrices(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test', limit_tokens=8, force=True)
+        folder = build.join('structured')
+        with open(folder.join(ROW_INDEX).strpath) as f:
+            itemids = json.load(f)
+        assert sorted(itemids) == sorted(DOCUMENTS)
+        dictionary = corpora.Dictionary.load(folder.join('dictionary.dict').strpath)
+        assert len(dictionary) == 8
+        corpus = [dictionary.doc2bow(DOCUMENTS[i].split()) for i in itemids]
+        tfidf = models.TfidfModel(corpus)
+
+        bow_matrix = sparse.load_npz(folder.join(BOW_MATRIX).strpath)
+        tfidf_matrix = sparse.load_npz(folder.join(TFIDF_MATRIX).strpath)
+        assert bow_matrix.shape == tfidf_matrix.shape == (4, 8)
+        for i, doc_id in enumerate(itemids):
+            row = bow_matrix.getrow(i)
+            assert list(zip(row.indices.tolist(), row.data.tolist())) == corpus[i]
+            assert read_text(folder.join('bow', '{}_bow.txt'.format(doc_id)).strpath) == corpus[i]
+            expected = tfidf[corpus[i]]
+            row = tfidf_matrix.getrow(i)
+            assert row.indices.tolist() == [f for f, _ in expected]
+            assert np.allclose(row.data, [v for _, v in expected])
+            text = read_text(folder.join('tfidf', '{}_tfidf.txt'.format(doc_id)).strpath)
+            assert [f for f, _ in text] == [f for f, _ in expected]
+            assert np.allclose([v for _, v in text], [v for _, v in expected])
+
+    @staticmethod
+    def test_without_text_files(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test', limit_tokens=8, force=True, export_text_files=False)
+        assert os.listdir(build.join('structured', 'bow').strpath) == []
+        assert os.listdir(build.join('structured', 'tfidf').strpath) == []
+        assert sparse.load_npz(build.join('structured', BOW_MATRIX).strpath).shape == (4, 8)
+
+    @staticmethod
+    def test_approximate_vocabulary(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test', limit_tokens=2, force=True)
+        folder = build.join('structured')
+        expected = sparse.load_npz(folder.join(BOW_MATRIX).strpath)
+        with open(folder.join('feature_to_id.dict').strpath) as f:
+            expected_features = json.load(f)
+        run(Console(file=io.StringIO()), build.strpath, 'test', limit_tokens=2, force=True, vocabulary='approximate')
+        with open(folder.join('feature_to_id.dict').strpath) as f:
+            assert json.load(f) == expected_features == {'applicant': 0, 'court': 1}
+        assert (sparse.load_npz(folder.join(BOW_MATRIX).strpath) != expected).nnz == 0
+
+    @staticmethod
+    def test_hashing_vocabulary(build):
+        run(Console(file=io.StringIO()), build.strpath, 'test', limit_tokens=16, force=True, vocabulary='hashing')
+        folder = build.join('structured')
+        bow = sparse.load_npz(folder.join(BOW_MATRIX).strpath)
+        with open(folder.join(ROW_INDEX).strpath) as f:
+            itemids = json.load(f)
+        assert bow.shape == (4, 16)
+        assert bow.sum(axis=1).ravel().tolist() == [[len(DOCUMENTS[i].split()) for i in itemids]]
+        with pytest.raises(ValueError):
+            run(Console(file=io.StringIO()), build.strpath, 'test', limit_tokens=16, vocabulary='unknown')
@@ -0,0 +1,94 @@
+import os
+import time
+import yaml
+import pytest
+from rich.console import Console
+
+from echr.utils.build import parse_workflow
+from echr.utils.scheduler import paths_overlap, build_dependencies, run_workflow
+
+WORKFLOW_PATH = './workflows'
+ACTION_PATH = os.path.join(WORKFLOW_PATH, 'actions')
+
+
+def load(workflow):
+    with open(os.path.join(WORKFLOW_PATH, '{}.yml'.format(workflow))) as f:
+        steps = yaml.safe_load(f)
+    return parse_workflow(Console(), [], steps, WORKFLOW_PATH, ACTION_PATH)
+
+
+def sleep_step(i, duration, rc):
+    time.sleep(duration)
+    return {'rc': rc, 'output': '', 'delta': None, 'end': time.time(), 'index': i}
+
+
+class TestPathsOverlap:
+    @staticmethod
+    @pytest.mark.parametrize("a,b,expected", [('raw', 'raw/judgments', True),
+                                              ('raw/judgments', 'raw/judgments/', True),
+                                              ('./raw/judgments', 'raw/judgments', True),
+                                              ('raw/judgments', 'raw/judgments.zip', False),
+                                              ('structured/bow', 'structured/tfidf', False),
+                                              ('raw/cases_info', 'raw/raw_cases_info', False)])
+    def test_paths_overlap(a, b, expected):
+        assert paths_overlap(a, b) == expected
+
+
+class TestDependencies:
+    @staticmethod
+    def test_all_actions_declared():
+        actions = [f for f in os.listdir(ACTION_PATH) if f.endswith('.yml')]
+        for a in actions:
+            with open(os.path.join(ACTION_PATH, a)) as f:
+                action = yaml.safe_load(f)
+            if action['run'] != 'echr.steps.deploy':
+                assert 'inputs' in action and 'outputs' in action, a
+
+    @staticmethod
+    def test_independent_steps():
+        steps = load('local')
+        names = [s['run'].split('.')[-1] for s in steps]
+        deps = build_dependencies(steps)
+
+        def depends(a, b):
+            return names.index(b) in deps[names.index(a)]
+
+        assert not depends('cases_info', 'format_judges')
+        assert depends('filter', 'cases_info')
+        assert depends('preprocess_documents', 'format_judges')
+        assert depends('process_documents', 'normalize_documents')
+        assert not depends('prepare_database', 'normalize_documents')
+        assert not depends('prepare_database', 'process_documents')
+        assert not depends('generate_sqlite', 'process_documents')
+        assert not depends('generate_sqlite', 'generate_datasets')
+        assert all(depends('archive', n) for n in names[:names.index('archive')] if n != 'generate_datasets')
+
+    @staticmethod
+    def test_undeclared_step_is_barrier():
+        steps = load('release')
+        deps = build_dependencies(steps)
+        assert deps[-1] == set(range(len(steps) - 1))
+
+
+class TestRunWorkflow:
+    @staticmethod
+    def test_parallel_execution():
+        steps = [{'inputs': [], 'outputs': ['a']},
+                 {'inputs': [], 'outputs': ['b']},
+                 {'inputs': ['a', 'b'], 'outputs': ['c']}]
+        results = {}
+        failed = run_workflow(steps, 2, lambda i: (sleep_step, (i, 0.5 if i < 2 else 0, 0)),
+                              on_done=lambda i, r: results.update({i: r}))
+        assert failed == []
+        assert results[2]['end'] >= max(results[0]['end'], results[1]['end'])
+        assert abs(results[0]['end'] - results[1]['end']) < 0.4
+
+    @staticmethod
+    def test_failure_cancels_remaining_steps():
+        steps = [{'inputs': [], 'outputs': ['a']},
+                 {'inputs': ['a'], 'outputs': ['b']}]
+        results = {}
+        failed = run_workflow(steps, 2, lambda i: (sleep_step, (i, 0, 1 if i == 0 else 0)),
+                              on_done=lambda i, r: results.update({i: r}))
+        assert failed == [0]
+        assert 1 not in results
@@ -0,0 +1,98 @@
+from mock import patch
+import json
+import math
+
+import numpy as np
+import pytest
+
+from echr.utils import serializer
+
+
+DATA = {
+    'itemid': '001-175180',
+    'docname': 'CASE OF ÇAKIR v. TURKEY',
+    'article': ['6', '6-1'],
+    'score': 0.1,
+    'count': 3,
+    'nested': {'b': [], 'a': {}, 'c': [{'z': None, 'y': True}]},
+}
+
+
+class TestSerializer:
+    @staticmethod
+    @pytest.fixture(params=['orjson', 'json'])
+    def backend(request):
+        if request.param == 'orjson' and serializer.orjson is None:
+            pytest.skip('orjson is not installed')
+        return request.param
+
+    @staticmethod
+    @pytest.mark.parametrize('pretty', [True, False])
+    def test_same_output_for_both_backends(pretty):
+        if serializer.orjson is None:
+            pytest.skip('orjson is not installed')
+        for sort_keys in [True, False]:
+            assert serializer.dumps(DATA, pretty=pretty, sort_keys=sort_keys, backend='orjson') == \
+                serializer.dumps(DATA, pretty=pretty, sort_keys=sort_keys, backend='json')
+
+    @staticmethod
+    def test_formats(backend):
+        pretty = serializer.dumps({'b': 1, 'a': [1]}, pretty=True, sort_keys=True, backend=backend)
+        assert pretty == b'{\n  "a": [\n    1\n  ],\n  "b": 1\n}'
+        compact = serializer.dumps({'b': 1, 'a': [1]}, pretty=False, backend=backend)
+        assert compact == b'{"b":1,"a":[1]}'
+
+    @staticmethod
+    def test_round_trip(backend, tmpdir):
+        path = tmpdir.join('data.json').strpath
+        serializer.dump(DATA, path, sort_keys=True, backend=backend)
+        assert serializer.load(path, backend=backend) == DATA
+        with open(path, 'r', encoding='utf-8') as f:
+            assert json.load(f) == DATA
+
+    @staticmethod
+    def test_non_str_keys_and_numpy(backend):
+        data = {1: np.int64(2), 'a': np.float64(0.5), 'b': np.float32(0.25), 'c': np.array([[1, 2]])}
+        assert serializer.dumps(data, pretty=False, backend=backend) == b'{"1":2,"a":0.5,"b":0.25,"c":[[1,2]]}'
+
+    @staticmethod
+    def test_non_finite_values(backend):
+        data = {'a': float('nan'), 'b': [1.0, float('inf')], 'c': np.array([np.nan, 1.0]), 'd': np.float32(-np.inf)}
+        assert serializer.dumps(data, pretty=False, backend=backend) == \
+            b'{"a":null,"b":[1.0,null],"c":[null,1.0],"d":null}'
+
+    @staticmethod
+    def test_unsupported_types(backend):
+        with pytest.raises(TypeError):
+            serializer.dumps({'a': object()}, backend=backend)
+
+    @staticmethod
+    def test_load_nan(tmpdir):
+        path = tmpdir.join('data.json').strpath
+        with open(path, 'w') as f:
+            json.dump({'a': float('nan')}, f)
+        assert math.isnan(serializer.load(path)['a'])
+
+    @staticmethod
+    @pytest.mark.parametrize('settings,pretty', [
+        ({}, True),
+        ({'format': 'pretty'}, True),
+        ({'format': 'compact'}, False),
+    ])
+    def test_configured_format(settings, pretty):
+        with patch('echr.utils.serializer.config', return_value={'serialization': settings}):
+            assert serializer.dumps({'a': 1}) == serializer.dumps({'a': 1}, pretty=pretty)
+
+    @staticmethod
+    def test_invalid_configuration():
+        with patch('echr.utils.serializer.config', return_value={'serialization': {'format': 'unknown'}}):
+            with pytest.raises(ValueError):
+                serializer.dumps({'a': 1})
+
+    @staticmethod
+    def test_fallback_without_orjson():
+        with patch('echr.utils.serializer.orjson', None):
+            assert serializer.dumps({'a': 1}, pretty=False) == b'{"a":1}'
+            assert serializer.loads(b'{"a":1}') == {'a': 1}
+            with pytest.raises(ImportError):
+                serializer.dumps({'a': 1}, backend='orjson')
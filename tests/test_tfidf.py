@@ -0,0 +1,49 @@
+from gensim import matutils, models
+from scipy import sparse
+import numpy as np
+import pytest
+
+from nlp.tfidf import tfidf, document_frequencies, idf_weights
+
+
+def random_bow(num_docs, num_terms, seed=0):
+    rng = np.random.default_rng(seed)
+    bow = sparse.random(num_docs, num_terms, density=0.1, format='lil', random_state=seed,
+                        data_rvs=lambda n: rng.integers(1, 20, n)).astype(np.int32)
+    bow[3] = 0
+    bow[:, 1] = 2
+    bow = bow.tocsr()
+    bow.eliminate_zeros()
+    return bow
+
+
+def gensim_tfidf(bow):
+    corpus = matutils.Sparse2Corpus(bow, documents_columns=False)
+    model = models.TfidfModel(corpus)
+    return [model[doc] for doc in corpus]
+
+
+class TestTfidf:
+    @staticmethod
+    def test_idf():
+        bow = sparse.csr_matrix(np.array([[1, 0, 2], [0, 0, 1], [3, 0, 0], [1, 0, 0]]))
+        dfs = document_frequencies(bow)
+        assert dfs.tolist() == [3, 0, 2]
+        assert np.allclose(idf_weights(dfs, 4), [np.log2(4 / 3), 0, 1])
+
+    @staticmethod
+    @pytest.mark.parametrize('workers,chunk_size', [(1, 4096), (1, 7), (3, 7)])
+    def test_same_as_gensim(workers, chunk_size):
+        bow = random_bow(50, 40)
+        res = tfidf(bow, workers=workers, chunk_size=chunk_size)
+        expected = gensim_tfidf(bow)
+        assert res.shape == bow.shape
+        for i, doc in enumerate(expected):
+            row = res.getrow(i)
+            assert row.indices.tolist() == [f for f, _ in doc]
+            assert np.allclose(row.data, [w for _, w in doc], rtol=1e-12, atol=0)
+        assert res.getrow(3).nnz == 0 and res.getcol(1).nnz == 0
+
+    @staticmethod
+    def test_empty():
+        assert tfidf(sparse.csr_matrix((0, 5), dtype=np.int32)).shape == (0, 5)
@@ -0,0 +1,57 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from nlp.topk import MisraGries, recall
+
+
+def zipf_documents(num_docs=200, length=300, vocabulary=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    return [['t{}'.format(i) for i in rng.zipf(1.3, length) % vocabulary] for _ in range(num_docs)]
+
+
+class TestMisraGries:
+    @staticmethod
+    def test_guarantee():
+        documents = zipf_documents()
+        exact = Counter()
+        summary = MisraGries(100)
+        for d in documents:
+            exact.update(d)
+            summary.update(d)
+        assert len(summary) <= 200 and summary.total == sum(exact.values())
+        summary.reduce()
+        assert len(summary) <= 100
+        bound = summary.error_bound()
+        for t, c in exact.items():
+            assert exact[t] - bound <= summary.counts.get(t, 0) <= exact[t]
+            if c > bound:
+                assert t in summary.counts
+
+    @staticmethod
+    def test_merge():
+        documents = zipf_documents(num_docs=20)
+        first, second, single = MisraGries(50), MisraGries(50), MisraGries(50)
+        for i, d in enumerate(documents):
+            (first if i % 2 else second).update(d)
+            single.update(d)
+        first.merge(second)
+        assert first.total == single.total
+        assert len(first.candidates()) <= 50
+
+    @staticmethod
+    def test_recall():
+        exact = Counter(t for d in zipf_documents() for t in d)
+        summary = MisraGries(500)
+        for d in zipf_documents():
+            summary.update(d)
+        top = [t for t, _ in exact.most_common(50)]
+        assert recall(top, summary.candidates()) == 1.
+        assert recall(['a', 'b'], ['b', 'c']) == 0.5
+        assert recall([], ['a']) == 1.
+
+    @staticmethod
+    def test_capacity():
+        with pytest.raises(ValueError):
+            MisraGries(0)